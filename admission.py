@@ -0,0 +1,176 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is shed. status_code is 429 when the wait queue is full and 503 when the
+    request waited its full time without getting a slot; retry_after is a whole number of seconds.
+    """
+
+    def __init__(self, reason: str, status_code: int, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def estimate_tokens(input_text: str, max_new_tokens: int, chars_per_token: float = 4.0) -> int:
+    """
+    Rough token cost of a generation: the prompt length in tokens, estimated from its characters,
+    plus the tokens it may generate. Cheap enough to run before the request is admitted.
+    """
+    return int(math.ceil(len(input_text) / chars_per_token)) + max(0, int(max_new_tokens))
+
+
+class AdmissionTicket:
+    """
+    A granted slot. release() is idempotent so it can be called from several cleanup paths.
+    """
+
+    def __init__(self, controller: "AdmissionController", cost: int):
+        self.controller = controller
+        self.cost = cost
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _Waiter:
+    """
+    A request waiting for a slot; ticket is set, under the controller's lock, when the slot is granted.
+    """
+
+    def __init__(self, cost: int, loop: asyncio.AbstractEventLoop):
+        self.cost = cost
+        self.loop = loop
+        self.future = loop.create_future()
+        self.ticket = None
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    """
+    Bounds the generations running at once by count and by estimated tokens in flight.
+
+    A request that does not fit waits in a FIFO queue of at most max_waiting requests for up to
+    max_wait_s; beyond that it is rejected with Overloaded instead of piling up behind the model.
+    Requests are admitted strictly in arrival order, so a large request is not starved by small ones;
+    a request costing more than the whole token budget is clamped to it and runs alone.
+    max_concurrent or token_budget of 0 disables that limit.
+
+    Waiting happens on the event loop, before any thread is taken, so a full queue is rejected at once.
+    Tickets may be released from any thread.
+    """
+
+    def __init__(self, max_concurrent: int, token_budget: int = 0, max_waiting: int = 16, max_wait_s: float = 10.0):
+        self.max_concurrent = max_concurrent
+        self.token_budget = token_budget
+        self.max_waiting = max_waiting
+        self.max_wait_s = max_wait_s
+        self._lock = threading.Lock()
+        self._waiting = deque()  # One _Waiter per waiting request, in arrival order
+        self.running = 0
+        self.tokens_in_flight = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._avg_hold_s = None  # Moving average of how long admitted requests keep their slot
+
+    def _fits_locked(self, cost: int) -> bool:
+        if self.max_concurrent and self.running >= self.max_concurrent:
+            return False
+        if self.token_budget and self.running and self.tokens_in_flight + cost > self.token_budget:
+            return False
+        return True
+
+    def _retry_after_locked(self) -> int:
+        # Time for the requests ahead to drain through the available slots
+        hold = self._avg_hold_s if self._avg_hold_s is not None else 1.0
+        slots = self.max_concurrent or max(1, self.running)
+        return max(1, int(math.ceil(hold * (len(self._waiting) + 1) / slots)))
+
+    async def acquire(self, cost: int = 0) -> AdmissionTicket:
+        """
+        Wait until a slot for a generation of cost estimated tokens is free and return its ticket.
+        Raises Overloaded right away if the wait queue is full, or once the slot has not freed up within max_wait_s.
+        """
+        if self.token_budget:
+            cost = min(cost, self.token_budget)
+        with self._lock:
+            if not self._waiting and self._fits_locked(cost):
+                return self._admit_locked(cost)
+            if len(self._waiting) >= self.max_waiting:
+                self.rejected_full += 1
+                raise Overloaded("Too many requests waiting for the model.", 429, self._retry_after_locked())
+            waiter = _Waiter(cost, asyncio.get_running_loop())
+            self._waiting.append(waiter)
+        try:
+            await asyncio.wait_for(waiter.future, self.max_wait_s)
+        except BaseException as e:
+            # Timed out or cancelled; the slot may still have been granted in the meantime
+            with self._lock:
+                if waiter.ticket is None:
+                    self._waiting.remove(waiter)
+                    # The next request in line may fit now that this one has left the queue
+                    self._grant_locked()
+                    if not isinstance(e, asyncio.TimeoutError):
+                        raise
+                    self.rejected_timeout += 1
+                    raise Overloaded(f"No generation slot freed up within {self.max_wait_s:g}s.", 503, self._retry_after_locked()) from None
+            if not isinstance(e, asyncio.TimeoutError):
+                waiter.ticket.release()
+                raise
+        return waiter.ticket
+
+    def _admit_locked(self, cost: int) -> AdmissionTicket:
+        self.running += 1
+        self.tokens_in_flight += cost
+        self.admitted += 1
+        return AdmissionTicket(self, cost)
+
+    def _grant_locked(self):
+        # Hand freed slots to the requests at the head of the queue, in order
+        while self._waiting and self._fits_locked(self._waiting[0].cost):
+            waiter = self._waiting.popleft()
+            waiter.ticket = self._admit_locked(waiter.cost)
+            waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+
+    def _release(self, ticket: AdmissionTicket):
+        held = time.monotonic() - ticket.admitted_at
+        with self._lock:
+            self.running -= 1
+            self.tokens_in_flight -= ticket.cost
+            self._avg_hold_s = held if self._avg_hold_s is None else 0.9 * self._avg_hold_s + 0.1 * held
+            self._grant_locked()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "token_budget": self.token_budget,
+                "max_waiting": self.max_waiting,
+                "running": self.running,
+                "waiting": len(self._waiting),
+                "tokens_in_flight": self.tokens_in_flight,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_full,
+                "rejected_timeout": self.rejected_timeout,
+                "avg_hold_seconds": round(self._avg_hold_s, 3) if self._avg_hold_s is not None else None,
+            }
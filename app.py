@@ -1,20 +1,105 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Any
+from typing import Optional, Any, Dict, List
 import os
+import asyncio
 import logging
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
-from huggingface_hub import login
 import threading
 import time
 import uuid
 import redis
+import redis.asyncio
+import json
+import socket
+import csv
+import io
+import re
+import hmac
 import httpx
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from starlette.background import BackgroundTask
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from admission import AdmissionController, Overloaded, estimate_tokens
+from batching import MicroBatcher, extract_generated_text, prepare_tokenizer_for_batching
+from engine import build_pipeline, engine_report
+from streaming import CancelOnEvent, TokenStream
+from transformers import StoppingCriteriaList
+from job_events import TERMINAL_STATUSES, JobEventHub
+from job_queue import LaneJobQueue
+from job_store import JobStore
+from metrics import (
+    ADMISSION_REJECTED,
+    MODEL_LOAD_SECONDS,
+    MODEL_LOADS,
+    QUEUE_DEPTH,
+    REQUEST_LATENCY,
+    CacheStatsCollector,
+    log_sampled,
+    observe_stage,
+    stage_timer,
+)
+from model_lifecycle import ModelLifecycle
+from model_registry import ModelRegistry
+from prefix_cache import PrefixCache
+from process_pool import InferencePool
+from profiling import ARTIFACTS, ProfileStore, RequestProfiler, StackSampler
+from result_archive import ResultArchive
+from result_cache import ResultCache, is_deterministic
+from speculative import SpeculativeDecoder
+from worker_registry import ThroughputMeter, WorkerHeartbeat, alist_workers, list_workers
+from supabase_rest import (
+    _quote,
+    aiter_inference_results,
+    async_supabase_client,
+    SUPABASE_KEY,
+    SUPABASE_RESULT_COLUMNS,
+    SUPABASE_URL,
+    SupabaseWriter,
+    delete_inference_result,
+    insert_inference_result,
+    select_inference_results,
+    supabase_http,
+    update_inference_result,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global redis_async, supabase_async
+    # Model loading runs in the background so the server accepts connections immediately; see /readyz
+    model_lifecycle.start()
+    # Long-polls subscribe before reading a job's status, which only holds once the subscription is confirmed
+    if not await asyncio.get_running_loop().run_in_executor(None, job_events.start, 5.0):
+        logger.warning("Job event subscription not confirmed yet; waiters will resync once it is.")
+    # Async clients are tied to the serving event loop, so they are created here rather than at import
+    redis_async = redis.asyncio.Redis(connection_pool=redis.asyncio.BlockingConnectionPool.from_url(
+        REDIS_URL, max_connections=REDIS_ASYNC_MAX_CONNECTIONS, timeout=REDIS_ASYNC_POOL_TIMEOUT_S))
+    job_store.use_async(redis_async)
+    job_queue.use_async(redis_async)
+    request_profiler.store.use_async(redis_async)
+    supabase_async = async_supabase_client()
+    yield
+    if job_worker_threads:
+        stop_job_workers()
+    if inference_pool is not None:
+        inference_pool.close()
+    for sink in result_sinks:
+        sink.close()
+    job_store.use_async(None)
+    job_queue.use_async(None)
+    request_profiler.store.use_async(None)
+    await redis_async.aclose()
+    if supabase_async is not None:
+        await supabase_async.aclose()
+    inference_executor.shutdown(wait=False, cancel_futures=True)
 
 app = FastAPI(
     title="NCOS Compliance LLM API",
     description="API contract for inference, health checks, and job queueing.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # --- Pydantic models for request/response ---
@@ -22,22 +107,56 @@ app = FastAPI(
 class InferRequest(BaseModel):
     input_text: str  # The text to run inference on
     parameters: Optional[dict] = None  # Optional model parameters (e.g., temperature, max_tokens)
+    profile: Optional[bool] = False  # Profile this request (needs the X-Profile-Token header); see GET /profiles
+
+class InferStreamRequest(InferRequest):
+    model_name: Optional[str] = None  # Optional model to stream from; defaults to the startup model
+
+class PrefixRequest(BaseModel):
+    prefix: str  # Prompt prefix shared by many requests, e.g. a policy/system preamble
+    model_name: Optional[str] = None  # Model to cache the prefix for; defaults to the startup model
 
 class InferResponse(BaseModel):
     result: str  # The model's output
     status: str  # 'success' or 'error'
     error: Optional[str] = None  # Error message if status is 'error'
+    profile_id: Optional[str] = None  # Id of the stored profile, if this request was profiled
 
 class QueueRequest(BaseModel):
     input_text: str  # The text to enqueue for inference
     parameters: Optional[dict] = None  # Optional model parameters
+    priority: Optional[str] = None  # Priority lane (see JOB_PRIORITY_LANES); defaults to JOB_DEFAULT_LANE
+    tenant: Optional[str] = None  # Tenant or test suite; jobs of different tenants in a lane are scheduled fairly
+    deadline_seconds: Optional[float] = None  # Drop the job unprocessed if it has not started within this many seconds
+    profile: Optional[bool] = False  # Profile the job under its job id (needs the X-Profile-Token header)
 
 class QueueResponse(BaseModel):
     job_id: str  # Unique job identifier
-    status: str  # 'queued', 'pending', 'done', or 'error'
+    status: str  # 'queued', 'running', 'done', 'error', 'cancelled', 'expired', or 'pending' if the job is unknown
+    result: Optional[str] = None  # Model output if available
+    error: Optional[str] = None  # Error message if status is 'error', 'cancelled' or 'expired'
+    position: Optional[int] = None  # Estimated number of jobs that will start before this one, while queued
+    estimated_wait_seconds: Optional[float] = None  # Estimated time until the job starts, while queued
+
+class QueueBatchRequest(BaseModel):
+    jobs: List[QueueRequest]  # Jobs to enqueue together
+
+class QueueBatchResponse(BaseModel):
+    job_ids: List[str]  # Job identifiers, in the order the jobs were submitted
+    status: str  # 'queued'
+
+class QueueStatusRequest(BaseModel):
+    job_ids: List[str]  # Job identifiers to look up
+    include_results: bool = True  # Set to False to return only statuses and errors
+
+class JobStatus(BaseModel):
+    status: str  # Same values as QueueResponse.status
     result: Optional[str] = None  # Model output if available
     error: Optional[str] = None  # Error message if status is 'error'
 
+class QueueStatusResponse(BaseModel):
+    statuses: Dict[str, JobStatus]  # Job ID -> status
+
 # --- Model Loading (Cloud-Ready) ---
 
 # Read model name and token from environment variables for security
@@ -49,211 +168,595 @@ HF_TOKEN = os.getenv("HF_TOKEN")  # Should be set in Hugging Face Space secrets
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("ncos-backend")
 
-# Login to Hugging Face Hub if token is provided
-if HF_TOKEN:
+def load_pipeline(model_name: str, path: str = None):
+    """
+    Load a tokenizer and causal LM and wrap them in a text-generation pipeline.
+    path is a local snapshot of model_name to load from; metrics and stats stay keyed by model_name.
+    The device (GPU if available, else CPU) and CPU optimizations are chosen by engine.py from the environment.
+    """
+    started = time.perf_counter()
     try:
-        login(token=HF_TOKEN)
-        logger.info("Logged in to Hugging Face Hub.")
-    except Exception as e:
-        logger.error(f"Failed to login to Hugging Face Hub: {e}")
-
-# Load model and tokenizer at startup
-try:
-    logger.info(f"Loading model: {MODEL_NAME}")
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForCausalLM.from_pretrained(MODEL_NAME)
-    # Use pipeline for simple inference
-    ncos_pipeline = pipeline("text-generation", model=model, tokenizer=tokenizer, device=0)
-    logger.info("Model and tokenizer loaded successfully.")
-except Exception as e:
-    logger.error(f"Model loading failed: {e}")
-    ncos_pipeline = None
+        pipe = build_pipeline(model_name, prepare_tokenizer=prepare_tokenizer_for_batching, path=path)
+    except Exception:
+        MODEL_LOADS.labels(model_name, "failure").inc()
+        raise
+    MODEL_LOADS.labels(model_name, "success").inc()
+    MODEL_LOAD_SECONDS.labels(model_name).observe(time.perf_counter() - started)
+    return pipe
+
+# The startup model is loaded in the background by model_lifecycle (see on_model_ready below);
+# until then ncos_pipeline is None and /readyz reports the loading phase.
+ncos_pipeline = None
+WARMUP_PROMPT = os.getenv("WARMUP_PROMPT", "Hello")
+WARMUP_MAX_NEW_TOKENS = int(os.getenv("WARMUP_MAX_NEW_TOKENS", "8"))  # 0 disables the warm-up generation
+
+# --- Micro-batching for /infer ---
+# Concurrent /infer calls are collected for up to INFER_BATCH_MAX_WAIT_MS and run as one padded batch.
+# Set INFER_BATCH_MAX_SIZE=1 to run every request on its own.
+INFER_BATCH_MAX_SIZE = int(os.getenv("INFER_BATCH_MAX_SIZE", "8"))
+INFER_BATCH_MAX_WAIT_MS = float(os.getenv("INFER_BATCH_MAX_WAIT_MS", "10"))
+infer_batcher = None
+
+# --- Inference Backend ---
+# 'thread' runs the startup model in this process, with /infer going through the micro-batcher.
+# 'process' forks INFERENCE_WORKERS processes that share the loaded weights through shared memory;
+# /infer and queued jobs for the startup model are spread across them. Each worker process keeps its
+# own prefix cache, so prefixes registered via POST /prefixes only apply to the in-process model.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "thread")
+INFERENCE_WORKER_THREADS = int(os.getenv("INFERENCE_WORKER_THREADS", "1"))  # Torch intra-op threads per worker process
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // max(1, INFERENCE_WORKER_THREADS))
+inference_pool = None
+
+# --- Admission Control ---
+# At most ADMISSION_MAX_CONCURRENT /infer and /infer/stream generations run at once, holding at most
+# ADMISSION_TOKEN_BUDGET estimated prompt + max_new_tokens tokens (0 = no token limit). Up to
+# ADMISSION_MAX_WAITING more wait up to ADMISSION_MAX_WAIT_S for a slot; the rest get 429, and requests
+# that time out get 503, both with Retry-After. Requests wait for a slot on the event loop, so only admitted
+# ones reach the inference executor; result cache hits are admitted too and give their slot back as soon as
+# they are answered. Queue consumers are bounded by JOB_WORKER_CONCURRENCY instead.
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", str(INFERENCE_WORKERS if INFERENCE_BACKEND == "process" else INFER_BATCH_MAX_SIZE)))
+ADMISSION_TOKEN_BUDGET = int(os.getenv("ADMISSION_TOKEN_BUDGET", "0"))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "32"))
+ADMISSION_MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", "10"))
+ADMISSION_CHARS_PER_TOKEN = float(os.getenv("ADMISSION_CHARS_PER_TOKEN", "4"))  # Used to estimate prompt tokens
+# POST /queue and /queue/batch are rejected with 503 while the queue holds more than QUEUE_MAX_DEPTH jobs
+# or would take more than QUEUE_MAX_DRAIN_S to drain at the current fleet throughput (0 = no limit).
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", "0"))
+QUEUE_MAX_DRAIN_S = float(os.getenv("QUEUE_MAX_DRAIN_S", "0"))
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENT,
+    token_budget=ADMISSION_TOKEN_BUDGET,
+    max_waiting=ADMISSION_MAX_WAITING,
+    max_wait_s=ADMISSION_MAX_WAIT_S,
+)
+
+# --- Inference Executor ---
+# Blocking model work of the HTTP endpoints (generating, loading a model for a stream or a prefix) runs on
+# this pool rather than on Starlette's shared threadpool, so endpoints that only talk to Redis or Supabase
+# never wait behind generations for a thread. Only admitted generations get here, so the default has room
+# for every admission slot plus two threads for model loads and prefix registration.
+INFERENCE_EXECUTOR_THREADS = int(os.getenv("INFERENCE_EXECUTOR_THREADS", "0")) or max(4, ADMISSION_MAX_CONCURRENT + 2)
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_EXECUTOR_THREADS, thread_name_prefix="inference")
 
 # --- Redis Connection ---
 # Use the provided Redis Cloud endpoint as the default for testing
 REDIS_URL = os.getenv("REDIS_URL", "redis://:password@redis-19567.c300.eu-central-1-1.ec2.redns.redis-cloud.com:19567/0")  # Set your Redis Cloud URL in env
-redis_client = redis.Redis.from_url(REDIS_URL)
+redis_client = redis.Redis.from_url(REDIS_URL)  # Worker threads, heartbeats and the job event listener
+# Queue, status and capacity endpoints use an asyncio client on a bounded pool, created in the lifespan.
+# Once all connections are in use, further calls wait up to REDIS_ASYNC_POOL_TIMEOUT_S for one to free up.
+REDIS_ASYNC_MAX_CONNECTIONS = int(os.getenv("REDIS_ASYNC_MAX_CONNECTIONS", "64"))
+REDIS_ASYNC_POOL_TIMEOUT_S = float(os.getenv("REDIS_ASYNC_POOL_TIMEOUT_S", "5"))
+redis_async = None
 
 # --- Job Queue Logic ---
+# Jobs live on a Redis Stream read through a consumer group; JOB_QUEUE is the old list-based queue,
+# which is drained into the stream at startup.
 JOB_QUEUE = "ncos_job_queue"
+JOB_STREAM = os.getenv("JOB_STREAM", "ncos_job_stream")  # Default lane/tenant; other lanes and tenants use JOB_STREAM:<lane>:<tenant>
+JOB_CONSUMER_GROUP = os.getenv("JOB_CONSUMER_GROUP", "ncos_workers")
 JOB_RESULT_PREFIX = "ncos_job_result:"
+# Consumer threads per process; with the process backend the default keeps every inference worker busy
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", str(INFERENCE_WORKERS) if INFERENCE_BACKEND == "process" else "1"))
+JOB_VISIBILITY_TIMEOUT_MS = int(os.getenv("JOB_VISIBILITY_TIMEOUT_MS", "300000"))  # Unacked jobs older than this are reclaimed
+JOB_MAX_DELIVERIES = int(os.getenv("JOB_MAX_DELIVERIES", "3"))  # Give up on a job after this many attempts
+JOB_QUEUE_BLOCK_MS = int(os.getenv("JOB_QUEUE_BLOCK_MS", "5000"))
+# Each job has a hash ncos_job:<id> with its status, timestamps, model and result; it expires after JOB_TTL_SECONDS.
+# Results of at least JOB_COMPRESS_MIN_BYTES are stored zlib-compressed.
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "604800"))
+JOB_COMPRESS_MIN_BYTES = int(os.getenv("JOB_COMPRESS_MIN_BYTES", "1024"))
+QUEUE_BATCH_MAX_JOBS = int(os.getenv("QUEUE_BATCH_MAX_JOBS", "1000"))  # Jobs per POST /queue/batch
+QUEUE_STATUS_MAX_IDS = int(os.getenv("QUEUE_STATUS_MAX_IDS", "1000"))  # Job ids per POST /queue/status
+# Priority lanes as name:weight, highest priority first. A lane's weight is its share of worker turns
+# relative to the other lanes with work; within a lane, tenants take turns evenly.
+JOB_PRIORITY_LANES = {
+    name.strip(): float(weight)
+    for name, weight in (lane.split(":") for lane in os.getenv("JOB_PRIORITY_LANES", "high:16,normal:4,low:1").split(","))
+}
+JOB_DEFAULT_LANE = os.getenv("JOB_DEFAULT_LANE", "normal")
+JOB_CANCEL_CHANNEL = "ncos_job_cancel"  # Pub/sub channel telling workers to stop a running job
+JOB_EVENTS_CHANNEL = "ncos_job_events"  # Pub/sub channel carrying every job status change
+QUEUE_LONG_POLL_MAX_S = float(os.getenv("QUEUE_LONG_POLL_MAX_S", "60"))  # Upper bound for GET /queue?wait=
+QUEUE_EVENTS_KEEPALIVE_S = float(os.getenv("QUEUE_EVENTS_KEEPALIVE_S", "15"))  # Comment sent on idle /queue/events streams
+job_queue = LaneJobQueue(
+    redis_client,
+    JOB_STREAM,
+    JOB_CONSUMER_GROUP,
+    lanes=JOB_PRIORITY_LANES,
+    default_lane=JOB_DEFAULT_LANE,
+    visibility_timeout_ms=JOB_VISIBILITY_TIMEOUT_MS,
+    max_deliveries=JOB_MAX_DELIVERIES,
+    block_ms=JOB_QUEUE_BLOCK_MS,
+)
+
+# --- Queue Consumers ---
+# API replicas can leave the queue to dedicated `python worker.py` processes by setting RUN_QUEUE_CONSUMERS=false.
+# Every process that consumes jobs publishes a heartbeat hash ncos_worker:<id> (see GET /workers).
+RUN_QUEUE_CONSUMERS = os.getenv("RUN_QUEUE_CONSUMERS", "true").lower() == "true"
+NCOS_PROCESS_ROLE = os.getenv("NCOS_PROCESS_ROLE", "api")  # 'api' or 'worker'; reported in heartbeats
+WORKER_HEARTBEAT_INTERVAL_S = float(os.getenv("WORKER_HEARTBEAT_INTERVAL_S", "5"))
+WORKER_HEARTBEAT_TTL_S = int(os.getenv("WORKER_HEARTBEAT_TTL_S", "30"))  # Workers missing heartbeats this long are dropped
+job_throughput = ThroughputMeter()
+job_workers_stopping = threading.Event()
+job_worker_threads = []
+worker_heartbeat = None
+running_jobs = {}  # job id -> Event set when the job is cancelled while running
+running_jobs_lock = threading.Lock()
+job_store = JobStore(
+    redis_client,
+    legacy_result_prefix=JOB_RESULT_PREFIX,
+    ttl_seconds=JOB_TTL_SECONDS,
+    compress_min_bytes=JOB_COMPRESS_MIN_BYTES,
+    events_channel=JOB_EVENTS_CHANNEL,
+)
+job_events = JobEventHub(redis_client, JOB_EVENTS_CHANNEL)
 
 # --- Model Cache ---
-model_cache = {"name": None, "pipeline": None}
+# Several models stay resident up to MODEL_CACHE_MAX_MB of weights; the least recently used is evicted first.
+# The startup model is pinned so jobs for it never trigger a reload.
+MODEL_CACHE_MAX_MB = int(os.getenv("MODEL_CACHE_MAX_MB", "16384"))
+JOB_LOOKAHEAD = int(os.getenv("JOB_LOOKAHEAD", "4"))  # Queued jobs each worker inspects, without claiming them, to prefetch models
+model_registry = ModelRegistry(load_pipeline, max_bytes=MODEL_CACHE_MAX_MB * 2**20)
 
-# --- Supabase REST API Helper Functions ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# --- Speculative Decoding ---
+# A small draft model with the same tokenizer (e.g. distilgpt2 for gpt2) proposes tokens that the main model
+# verifies in one forward pass. SPECULATIVE_DRAFT_MODEL turns it on for every request; requests can pick
+# a draft with parameters={"draft_model": "<name>"} or opt out with "none". The default draft is loaded and
+# pinned at startup. Acceptance rate and speedup are reported under /engine.
+SPECULATIVE_DRAFT_MODEL = os.getenv("SPECULATIVE_DRAFT_MODEL", "")
+SPECULATIVE_NUM_TOKENS = int(os.getenv("SPECULATIVE_NUM_TOKENS", "0"))  # Draft tokens per step; 0 = transformers' adaptive default
+speculative = SpeculativeDecoder(model_registry.get, default_draft=SPECULATIVE_DRAFT_MODEL, num_assistant_tokens=SPECULATIVE_NUM_TOKENS)
+
+# --- Result Cache ---
+# Generated texts are cached in Redis next to the job results, keyed on a hash of model, input and parameters.
+# Only deterministic generations are cached unless the caller passes parameters={"cache": true};
+# {"cache": false} always bypasses the cache.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+result_cache = ResultCache(
+    redis_client,
+    ttl_seconds=int(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400")),
+    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000")),
+    max_value_bytes=int(os.getenv("RESULT_CACHE_MAX_VALUE_BYTES", "1048576")),
+)
 
-def insert_inference_result(data: dict) -> bool:
+def cached_generate(model_name: str, pipe, input_text: str, params: dict, compute):
     """
-    Insert a row into the inference_results table using Supabase REST API.
-    Returns True if successful, False otherwise.
+    Run compute() through the result cache when the request is cacheable, coalescing identical in-flight requests.
+    Removes the 'cache' opt-in flag from params, since it is not a generation parameter.
     """
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        logger.warning("Supabase credentials not set. Skipping Supabase integration.")
-        return False
-    url = f"{SUPABASE_URL}/rest/v1/inference_results"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
-    }
-    try:
-        response = httpx.post(url, json=data, headers=headers)
-        if response.status_code == 201:
-            logger.info(f"Stored job {data.get('job_id')} result in Supabase via REST API.")
-            return True
-        else:
-            logger.error(f"Failed to store job {data.get('job_id')} in Supabase: {response.status_code} {response.text}")
-            return False
-    except Exception as e:
-        logger.error(f"Exception during Supabase REST API call: {e}")
-        return False
-
-def select_inference_results(filters: dict = None) -> list:
-    """
-    Select rows from the inference_results table using Supabase REST API.
-    filters: dict of query params (e.g., {"job_id": "eq.test123"})
-    Returns a list of results or an empty list.
-    """
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        logger.warning("Supabase credentials not set. Skipping Supabase integration.")
-        return []
-    url = f"{SUPABASE_URL}/rest/v1/inference_results"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}"
-    }
-    params = {"select": "*"}
-    if filters:
-        params.update(filters)
-    try:
-        response = httpx.get(url, headers=headers, params=params)
-        if response.status_code == 200:
-            logger.info(f"Selected results from Supabase via REST API.")
-            return response.json()
-        else:
-            logger.error(f"Failed to select from Supabase: {response.status_code} {response.text}")
-            return []
-    except Exception as e:
-        logger.error(f"Exception during Supabase REST API select: {e}")
-        return []
-
-def update_inference_result(job_id: str, update_data: dict) -> bool:
-    """
-    Update a row in the inference_results table using Supabase REST API.
-    job_id: the job_id to match
-    update_data: dict of fields to update
-    Returns True if successful, False otherwise.
-    """
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        logger.warning("Supabase credentials not set. Skipping Supabase integration.")
-        return False
-    url = f"{SUPABASE_URL}/rest/v1/inference_results"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json"
+    cache_opt_in = params.pop("cache", None)
+    if not RESULT_CACHE_ENABLED or cache_opt_in is False:
+        return compute()
+    if not cache_opt_in and not is_deterministic(pipe, params):
+        return compute()
+    key = result_cache.make_key(model_name, input_text, params)
+    return result_cache.get_or_compute(key, compute)
+
+# --- Prompt Prefix Cache ---
+# Attention key/values of long shared prompt prefixes (registered via POST /prefixes or detected automatically)
+# are kept per model, so requests starting with them only prefill the rest of the prompt.
+# Requests that hit the prefix cache run on their own instead of through the /infer micro-batcher.
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+prefix_cache = PrefixCache(
+    max_bytes=int(os.getenv("PREFIX_CACHE_MAX_MB", "512")) * 2**20,
+    min_tokens=int(os.getenv("PREFIX_CACHE_MIN_TOKENS", "64")),
+    auto_detect=os.getenv("PREFIX_CACHE_AUTO_DETECT", "true").lower() == "true",
+)
+
+def generate_text(model_name: str, pipe, input_text: str, params: dict, run_pipeline=None) -> str:
+    """
+    Generate text for one prompt, with a draft model assisting when speculative decoding applies, or resuming
+    from a cached prefix state when the prompt starts with a known prefix.
+    Otherwise run_pipeline() is called, or the pipeline itself if no run_pipeline is given.
+    """
+    draft_model = speculative.draft_for(model_name, params)
+    if draft_model is not None:
+        return speculative.generate(pipe, model_name, draft_model, input_text, params)
+    if PREFIX_CACHE_ENABLED:
+        result_text = prefix_cache.generate(pipe, model_name, input_text, params)
+        if result_text is not None:
+            return result_text
+    if run_pipeline is not None:
+        return run_pipeline()
+    return extract_generated_text(pipe(input_text, **params))
+
+# --- Supabase Result Storage ---
+# Job results are handed to a background writer that bulk-inserts them over a pooled connection.
+SUPABASE_WRITER_BATCH_SIZE = int(os.getenv("SUPABASE_WRITER_BATCH_SIZE", "50"))
+SUPABASE_WRITER_FLUSH_INTERVAL_S = float(os.getenv("SUPABASE_WRITER_FLUSH_INTERVAL_S", "1.0"))
+SUPABASE_JOURNAL_PATH = os.getenv("SUPABASE_JOURNAL_PATH", "/tmp/ncos_supabase_journal.jsonl")  # Results are spilled here while Supabase is down
+SUPABASE_JOURNAL_REPLAY_S = float(os.getenv("SUPABASE_JOURNAL_REPLAY_S", "30"))  # How often an idle writer retries the journal
+supabase_writer = None
+if supabase_http is not None:
+    supabase_writer = SupabaseWriter(
+        supabase_http,
+        batch_size=SUPABASE_WRITER_BATCH_SIZE,
+        flush_interval_s=SUPABASE_WRITER_FLUSH_INTERVAL_S,
+        journal_path=SUPABASE_JOURNAL_PATH,
+        columns=SUPABASE_RESULT_COLUMNS,
+        replay_interval_s=SUPABASE_JOURNAL_REPLAY_S,
+    )
+supabase_async = None  # httpx.AsyncClient for Supabase reads from endpoints; created in the lifespan
+
+# --- Result Archive ---
+# Job results are also appended to a local SQLite archive (WAL mode, indexed on job_id, model, suite and
+# finish time) that serves the filtered and aggregated reads of GET /results/archive without calling Supabase.
+# Set RESULT_ARCHIVE_PATH to an empty string to disable it.
+RESULT_ARCHIVE_PATH = os.getenv("RESULT_ARCHIVE_PATH", "/tmp/ncos_results.sqlite3")
+result_archive = ResultArchive(RESULT_ARCHIVE_PATH) if RESULT_ARCHIVE_PATH else None
+# Every finished job is handed to each result sink; a sink has submit(row), which must not block, and close()
+result_sinks = [sink for sink in (supabase_writer, result_archive) if sink is not None]
+
+# --- Profiling ---
+# /infer requests and queued jobs submitted with profile=true and an X-Profile-Token header matching PROFILE_TOKEN
+# run under the torch profiler and a Python stack sampler; their traces are stored in Redis and downloaded from
+# GET /profiles/<id>. With PROFILE_SLOW_REQUEST_S set, every other request and job is followed by the sampler
+# alone, and its stacks are kept only if it took at least that long.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")  # Unset disables profile=true and the /profiles endpoints
+PROFILE_SLOW_REQUEST_S = float(os.getenv("PROFILE_SLOW_REQUEST_S", "0"))  # 0 disables slow-request capture
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "50"))  # The oldest profiles are evicted beyond this
+PROFILE_TTL_SECONDS = int(os.getenv("PROFILE_TTL_SECONDS", "86400"))
+PROFILE_MAX_TRACE_MB = float(os.getenv("PROFILE_MAX_TRACE_MB", "32"))  # Larger traces (after compression) are not stored
+request_profiler = RequestProfiler(
+    ProfileStore(redis_client, max_profiles=PROFILE_MAX_STORED, ttl_seconds=PROFILE_TTL_SECONDS,
+                 max_artifact_bytes=int(PROFILE_MAX_TRACE_MB * 2**20)),
+    StackSampler(interval_s=PROFILE_SAMPLE_INTERVAL_MS / 1000.0),
+    slow_threshold_s=PROFILE_SLOW_REQUEST_S,
+)
+
+# --- Background Worker Threads ---
+class JobCancelled(Exception):
+    pass
+
+def submit_result(job: dict, status: str, result: str, seconds: Optional[float] = None):
+    """
+    Hand a finished job to every result sink (buffered and written in the background). Jobs that ended
+    without a result are submitted too, with their error as the result, so the archive counts them.
+    """
+    data = {
+        "job_id": job["job_id"],
+        "input_text": job["input_text"],
+        "parameters": str(job.get("parameters", {})),
+        "model_name": job.get("model_name", MODEL_NAME),
+        "result": result,
+        "status": status,
+        "created_at": job.get("created_at"),
+        "seconds": round(seconds, 4) if seconds is not None else None,
+        "tenant": job.get("tenant"),
     }
-    params = {"job_id": f"eq.{job_id}"}
+    for sink in result_sinks:
+        sink.submit(data)
+
+def process_job(job: dict):
+    """
+    Run one queued job and store its result in Redis (and Supabase if configured).
+    Failures are recorded as an 'ERROR:' result rather than raised. Jobs past their deadline
+    or cancelled while queued are skipped; jobs cancelled while running stop at the next decoding step.
+    Every outcome is also submitted to the result sinks.
+    Raises redis.RedisError if the job could not be started.
+    """
+    job_id = job["job_id"]
+    input_text = job["input_text"]
+    parameters = job.get("parameters", {})
+    model_name = job.get("model_name", MODEL_NAME)
+    if "created_at" in job:
+        observe_stage("queue_wait", time.time() - job["created_at"])
+    if job.get("deadline_at") is not None and time.time() > job["deadline_at"]:
+        logger.info(f"Job {job_id} expired before it started.")
+        job_store.fail(job_id, "ERROR: deadline passed before the job started", status="expired")
+        submit_result(job, "expired", "ERROR: deadline passed before the job started")
+        return
+    if not job_store.mark_running(job_id):
+        logger.info(f"Skipping cancelled job {job_id}.")
+        submit_result(job, "cancelled", "Cancelled before it started.")
+        return
+    started = time.monotonic()
+    job_throughput.started()
+    ok = False
+    cancelled = threading.Event()
+    with running_jobs_lock:
+        running_jobs[job_id] = cancelled
     try:
-        response = httpx.patch(url, json=update_data, headers=headers, params=params)
-        if response.status_code in (200, 204):
-            logger.info(f"Updated job {job_id} in Supabase via REST API.")
-            return True
-        else:
-            logger.error(f"Failed to update job {job_id} in Supabase: {response.status_code} {response.text}")
-            return False
+        # The cancel message may have been published before this job was registered above
+        if job_store.cancel_requested(job_id):
+            cancelled.set()
+        # Load model if needed
+        pipe = model_registry.get(model_name)
+        params = parameters or {}
+        params.setdefault("max_new_tokens", 128)
+        params.setdefault("temperature", 0.7)
+        stopping = StoppingCriteriaList([CancelOnEvent(cancelled)])
+        profile = bool(job.get("profile"))
+        if profile:
+            # A profiled job runs on this thread and is never answered from the result cache
+            params["cache"] = False
+
+        def compute():
+            if cancelled.is_set():
+                raise JobCancelled()
+            if inference_pool is not None and model_name == MODEL_NAME and not profile:
+                # Worker processes cannot see the event; a cancelled pool job is discarded when it returns
+                text = inference_pool.submit(input_text, params)
+            else:
+                text = generate_text(model_name, pipe, input_text, {**params, "stopping_criteria": stopping})
+            if cancelled.is_set():
+                raise JobCancelled()
+            return text
+
+        profile_meta = {"source": "job", "model_name": model_name, "tenant": job.get("tenant"),
+                        "input_chars": len(input_text), "max_new_tokens": params.get("max_new_tokens")}
+        with request_profiler.capture(job_id, profile_meta, requested=profile):
+            result_text = cached_generate(model_name, pipe, input_text, params, compute)
+        with stage_timer("redis_write"):
+            job_store.complete(job_id, result_text)
+        log_sampled("job_done", job_id=job_id, model_name=model_name, input_text=input_text, result=result_text)
+        submit_result(job, "done", result_text, time.monotonic() - started)
+        ok = True
+    except JobCancelled:
+        logger.info(f"Job {job_id} cancelled while running.")
+        job_store.fail(job_id, "Cancelled while running.", status="cancelled")
+        submit_result(job, "cancelled", "Cancelled while running.", time.monotonic() - started)
     except Exception as e:
-        logger.error(f"Exception during Supabase REST API update: {e}")
-        return False
-
-def delete_inference_result(job_id: str) -> bool:
-    """
-    Delete a row from the inference_results table using Supabase REST API.
-    job_id: the job_id to match
-    Returns True if successful, False otherwise.
-    """
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        logger.warning("Supabase credentials not set. Skipping Supabase integration.")
-        return False
-    url = f"{SUPABASE_URL}/rest/v1/inference_results"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}"
-    }
-    params = {"job_id": f"eq.{job_id}"}
+        logger.error(f"Job {job_id} failed: {e}")
+        job_store.fail(job_id, f"ERROR: {e}")
+        submit_result(job, "error", f"ERROR: {e}", time.monotonic() - started)
+    finally:
+        with running_jobs_lock:
+            running_jobs.pop(job_id, None)
+        job_throughput.finished(ok, time.monotonic() - started)
+
+def prefetch_next_model(entries: list):
+    """
+    Start loading the first model that the given jobs, or the next JOB_LOOKAHEAD queued jobs, need but is
+    not resident. The queued jobs are only peeked at, so other consumers and replicas can still take them.
+    """
+    model_names = [job.get("model_name", MODEL_NAME) for _, job in entries]
     try:
-        response = httpx.delete(url, headers=headers, params=params)
-        if response.status_code in (200, 204):
-            logger.info(f"Deleted job {job_id} from Supabase via REST API.")
-            return True
-        else:
-            logger.error(f"Failed to delete job {job_id} from Supabase: {response.status_code} {response.text}")
-            return False
-    except Exception as e:
-        logger.error(f"Exception during Supabase REST API delete: {e}")
-        return False
-
-# --- Background Worker Thread ---
-def job_worker():
-    while True:
-        job_data = redis_client.lpop(JOB_QUEUE)
-        if job_data:
-            job = eval(job_data)  # In production, use json.loads for safety
-            job_id = job["job_id"]
-            input_text = job["input_text"]
-            parameters = job.get("parameters", {})
-            model_name = job.get("model_name", "gpt2")
+        model_names += [job.get("model_name", MODEL_NAME) for _, job in job_queue.peek(JOB_LOOKAHEAD)]
+    except redis.RedisError as e:
+        logger.warning(f"Job queue look-ahead failed: {e}")
+    for model_name in model_names:
+        if not model_registry.is_loaded(model_name):
+            model_registry.prefetch(model_name)
+            return
+
+def _job_model_loaded(job: dict) -> bool:
+    return model_registry.is_loaded(job.get("model_name", MODEL_NAME))
+
+def job_worker(consumer: str):
+    """
+    Consume jobs from the stream until stop_job_workers() is called.
+    Blocks in Redis while the queue is empty, and periodically takes over jobs
+    that another consumer picked up but never acknowledged.
+    """
+    reclaim_interval = JOB_VISIBILITY_TIMEOUT_MS / 2000.0
+    next_reclaim = 0.0
+    while not job_workers_stopping.is_set():
+        try:
+            entries = []
+            if time.monotonic() >= next_reclaim:
+                next_reclaim = time.monotonic() + reclaim_interval
+                for entry_id, job, deliveries in job_queue.reclaim(consumer, count=1):
+                    if deliveries > JOB_MAX_DELIVERIES:
+                        logger.error(f"Job {job.get('job_id')} abandoned after {deliveries - 1} attempts.")
+                        job_store.fail(job["job_id"], f"ERROR: job abandoned after {deliveries - 1} attempts")
+                        submit_result(job, "error", f"ERROR: job abandoned after {deliveries - 1} attempts")
+                        job_queue.ack(entry_id)
+                    else:
+                        entries.append((entry_id, job))
+            if not entries:
+                # One job at a time: claimed jobs are invisible to idle consumers and to higher lanes' scheduling.
+                # Within a lane, tenants whose next job is for an already-loaded model go first.
+                entries = job_queue.read(consumer, count=1, prefer=_job_model_loaded)
+        except redis.RedisError as e:
+            logger.error(f"Job queue read failed for {consumer}: {e}")
+            if "NOGROUP" in str(e):
+                # The stream or group was removed (e.g. Redis was flushed); recreate it
+                try:
+                    job_queue.ensure_group()
+                except redis.RedisError:
+                    pass
+            time.sleep(1)
+            continue
+        for entry_id, _ in entries:
+            job_queue.hold(consumer, entry_id)
+        # Warm up the model that the jobs queued behind this one need while it runs
+        prefetch_next_model(entries)
+        for entry_id, job in entries:
             try:
-                # Load model if needed
-                if model_cache["name"] != model_name:
-                    logger.info(f"Loading model for job: {model_name}")
-                    tokenizer = AutoTokenizer.from_pretrained(model_name)
-                    model = AutoModelForCausalLM.from_pretrained(model_name)
-                    model_cache["pipeline"] = pipeline("text-generation", model=model, tokenizer=tokenizer, device=0)
-                    model_cache["name"] = model_name
-                pipe = model_cache["pipeline"]
-                params = parameters or {}
-                params.setdefault("max_new_tokens", 128)
-                params.setdefault("temperature", 0.7)
-                output = pipe(input_text, **params)
-                result_text = output[0]["generated_text"] if output and "generated_text" in output[0] else str(output)
-                redis_client.set(JOB_RESULT_PREFIX + job_id, result_text)
-                # --- Store result in Supabase ---
-                if SUPABASE_URL and SUPABASE_KEY:
-                    data = {
-                        "job_id": job_id,
-                        "input_text": input_text,
-                        "parameters": str(parameters),
-                        "model_name": model_name,
-                        "result": result_text
-                    }
-                    insert_inference_result(data)
-            except Exception as e:
-                logger.error(f"Job {job_id} failed: {e}")
-                redis_client.set(JOB_RESULT_PREFIX + job_id, f"ERROR: {e}")
-        else:
+                process_job(job)
+            except redis.RedisError as e:
+                # Leave the job unacked and stop renewing its lease, so it is retried after the visibility timeout
+                logger.error(f"Could not start job {job.get('job_id')}: {e}")
+                job_queue.release(entry_id)
+                continue
+            try:
+                job_queue.ack(entry_id)
+            except redis.RedisError as e:
+                # The job will be reclaimed and run again once its visibility timeout passes
+                logger.error(f"Failed to ack job {job.get('job_id')}: {e}")
+
+def _worker_info() -> dict:
+    return {
+        "role": NCOS_PROCESS_ROLE,
+        "hostname": socket.gethostname(),
+        "pid": os.getpid(),
+        "consumers": JOB_WORKER_CONCURRENCY,
+        "inference_backend": INFERENCE_BACKEND,
+        "inference_workers": INFERENCE_WORKERS if inference_pool is not None else 1,
+        "models": [model["name"] for model in model_registry.stats()["models"]],
+        **job_throughput.snapshot(),
+    }
+
+def cancel_listener():
+    """
+    Stop running jobs of this process when DELETE /queue/<id> publishes their id.
+    """
+    while not job_workers_stopping.is_set():
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(JOB_CANCEL_CHANNEL)
+            while not job_workers_stopping.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                with running_jobs_lock:
+                    event = running_jobs.get(message["data"].decode("utf-8"))
+                if event is not None:
+                    event.set()
+        except redis.RedisError as e:
+            logger.error(f"Job cancel listener failed: {e}")
             time.sleep(1)
 
-# Start background worker thread
-threading.Thread(target=job_worker, daemon=True).start()
+def start_job_workers():
+    """
+    Create the consumer groups, migrate the legacy list queue, start JOB_WORKER_CONCURRENCY consumer threads
+    and begin publishing this process's heartbeat.
+    """
+    global worker_heartbeat
+    try:
+        job_queue.ensure_group()
+        job_queue.migrate_legacy_list(JOB_QUEUE)
+    except redis.RedisError as e:
+        logger.error(f"Failed to prepare job queue: {e}")
+    consumer_prefix = f"{socket.gethostname()}-{os.getpid()}"
+    for i in range(JOB_WORKER_CONCURRENCY):
+        thread = threading.Thread(target=job_worker, args=(f"{consumer_prefix}-{i}",), name=f"job-worker-{i}", daemon=True)
+        thread.start()
+        job_worker_threads.append(thread)
+    threading.Thread(target=cancel_listener, name="job-cancel-listener", daemon=True).start()
+    worker_heartbeat = WorkerHeartbeat(
+        redis_client,
+        consumer_prefix,
+        _worker_info,
+        interval_s=WORKER_HEARTBEAT_INTERVAL_S,
+        ttl_s=WORKER_HEARTBEAT_TTL_S,
+    )
+    worker_heartbeat.start()
+
+def stop_job_workers(timeout: float = 30.0):
+    """
+    Let the consumer threads finish the jobs they hold, then deregister this process's heartbeat.
+    Jobs still running after timeout are picked up by another consumer once their lease expires.
+    """
+    job_workers_stopping.set()
+    deadline = time.monotonic() + timeout
+    for thread in job_worker_threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    if worker_heartbeat is not None:
+        worker_heartbeat.stop()
+
+# --- Startup Lifecycle ---
+def _pool_generate(pipe, input_text: str, params: dict) -> str:
+    # Runs inside an inference worker process
+    return generate_text(MODEL_NAME, pipe, input_text, params)
+
+def on_model_ready(pipe):
+    """
+    Publish the loaded startup model to the request handlers and start consuming the job queue.
+    """
+    global ncos_pipeline, infer_batcher, inference_pool
+    if SPECULATIVE_DRAFT_MODEL:
+        # Loaded before the worker processes fork so they share it
+        try:
+            model_registry.put(SPECULATIVE_DRAFT_MODEL, load_pipeline(SPECULATIVE_DRAFT_MODEL), pinned=True)
+        except Exception as e:
+            logger.error(f"Could not load draft model {SPECULATIVE_DRAFT_MODEL}, speculative decoding is off by default: {e}")
+            speculative.default_draft = ""
+    if INFERENCE_BACKEND == "process":
+        inference_pool = InferencePool(pipe, _pool_generate, workers=INFERENCE_WORKERS, torch_threads=INFERENCE_WORKER_THREADS)
+    else:
+        infer_batcher = MicroBatcher(pipe, max_batch_size=INFER_BATCH_MAX_SIZE, max_wait_ms=INFER_BATCH_MAX_WAIT_MS)
+    model_registry.put(MODEL_NAME, pipe, pinned=True)
+    ncos_pipeline = pipe
+    # Workers start only now so that jobs for the startup model do not trigger a second load
+    if RUN_QUEUE_CONSUMERS:
+        start_job_workers()
+
+model_lifecycle = ModelLifecycle(
+    MODEL_NAME,
+    load_pipeline,
+    on_model_ready,
+    hf_token=HF_TOKEN,
+    warmup_prompt=WARMUP_PROMPT,
+    warmup_max_new_tokens=WARMUP_MAX_NEW_TOKENS,
+)
 
 # --- Endpoints ---
 
+def _model_unavailable_reason() -> str:
+    if model_lifecycle.error:
+        return f"Model not loaded: {model_lifecycle.error}"
+    return f"Model not loaded yet (phase: {model_lifecycle.phase})."
+
+async def _admit(endpoint: str, input_text: str, params: dict):
+    """
+    Wait on the event loop for a generation slot and return its ticket. Raises Overloaded if the request is shed.
+    """
+    cost = estimate_tokens(input_text, params.get("max_new_tokens", 0), ADMISSION_CHARS_PER_TOKEN)
+    try:
+        return await admission.acquire(cost)
+    except Overloaded as e:
+        ADMISSION_REJECTED.labels(endpoint, "queue_full" if e.status_code == 429 else "timeout").inc()
+        logger.warning(f"Shedding {endpoint} request ({e.status_code}): {e}")
+        raise
+
+def _check_profile_token(token: Optional[str]):
+    """
+    Raise HTTPException(403) unless profiling is enabled and token matches PROFILE_TOKEN.
+    """
+    if not PROFILE_TOKEN:
+        raise HTTPException(status_code=403, detail="Profiling is disabled; set PROFILE_TOKEN to enable it.")
+    if not token or not hmac.compare_digest(token.encode("utf-8"), PROFILE_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Missing or invalid X-Profile-Token header.")
+
+def _overloaded_response(e: Overloaded) -> JSONResponse:
+    content = InferResponse(result="", status="error", error=str(e)).dict()
+    return JSONResponse(status_code=e.status_code, content=content, headers={"Retry-After": str(e.retry_after)})
+
+async def _run_inference(fn, *args):
+    """
+    Run blocking model work on the inference executor and wait for it without holding the event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, fn, *args)
+
 @app.post("/infer", response_model=InferResponse, summary="Run model inference", description="Run LLM inference on the input text and return the result.")
-def infer(request: InferRequest):
+async def infer(request: InferRequest, x_profile_token: Optional[str] = Header(None)):
     """
     Run model inference on the input text.
     - **input_text**: The text to run inference on.
     - **parameters**: Optional model parameters (e.g., temperature, max_tokens).
-    Returns the model's output or an error message.
+    - **profile**: Optional; run under the torch profiler and the stack sampler, unbatched and uncached.
+      Requires the X-Profile-Token header; the traces are downloaded from GET /profiles/<profile_id>.
+    Returns the model's output or an error message, or 429/503 with Retry-After when the model is saturated.
+    profile_id is set when the request was profiled, on request or for being slower than PROFILE_SLOW_REQUEST_S.
     """
+    if request.profile:
+        _check_profile_token(x_profile_token)
     if ncos_pipeline is None:
-        # Model failed to load
+        # Model is still loading or failed to load
         logger.error("Inference requested but model is not loaded.")
-        return InferResponse(result="", status="error", error="Model not loaded.")
+        return InferResponse(result="", status="error", error=_model_unavailable_reason())
     try:
         # Prepare parameters for the pipeline
         params = request.parameters or {}
@@ -261,15 +764,172 @@ def infer(request: InferRequest):
         params.setdefault("max_new_tokens", 128)
         params.setdefault("temperature", 0.7)
         # Run inference
-        logger.info(f"Running inference for input: {request.input_text}")
-        output = ncos_pipeline(request.input_text, **params)
-        # output is a list of dicts with 'generated_text'
-        result_text = output[0]["generated_text"] if output and "generated_text" in output[0] else str(output)
-        return InferResponse(result=result_text, status="success")
+        log_sampled("infer", model_name=MODEL_NAME, input_text=request.input_text, parameters=params)
+
+        if request.profile:
+            params["cache"] = False
+
+        def compute():
+            if request.profile:
+                # Run on this thread rather than in a batch or worker process, so the profilers see it
+                return generate_text(MODEL_NAME, ncos_pipeline, request.input_text, params)
+            if inference_pool is not None:
+                return inference_pool.submit(request.input_text, params)
+            # The batcher groups this call with concurrent requests that use the same parameters
+            return generate_text(MODEL_NAME, ncos_pipeline, request.input_text, params, lambda: infer_batcher.submit(request.input_text, params))
+
+        def run():
+            profile_meta = {"source": "/infer", "model_name": MODEL_NAME, "input_chars": len(request.input_text),
+                            "max_new_tokens": params.get("max_new_tokens")}
+            # Batched generations run on the batcher's thread, so a slow request's samples include it
+            extra_threads = (infer_batcher.thread_id,) if infer_batcher is not None and not request.profile else ()
+            with request_profiler.capture(str(uuid.uuid4()), profile_meta, requested=request.profile, extra_threads=extra_threads) as capture:
+                result_text = cached_generate(MODEL_NAME, ncos_pipeline, request.input_text, params, compute)
+            return result_text, capture.profile_id
+
+        with await _admit("/infer", request.input_text, params):
+            result_text, profile_id = await _run_inference(run)
+        return InferResponse(result=result_text, status="success", profile_id=profile_id)
+    except Overloaded as e:
+        return _overloaded_response(e)
     except Exception as e:
         logger.error(f"Error during inference: {e}")
         return InferResponse(result="", status="error", error=str(e))
 
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/infer/stream", summary="Stream model inference", description="Run LLM inference and stream tokens as server-sent events while they are decoded.")
+async def infer_stream(request: InferStreamRequest, raw_request: Request):
+    """
+    Stream model inference over server-sent events.
+    - **input_text**: The text to run inference on.
+    - **parameters**: Optional model parameters (e.g., temperature, max_new_tokens).
+    - **model_name**: Optional model name; other models are loaded through the model cache.
+    Emits a `token` event per decoded chunk and a final `done` event with the same fields as InferResponse.
+    Generation stops as soon as the client disconnects. Returns 429/503 with Retry-After when the model is saturated.
+    """
+    params = request.parameters or {}
+    params.setdefault("max_new_tokens", 128)
+    params.setdefault("temperature", 0.7)
+    params.pop("cache", None)  # Streamed generations are not served from the result cache
+    params.pop("draft_model", None)  # Streams decode token by token without a draft model
+    try:
+        ticket = await _admit("/infer/stream", request.input_text, params)
+    except Overloaded as e:
+        return _overloaded_response(e)
+
+    async def event_stream():
+        if request.model_name and request.model_name != MODEL_NAME:
+            try:
+                pipe = await _run_inference(model_registry.get, request.model_name)
+            except Exception as e:
+                logger.error(f"Error loading model {request.model_name} for streaming: {e}")
+                yield _sse_event("done", InferResponse(result="", status="error", error=str(e)).dict())
+                return
+        else:
+            pipe = ncos_pipeline
+        if pipe is None:
+            logger.error("Streaming inference requested but model is not loaded.")
+            yield _sse_event("done", InferResponse(result="", status="error", error=_model_unavailable_reason()).dict())
+            return
+        try:
+            stream = TokenStream(pipe, request.input_text, params)
+        except Exception as e:
+            logger.error(f"Error starting streaming inference: {e}")
+            yield _sse_event("done", InferResponse(result="", status="error", error=str(e)).dict())
+            return
+        tokens = iter(stream)
+        try:
+            while True:
+                chunk = await _run_inference(next, tokens, None)
+                if chunk is None:
+                    break
+                if await raw_request.is_disconnected():
+                    logger.info("Client disconnected, stopping streaming generation.")
+                    stream.cancel()
+                    return
+                yield _sse_event("token", {"token": chunk})
+            if stream.error is not None:
+                logger.error(f"Error during streaming inference: {stream.error}")
+                yield _sse_event("done", InferResponse(result="", status="error", error=str(stream.error)).dict())
+            else:
+                yield _sse_event("done", InferResponse(result=stream.text, status="success").dict())
+        finally:
+            # Covers the response being torn down mid-stream as well as normal completion
+            stream.cancel()
+
+    async def admitted_stream():
+        try:
+            async for event in event_stream():
+                yield event
+        finally:
+            ticket.release()
+
+    # The background task releases the slot if the response is dropped before the stream starts
+    return StreamingResponse(admitted_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}, background=BackgroundTask(ticket.release))
+
+@app.get("/infer/stats", summary="Inference batching stats", description="Report batch sizes and queueing delay of the /infer micro-batcher.")
+def infer_stats():
+    """
+    Report how the /infer micro-batcher is grouping requests.
+    Returns batch counts, average and per-batch sizes, the wait time requests spent in the batching window,
+    result cache hit/miss/coalescing counters, and admission control slots, waiters and rejections.
+    """
+    if infer_batcher is None:
+        return {"enabled": False, "result_cache": result_cache.stats(), "admission": admission.stats()}
+    return {"enabled": True, **infer_batcher.stats(), "result_cache": result_cache.stats(), "admission": admission.stats()}
+
+@app.get("/models", summary="Model cache stats", description="List resident models and model cache hit, miss, eviction and load-time counters.")
+def models():
+    """
+    Report the state of the model cache.
+    Returns resident models with their estimated size and the cache counters.
+    """
+    return model_registry.stats()
+
+@app.get("/engine", summary="Inference engine info", description="Report the device, CPU optimizations and tokens/s achieved per model.")
+def engine():
+    """
+    Report the inference engine configuration.
+    Returns the selected device, CPU quantization/autocast/thread settings and generation throughput per model,
+    and the state of the inference worker processes when INFERENCE_BACKEND=process. `speculative` gives the
+    draft acceptance rate and the speedup over plain decoding per model/draft pair.
+    """
+    report = {"backend": INFERENCE_BACKEND, **engine_report()}
+    report["speculative"] = speculative.stats(report["models"])
+    if inference_pool is not None:
+        report["process_pool"] = inference_pool.stats()
+    return report
+
+@app.get("/prefixes", summary="Prefix cache stats", description="List cached prompt prefixes and prefix cache hit/miss counters.")
+def list_prefixes():
+    """
+    Report the state of the prompt prefix cache.
+    Returns cached prefixes with their length and size, and hit, miss, tokens saved and eviction counters.
+    """
+    return {"enabled": PREFIX_CACHE_ENABLED, **prefix_cache.stats()}
+
+@app.post("/prefixes", summary="Register a prompt prefix", description="Register a prompt prefix whose key/values should be cached for a model.")
+async def register_prefix(request: PrefixRequest):
+    """
+    Register a prompt prefix for the prefix cache.
+    - **prefix**: The shared prompt prefix text.
+    - **model_name**: Optional model name; defaults to the startup model.
+    Returns the prefix length in tokens. Its key/values are computed on the first request that starts with it.
+    """
+    model_name = request.model_name or MODEL_NAME
+    if model_name == MODEL_NAME and ncos_pipeline is None:
+        raise HTTPException(status_code=503, detail=_model_unavailable_reason())
+
+    def register():
+        # Loading another model and tokenizing a long prefix both block, so they run on the inference executor
+        pipe = ncos_pipeline if model_name == MODEL_NAME else model_registry.get(model_name)
+        return prefix_cache.register(model_name, pipe.tokenizer, request.prefix)
+
+    tokens = await _run_inference(register)
+    return {"model_name": model_name, "tokens": tokens}
+
 @app.get("/healthz", summary="Health check", description="Check if the backend service is healthy.")
 def healthz():
     """
@@ -278,53 +938,547 @@ def healthz():
     """
     return {"status": "ok"}
 
-@app.post("/queue", response_model=QueueResponse, summary="Submit job to queue", description="Submit a job to the Redis queue for asynchronous processing.")
-def submit_job(request: QueueRequest):
+_TENANT_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+def _new_job(request: QueueRequest) -> dict:
     """
-    Submit a job to the queue (e.g., Redis).
-    - **input_text**: The text to enqueue for inference.
-    - **parameters**: Optional model parameters.
-    Returns a job ID and status.
+    Build the job record for a request. Raises HTTPException(422) for an unknown lane, a malformed tenant
+    or a non-positive deadline.
     """
-    job_id = str(uuid.uuid4())
+    if request.priority is not None and request.priority not in JOB_PRIORITY_LANES:
+        raise HTTPException(status_code=422, detail=f"priority must be one of {list(JOB_PRIORITY_LANES)}.")
+    if request.tenant is not None and not _TENANT_PATTERN.match(request.tenant):
+        raise HTTPException(status_code=422, detail="tenant must be 1-64 letters, digits, '_', '-' or '.'.")
+    if request.deadline_seconds is not None and request.deadline_seconds <= 0:
+        raise HTTPException(status_code=422, detail="deadline_seconds must be positive.")
+    now = time.time()
     job = {
-        "job_id": job_id,
+        "job_id": str(uuid.uuid4()),
         "input_text": request.input_text,
         "parameters": request.parameters,
-        "model_name": os.getenv("HF_MODEL_NAME", "gpt2")  # Allow override per job in future
+        "model_name": MODEL_NAME,  # Allow override per job in future
+        "created_at": now,
     }
-    redis_client.rpush(JOB_QUEUE, str(job))
-    return QueueResponse(job_id=job_id, status="queued")
+    if request.priority is not None:
+        job["priority"] = request.priority
+    if request.tenant is not None:
+        job["tenant"] = request.tenant
+    if request.deadline_seconds is not None:
+        job["deadline_at"] = now + request.deadline_seconds
+    if request.profile:
+        job["profile"] = True
+    return job
 
-@app.get("/queue", response_model=QueueResponse, summary="Get job status/result", description="Get the status or result of a queued job by job_id.")
-def get_job_status(job_id: str):
+async def _check_queue_capacity(endpoint: str, new_jobs: int):
     """
-    Get the status/result of a queued job.
-    - **job_id**: The job identifier.
-    Returns the job status and result if available.
-    """
-    result = redis_client.get(JOB_RESULT_PREFIX + job_id)
-    if result:
-        result_str = result.decode("utf-8")
-        if result_str.startswith("ERROR:"):
-            return QueueResponse(job_id=job_id, status="error", error=result_str)
-        return QueueResponse(job_id=job_id, status="done", result=result_str)
+    Raise HTTPException(503) with Retry-After if adding new_jobs would take the queue past QUEUE_MAX_DEPTH
+    jobs or past QUEUE_MAX_DRAIN_S seconds of work at the current fleet throughput.
+    """
+    if not QUEUE_MAX_DEPTH and not QUEUE_MAX_DRAIN_S:
+        return
+    try:
+        depth = await job_queue.adepth() + new_jobs
+        jobs_per_s = sum(worker.get("jobs_per_s", 0) for worker in await alist_workers(redis_async, ttl_s=WORKER_HEARTBEAT_TTL_S))
+    except redis.RedisError as e:
+        logger.warning(f"Could not check queue capacity: {e}")
+        return
+    if QUEUE_MAX_DEPTH and depth > QUEUE_MAX_DEPTH:
+        reason, excess = "queue_depth", depth - QUEUE_MAX_DEPTH
+        detail = f"Queue is full ({depth - new_jobs} jobs waiting, limit {QUEUE_MAX_DEPTH})."
+    elif QUEUE_MAX_DRAIN_S and jobs_per_s > 0 and depth / jobs_per_s > QUEUE_MAX_DRAIN_S:
+        # An idle fleet has no throughput to judge by, so only the depth limit applies to it
+        reason, excess = "queue_drain", depth - QUEUE_MAX_DRAIN_S * jobs_per_s
+        detail = f"Queue backlog would take {depth / jobs_per_s:.0f}s to drain (limit {QUEUE_MAX_DRAIN_S:g}s)."
     else:
+        return
+    # Roughly when enough of the backlog will have drained for this submission to fit
+    retry_after = max(1, int(excess / jobs_per_s)) if jobs_per_s > 0 else 30
+    ADMISSION_REJECTED.labels(endpoint, reason).inc()
+    logger.warning(f"Rejecting {new_jobs} job(s) on {endpoint}: {detail}")
+    raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": str(retry_after)})
+
+async def _enqueue_jobs(jobs: list):
+    """
+    Record the jobs and add them to the stream in one MULTI/EXEC round trip.
+    """
+    pipe = redis_async.pipeline(transaction=True)
+    for job in jobs:
+        job_store.create(job, pipe)
+    await job_queue.aenqueue_many(jobs, pipe)
+    await pipe.execute()
+
+async def _estimate_wait(position: int) -> Optional[float]:
+    """
+    Seconds until position jobs ahead have started, from the fleet throughput in the worker heartbeats.
+    """
+    if position == 0:
+        return 0.0
+    fleet = await alist_workers(redis_async, ttl_s=WORKER_HEARTBEAT_TTL_S)
+    jobs_per_s = sum(worker.get("jobs_per_s", 0) for worker in fleet)
+    if jobs_per_s > 0:
+        return round(position / jobs_per_s, 1)
+    # Idle fleet: fall back to the average job time spread over all consumers
+    consumers = sum(worker.get("consumers", 0) for worker in fleet)
+    durations = [worker["avg_job_seconds"] for worker in fleet if worker.get("avg_job_seconds")]
+    if consumers and durations:
+        return round(position * (sum(durations) / len(durations)) / consumers, 1)
+    return None
+
+def _job_status(job_id: str, record: Optional[dict]) -> QueueResponse:
+    if record is None:
         return QueueResponse(job_id=job_id, status="pending")
+    return QueueResponse(job_id=job_id, status=record["status"], result=record.get("result"), error=record.get("error"))
+
+async def _job_status_with_position(job_id: str, record: Optional[dict]) -> QueueResponse:
+    """
+    Like _job_status, plus the estimated queue position and wait while the job is queued.
+    """
+    response = _job_status(job_id, record)
+    if record is not None and record["status"] == "queued" and "seq" in record:
+        try:
+            response.position = max(0, await job_queue.aposition(record["stream"], record["seq"]))
+            response.estimated_wait_seconds = await _estimate_wait(response.position)
+        except redis.RedisError as e:
+            logger.warning(f"Could not estimate queue position of job {job_id}: {e}")
+    return response
+
+@app.get("/readyz", summary="Readiness check", description="Check whether the model is loaded and warmed up, and report loading progress.")
+def readyz():
+    """
+    Readiness check endpoint.
+    Returns 200 once the startup model is loaded and warmed up, and 503 with the current loading phase
+    and per-phase timings until then (or if loading failed). Unlike /healthz, this tracks the model.
+    """
+    status = model_lifecycle.status()
+    if status["ready"]:
+        return {"status": "ready", **status}
+    return JSONResponse(status_code=503, content={"status": "failed" if status["error"] else "loading", **status})
+
+@app.post("/queue", response_model=QueueResponse, summary="Submit job to queue", description="Submit a job to the Redis queue for asynchronous processing.")
+async def submit_job(request: QueueRequest, x_profile_token: Optional[str] = Header(None)):
+    """
+    Submit a job to the queue (e.g., Redis).
+    - **input_text**: The text to enqueue for inference.
+    - **parameters**: Optional model parameters.
+    - **priority**: Optional priority lane (JOB_PRIORITY_LANES, e.g. 'high', 'normal', 'low').
+    - **tenant**: Optional tenant or test suite name; tenants in the same lane share workers fairly.
+    - **deadline_seconds**: Optional; the job is dropped with status 'expired' if it has not started by then.
+    - **profile**: Optional; profile the job under its job id. Requires the X-Profile-Token header.
+    Returns a job ID and status, with the job's estimated queue position and wait, or 503 with Retry-After
+    if the backlog is over QUEUE_MAX_DEPTH or QUEUE_MAX_DRAIN_S.
+    """
+    if request.profile:
+        _check_profile_token(x_profile_token)
+    job = _new_job(request)
+    await _check_queue_capacity("/queue", 1)
+    await _enqueue_jobs([job])
+    return await _job_status_with_position(job["job_id"], await job_store.aget(job["job_id"]))
+
+@app.post("/queue/batch", response_model=QueueBatchResponse, summary="Submit many jobs to queue", description="Submit several jobs to the Redis queue in one request and one Redis round trip.")
+async def submit_job_batch(request: QueueBatchRequest, x_profile_token: Optional[str] = Header(None)):
+    """
+    Submit a batch of jobs to the queue.
+    - **jobs**: List of jobs, each with input_text and optional parameters, priority, tenant, deadline_seconds
+      and profile (at most QUEUE_BATCH_MAX_JOBS). Profiling any of them requires the X-Profile-Token header.
+    Returns the job IDs in the same order as the submitted jobs. The whole batch is rejected with 503 and
+    Retry-After if it would take the backlog over QUEUE_MAX_DEPTH or QUEUE_MAX_DRAIN_S.
+    """
+    if not request.jobs:
+        raise HTTPException(status_code=422, detail="jobs must not be empty.")
+    if len(request.jobs) > QUEUE_BATCH_MAX_JOBS:
+        raise HTTPException(status_code=413, detail=f"At most {QUEUE_BATCH_MAX_JOBS} jobs per batch.")
+    if any(job_request.profile for job_request in request.jobs):
+        _check_profile_token(x_profile_token)
+    jobs = [_new_job(job_request) for job_request in request.jobs]
+    await _check_queue_capacity("/queue/batch", len(jobs))
+    await _enqueue_jobs(jobs)
+    return QueueBatchResponse(job_ids=[job["job_id"] for job in jobs], status="queued")
+
+@app.get("/queue", response_model=QueueResponse, summary="Get job status/result", description="Get the status or result of a queued job by job_id, optionally waiting for it to finish.")
+async def get_job_status(job_id: str, wait: float = 0):
+    """
+    Get the status/result of a queued job.
+    - **job_id**: The job identifier.
+    - **wait**: Optional; seconds to hold the request open until the job finishes (at most QUEUE_LONG_POLL_MAX_S).
+      Returns as soon as the job reaches a final status, or with its current status when the wait runs out.
+    Returns the job status and result if available, and the estimated queue position and wait while queued.
+    """
+    wait = min(max(wait, 0.0), QUEUE_LONG_POLL_MAX_S)
+    if wait <= 0:
+        return await _job_status_with_position(job_id, await job_store.aget(job_id))
+    deadline = time.monotonic() + wait
+    # Subscribe before reading so a completion between the read and the wait is not missed
+    async with job_events.subscribe([job_id]) as events:
+        record = await job_store.aget(job_id)
+        while record is None or record["status"] not in TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or await events.get(remaining) is None:
+                break
+            record = await job_store.aget(job_id)
+    return await _job_status_with_position(job_id, record)
+
+@app.get("/queue/events", summary="Stream job status changes", description="Stream status changes of many queued jobs as server-sent events over one connection.")
+async def job_status_events(job_ids: str, raw_request: Request):
+    """
+    Stream status changes of several queued jobs.
+    - **job_ids**: Comma-separated job identifiers (at most QUEUE_STATUS_MAX_IDS).
+    Emits a `status` event with each job's current status, error and result right away and again whenever it
+    changes, then a `done` event once every job has reached a final status. Idle streams get a keep-alive
+    comment every QUEUE_EVENTS_KEEPALIVE_S seconds.
+    """
+    ids = list(dict.fromkeys(job_id.strip() for job_id in job_ids.split(",") if job_id.strip()))
+    if not ids:
+        raise HTTPException(status_code=422, detail="job_ids must not be empty.")
+    if len(ids) > QUEUE_STATUS_MAX_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {QUEUE_STATUS_MAX_IDS} job ids per request.")
+
+    def status_event(job_id: str, record: Optional[dict]) -> str:
+        return _sse_event("status", _job_status(job_id, record).dict())
+
+    async def event_stream():
+        async with job_events.subscribe(ids) as events:
+            records = await job_store.aget_many(ids)
+            statuses = {}
+            for job_id in ids:
+                statuses[job_id] = records[job_id]["status"] if records[job_id] else None
+                yield status_event(job_id, records[job_id])
+            while any(status not in TERMINAL_STATUSES for status in statuses.values()):
+                event = await events.get(QUEUE_EVENTS_KEEPALIVE_S)
+                if await raw_request.is_disconnected():
+                    return
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                job_id = event.get("job_id")
+                if job_id not in statuses or statuses[job_id] in TERMINAL_STATUSES:
+                    continue
+                # Re-read rather than trusting the event, which may be a resync or arrive out of order
+                record = await job_store.aget(job_id)
+                status = record["status"] if record else None
+                if status != statuses[job_id]:
+                    statuses[job_id] = status
+                    yield status_event(job_id, record)
+            yield _sse_event("done", {"job_ids": ids, "statuses": statuses})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.delete("/queue/{job_id}", response_model=QueueResponse, summary="Cancel a job", description="Cancel a queued job, or stop a running one early.")
+async def cancel_job(job_id: str):
+    """
+    Cancel a job.
+    - **job_id**: The job identifier.
+    A queued job is marked 'cancelled' and never runs. A running job stops at its next decoding step and is
+    marked 'cancelled' by its worker shortly after. Finished jobs are left as they are.
+    Returns the job's status after the request.
+    """
+    previous = await job_store.acancel(job_id)
+    if previous == "running":
+        await redis_async.publish(JOB_CANCEL_CHANNEL, job_id)
+    record = await job_store.aget(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    return _job_status(job_id, record)
+
+@app.post("/queue/status", response_model=QueueStatusResponse, summary="Get status of many jobs", description="Resolve the status of many queued jobs in one request and one Redis round trip.")
+async def get_job_status_batch(request: QueueStatusRequest):
+    """
+    Get the status/result of several queued jobs.
+    - **job_ids**: The job identifiers (at most QUEUE_STATUS_MAX_IDS).
+    - **include_results**: Set to false to return only statuses and errors.
+    Returns a map from job ID to status, result and error.
+    """
+    if len(request.job_ids) > QUEUE_STATUS_MAX_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {QUEUE_STATUS_MAX_IDS} job ids per request.")
+    if not request.job_ids:
+        return QueueStatusResponse(statuses={})
+    records = await job_store.aget_many(request.job_ids)
+    statuses = {}
+    for job_id in request.job_ids:
+        status = _job_status(job_id, records[job_id])
+        statuses[job_id] = JobStatus(
+            status=status.status,
+            result=status.result if request.include_results else None,
+            error=status.error,
+        )
+    return QueueStatusResponse(statuses=statuses)
+
+@app.get("/workers", summary="Queue worker fleet", description="List live queue workers from their Redis heartbeats, with fleet capacity and queue lag.")
+def workers():
+    """
+    Report the queue-consuming processes and the backlog they face.
+    Returns each live worker's heartbeat (role, loaded models, consumers, busy consumers, jobs/s),
+    fleet totals, and the queue lag: undelivered and pending jobs, the age of the oldest undelivered job,
+    and the estimated time to drain the backlog at the current fleet throughput. job_events counts this
+    replica's long-poll and streaming waiters.
+    """
+    try:
+        fleet = list_workers(redis_client, ttl_s=WORKER_HEARTBEAT_TTL_S)
+        lag = job_queue.lag()
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Redis unavailable: {e}")
+    jobs_per_s = sum(worker.get("jobs_per_s", 0) for worker in fleet)
+    return {
+        "workers": fleet,
+        "fleet": {
+            "workers": len(fleet),
+            "consumers": sum(worker.get("consumers", 0) for worker in fleet),
+            "busy": sum(worker.get("busy", 0) for worker in fleet),
+            "jobs_per_s": round(jobs_per_s, 3),
+        },
+        "queue": {
+            **lag,
+            "estimated_drain_seconds": round(lag["depth"] / jobs_per_s, 1) if jobs_per_s else None,
+        },
+        "job_events": job_events.stats(),
+    }
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+
+async def _export_rows_with_first(first, rows):
+    if first is not None:
+        yield first
+    async for row in rows:
+        yield row
+
+async def _export_rows_ndjson(rows):
+    async for row in rows:
+        yield json.dumps(row, default=str) + "\n"
+
+async def _export_rows_csv(rows, columns: str):
+    buffer = io.StringIO()
+    writer = None
+    async for row in rows:
+        if writer is None:
+            fieldnames = list(row) if columns.strip() == "*" else [c.strip() for c in columns.split(",") if c.strip()]
+            writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction="ignore")
+            writer.writeheader()
+        writer.writerow({k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in row.items()})
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+@app.get("/results/export", summary="Export stored results", description="Stream stored inference results from Supabase as NDJSON or CSV without buffering them.")
+async def export_results(
+    format: str = "ndjson",
+    columns: str = "*",
+    model_name: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    order_by: str = "job_id",
+    limit: Optional[int] = None,
+):
+    """
+    Stream rows from the inference_results table.
+    - **format**: 'ndjson' (default) or 'csv'.
+    - **columns**: Comma-separated columns to export (default all).
+    - **model_name**: Only export results for this model.
+    - **since** / **until**: Only export results created in [since, until) (ISO timestamps).
+    - **order_by**: 'job_id' (default) or 'created_at'; rows are paged with keyset pagination on it.
+    - **limit**: Maximum number of rows to export.
+    Rows are fetched page by page and written out as they arrive. The first page is fetched before the
+    response starts, so a rejected query or an unreachable Supabase is reported with an error status.
+    """
+    if supabase_async is None:
+        raise HTTPException(status_code=503, detail="Supabase credentials not set.")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=422, detail="format must be 'ndjson' or 'csv'.")
+    if order_by not in ("job_id", "created_at"):
+        raise HTTPException(status_code=422, detail="order_by must be 'job_id' or 'created_at'.")
+    _archive_timestamp("since", since)
+    _archive_timestamp("until", until)
+    filters = {}
+    if model_name:
+        filters["model_name"] = f"eq.{model_name}"
+    time_range = []
+    if since:
+        time_range.append(f"created_at.gte.{_quote(since)}")
+    if until:
+        time_range.append(f"created_at.lt.{_quote(until)}")
+    if time_range:
+        filters["and"] = f"({','.join(time_range)})"
+    rows = aiter_inference_results(supabase_async, filters=filters, columns=columns, order_by=order_by, page_size=EXPORT_PAGE_SIZE, limit=limit)
+    try:
+        first = await rows.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except httpx.HTTPStatusError as e:
+        # PostgREST answers 400 for unknown columns or malformed filters; anything else is Supabase's fault
+        status_code = 400 if e.response.status_code == 400 else 502
+        raise HTTPException(status_code=status_code, detail=f"Supabase rejected the export query: {e.response.text}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Supabase unavailable: {e}")
+    rows = _export_rows_with_first(first, rows)
+    if format == "csv":
+        return StreamingResponse(_export_rows_csv(rows, columns), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=inference_results.csv"})
+    return StreamingResponse(_export_rows_ndjson(rows), media_type="application/x-ndjson")
+
+def _archive_timestamp(name: str, value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"{name} must be an ISO timestamp.")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def _archive_or_503() -> ResultArchive:
+    if result_archive is None:
+        raise HTTPException(status_code=503, detail="Result archive disabled (RESULT_ARCHIVE_PATH is empty).")
+    return result_archive
+
+@app.get("/results/archive", summary="Query archived results", description="Filter results in the local result archive without calling Supabase.")
+def query_archived_results(
+    model_name: Optional[str] = None,
+    status: Optional[str] = None,
+    suite: Optional[str] = None,
+    tenant: Optional[str] = None,
+    job_id: Optional[str] = None,
+    passed: Optional[bool] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    include_text: bool = True,
+    limit: int = 100,
+    offset: int = 0,
+):
+    """
+    Read results from the local SQLite archive, newest first.
+    - **model_name** / **status** / **suite** / **tenant** / **job_id** / **passed**: Optional exact-match filters.
+    - **since** / **until**: Only results finished in [since, until) (ISO timestamps, UTC if no offset is given).
+    - **include_text**: Set to false to leave out input_text, parameters and result.
+    - **limit** / **offset**: Page through the matches (limit at most EXPORT_PAGE_SIZE).
+    Only results stored by this host's processes are archived; use /results/export for the full Supabase table.
+    """
+    archive = _archive_or_503()
+    filters = {"model_name": model_name, "status": status, "suite": suite, "tenant": tenant, "job_id": job_id, "passed": passed}
+    rows = archive.query(
+        filters,
+        since=_archive_timestamp("since", since),
+        until=_archive_timestamp("until", until),
+        limit=max(1, min(limit, EXPORT_PAGE_SIZE)),
+        offset=max(0, offset),
+        include_text=include_text,
+    )
+    return {"results": rows, "count": len(rows)}
+
+@app.get("/results/archive/aggregate", summary="Aggregate archived results", description="Count results and pass rates per group from the local result archive.")
+def aggregate_archived_results(
+    group_by: str = "model_name",
+    model_name: Optional[str] = None,
+    status: Optional[str] = None,
+    suite: Optional[str] = None,
+    tenant: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """
+    Aggregate results in the local SQLite archive.
+    - **group_by**: Comma-separated groupings: model_name, status, suite, tenant, day, hour (empty for one total).
+    - **model_name** / **status** / **suite** / **tenant**: Optional exact-match filters.
+    - **since** / **until**: Only results finished in [since, until) (ISO timestamps).
+    Returns per group the number of results, passed/failed/error counts, the pass rate among results with an
+    expected answer, and the average seconds per result, e.g. pass rate per model per day with group_by=model_name,day.
+    """
+    archive = _archive_or_503()
+    filters = {"model_name": model_name, "status": status, "suite": suite, "tenant": tenant}
+    try:
+        groups = archive.aggregate(
+            [key.strip() for key in group_by.split(",") if key.strip()],
+            filters,
+            since=_archive_timestamp("since", since),
+            until=_archive_timestamp("until", until),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"groups": groups, "archive": archive.stats()}
+
+@app.get("/profiles", summary="List stored profiles", description="List the newest stored request and job profiles, requested or captured for slow requests.")
+async def list_profiles(limit: int = 50, x_profile_token: Optional[str] = Header(None)):
+    """
+    List stored profiles.
+    - **limit**: Maximum number of profiles to return, newest first (at most PROFILE_MAX_STORED are kept).
+    Requires the X-Profile-Token header. Returns each profile's id (the job id for queued jobs), trigger
+    ('requested' or 'slow'), duration, model and the traces it holds, plus the profiler's settings and counters.
+    """
+    _check_profile_token(x_profile_token)
+    try:
+        profiles = await request_profiler.store.alist(min(max(limit, 1), PROFILE_MAX_STORED))
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Redis unavailable: {e}")
+    return {"profiles": profiles, "profiler": request_profiler.stats()}
+
+@app.get("/profiles/{profile_id}", summary="Download a profile", description="Download the Chrome trace or the collapsed Python stacks captured for a request or job.")
+async def download_profile(profile_id: str, format: str = "collapsed", x_profile_token: Optional[str] = Header(None)):
+    """
+    Download one trace of a stored profile.
+    - **profile_id**: The profile_id returned by /infer, or the job id of a profiled job.
+    - **format**: 'collapsed' (default) for the sampled Python stacks, for flamegraph.pl or speedscope, or 'chrome'
+      for the torch profiler trace, for chrome://tracing or Perfetto. Slow-request profiles only have 'collapsed'.
+    Requires the X-Profile-Token header.
+    """
+    _check_profile_token(x_profile_token)
+    if format not in ARTIFACTS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {list(ARTIFACTS)}.")
+    try:
+        payload = await request_profiler.store.aget_artifact(profile_id, format)
+        if payload is None:
+            meta = await request_profiler.store.aget_meta(profile_id)
+            if meta is None:
+                raise HTTPException(status_code=404, detail=f"Unknown profile {profile_id}.")
+            raise HTTPException(status_code=404, detail=f"Profile {profile_id} has no {format} trace; it has {meta['artifacts']}.")
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Redis unavailable: {e}")
+    media_type, suffix = ARTIFACTS[format]
+    return Response(payload, media_type=media_type, headers={"Content-Disposition": f"attachment; filename={profile_id}.{suffix}"})
 
 @app.get("/")
 def root():
     return {
         "message": "Welcome to the NCOS_S3 FastAPI backend!",
         "docs": "/docs",
-        "health": "/healthz"
+        "health": "/healthz",
+        "ready": "/readyz",
+        "metrics": "/metrics"
     }
 
-# Add middleware to log every incoming request path and method
+# --- Metrics ---
+# Queue depths and cache counters are read when /metrics is scraped rather than updated on every request.
+def _queue_depth(read_depth):
+    def depth() -> float:
+        try:
+            return read_depth()
+        except redis.RedisError:
+            return float("nan")
+    return depth
+
+QUEUE_DEPTH.labels(JOB_STREAM).set_function(_queue_depth(job_queue.depth))
+QUEUE_DEPTH.labels(JOB_QUEUE).set_function(_queue_depth(lambda: redis_client.llen(JOB_QUEUE)))
+REGISTRY.register(CacheStatsCollector({
+    "result": result_cache.stats,
+    "prefix": prefix_cache.stats,
+    "model": model_registry.stats,
+}))
+
+@app.get("/metrics", summary="Prometheus metrics", description="Expose request latency, stage timings, queue depth, throughput and cache counters in Prometheus text format.")
+def metrics():
+    """
+    Prometheus scrape endpoint.
+    Returns request latency per route, per-stage job timings (queue wait, tokenize, prefill, decode,
+    Redis and Supabase writes), queue depth, tokens generated, model loads and cache hit/miss counters.
+    """
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+# Add middleware to log every incoming request path and method, and time it per route
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     logger.info(f"Incoming request: {request.method} {request.url.path}")
+    started = time.perf_counter()
     response = await call_next(request)
+    # Label by route template (/queue, not /queue?job_id=...) so the number of series stays bounded
+    route = request.scope.get("route")
+    REQUEST_LATENCY.labels(request.method, route.path if route is not None else "unmatched", response.status_code).observe(time.perf_counter() - started)
     return response
 
 # --- End of API contract skeleton ---
@@ -0,0 +1,178 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger("ncos-backend")
+
+
+def extract_generated_text(output) -> str:
+    """
+    Pull the generated text out of a text-generation pipeline output for one prompt.
+    """
+    return output[0]["generated_text"] if output and "generated_text" in output[0] else str(output)
+
+
+def prepare_tokenizer_for_batching(tokenizer):
+    """
+    Make a causal LM tokenizer safe for padded batch generation.
+    GPT-2 style tokenizers ship without a pad token, and decoder-only models
+    must be padded on the left so generation continues from the real prompt.
+    """
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+
+class _PendingRequest:
+    __slots__ = ("input_text", "params", "future", "enqueued_at")
+
+    def __init__(self, input_text: str, params: dict):
+        self.input_text = input_text
+        self.params = params
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    Collects concurrent inference requests for a short window and runs them
+    through the pipeline as one padded batch.
+
+    Requests are grouped by their generation parameters, since only requests
+    with identical parameters can share a generate() call. A group is flushed
+    as soon as it reaches max_batch_size, or once its oldest request has waited
+    max_wait_ms. Batches run one at a time on a single scheduler thread, so
+    requests that arrive while a batch is running are picked up by the next one.
+    """
+
+    def __init__(self, pipe, max_batch_size: int = 8, max_wait_ms: float = 10.0, stats_window: int = 256):
+        self.pipe = pipe
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._groups = {}  # params key -> list of _PendingRequest, oldest first
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._recent = deque(maxlen=stats_window)
+        self._batches = 0
+        self._requests = 0
+        self._size_histogram = {}
+        self._thread = threading.Thread(target=self._run, name="infer-batcher", daemon=True)
+        self._thread.start()
+
+    @property
+    def thread_id(self) -> int:
+        """
+        Identifier of the scheduler thread that runs the batches.
+        """
+        return self._thread.ident
+
+    @staticmethod
+    def _group_key(params: dict) -> str:
+        return json.dumps(params, sort_keys=True, default=str)
+
+    def submit(self, input_text: str, params: dict) -> str:
+        """
+        Queue a prompt for the next compatible batch and block until its text is ready.
+        Raises whatever exception the pipeline raised for this prompt.
+        """
+        return self.submit_async(input_text, params).result()
+
+    def submit_async(self, input_text: str, params: dict) -> Future:
+        """
+        Queue a prompt for the next compatible batch and return a Future for its text.
+        """
+        pending = _PendingRequest(input_text, params)
+        key = self._group_key(params)
+        with self._cond:
+            self._groups.setdefault(key, []).append(pending)
+            self._cond.notify()
+        return pending.future
+
+    def _next_batch(self):
+        """
+        Block until some group is ready to run and pop up to max_batch_size requests from it.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                ready_key = None
+                next_deadline = None
+                for key, items in self._groups.items():
+                    deadline = items[0].enqueued_at + self.max_wait
+                    if len(items) >= self.max_batch_size or deadline <= now:
+                        # Prefer whichever ready group has been waiting longest
+                        if ready_key is None or items[0].enqueued_at < self._groups[ready_key][0].enqueued_at:
+                            ready_key = key
+                    elif next_deadline is None or deadline < next_deadline:
+                        next_deadline = deadline
+                if ready_key is not None:
+                    items = self._groups[ready_key]
+                    batch = items[:self.max_batch_size]
+                    del items[:self.max_batch_size]
+                    if not items:
+                        del self._groups[ready_key]
+                    return batch
+                timeout = None if next_deadline is None else max(0.0, next_deadline - now)
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            waits_ms = [(started - item.enqueued_at) * 1000 for item in batch]
+            params = batch[0].params
+            try:
+                if len(batch) == 1:
+                    outputs = [self.pipe(batch[0].input_text, **params)]
+                else:
+                    outputs = self.pipe([item.input_text for item in batch], batch_size=len(batch), **params)
+                for item, output in zip(batch, outputs):
+                    item.future.set_result(extract_generated_text(output))
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].future.set_exception(e)
+                else:
+                    # One bad prompt should not fail every request it was batched with
+                    logger.error(f"Batch of {len(batch)} failed, retrying individually: {e}")
+                    for item in batch:
+                        if item.future.done():
+                            continue
+                        try:
+                            item.future.set_result(extract_generated_text(self.pipe(item.input_text, **params)))
+                        except Exception as item_error:
+                            item.future.set_exception(item_error)
+            run_ms = (time.monotonic() - started) * 1000
+            self._record(len(batch), waits_ms, run_ms)
+
+    def _record(self, size: int, waits_ms: list, run_ms: float):
+        max_wait_ms = max(waits_ms)
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += size
+            self._size_histogram[size] = self._size_histogram.get(size, 0) + 1
+            self._recent.append({"size": size, "max_wait_ms": round(max_wait_ms, 2), "run_ms": round(run_ms, 2)})
+        logger.info(f"Inference batch: size={size} max_wait_ms={max_wait_ms:.1f} run_ms={run_ms:.1f}")
+
+    def stats(self) -> dict:
+        """
+        Summarize recent batches so the batching window can be tuned against latency.
+        """
+        with self._stats_lock:
+            recent = list(self._recent)
+            summary = {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "requests": self._requests,
+                "avg_batch_size": round(self._requests / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._size_histogram.items())),
+            }
+        if recent:
+            summary["recent_avg_wait_ms"] = round(sum(b["max_wait_ms"] for b in recent) / len(recent), 2)
+            summary["recent_avg_run_ms"] = round(sum(b["run_ms"] for b in recent) / len(recent), 2)
+        summary["recent_batches"] = recent[-20:]
+        return summary
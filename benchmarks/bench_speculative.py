@@ -0,0 +1,101 @@
+"""
+Compare plain and speculative (assisted) greedy decoding on the CPU.
+
+Loads the target and draft models through engine.py exactly as the backend does, generates the same
+prompts both ways, checks that the outputs are identical, and prints the draft acceptance rate and the
+measured speedup as JSON.
+
+    python benchmarks/bench_speculative.py --model gpt2 --draft distilgpt2 --max-new-tokens 64
+    python benchmarks/bench_speculative.py --model tiny    # random tiny pair, no download needed
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_PROMPTS = [
+    "Does this transaction comply with the anti-money-laundering policy?",
+    "Summarize the data retention requirements for customer records.",
+    "List the approvals needed before onboarding a new vendor.",
+    "Explain when a suspicious activity report must be filed.",
+]
+
+
+def load_models(args):
+    os.environ.setdefault("INFERENCE_DEVICE", "cpu")
+    from batching import prepare_tokenizer_for_batching
+    from engine import build_pipeline
+
+    model, draft = args.model, args.draft
+    if model == "tiny":
+        from standins import build_tiny_model
+
+        workdir = tempfile.mkdtemp(prefix="ncos-bench-spec-")
+        model = build_tiny_model(os.path.join(workdir, "tiny-target"), n_layer=4)
+        draft = build_tiny_model(os.path.join(workdir, "tiny-draft"), n_layer=1)
+    target_pipe = build_pipeline(model, prepare_tokenizer=prepare_tokenizer_for_batching)
+    draft_pipe = build_pipeline(draft, prepare_tokenizer=prepare_tokenizer_for_batching)
+    return model, target_pipe, draft, draft_pipe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure speculative decoding acceptance and speedup.")
+    parser.add_argument("--model", default="gpt2", help="Target model name/path, or 'tiny'")
+    parser.add_argument("--draft", default="distilgpt2", help="Draft model sharing the target's tokenizer")
+    parser.add_argument("--prompts", default=None, help="File with one prompt per line (default: built-in prompts)")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the prompts; the first is untimed warm-up")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--num-assistant-tokens", type=int, default=0, help="Draft tokens per step; 0 = adaptive")
+    args = parser.parse_args(argv)
+
+    from speculative import SpeculativeDecoder
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts:
+        with open(args.prompts) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    model, target_pipe, draft, draft_pipe = load_models(args)
+    decoder = SpeculativeDecoder(lambda name: draft_pipe, num_assistant_tokens=args.num_assistant_tokens)
+    params = {"do_sample": False, "max_new_tokens": args.max_new_tokens}
+
+    plain_seconds = speculative_seconds = 0.0
+    mismatches = 0
+    for attempt in range(max(2, args.repeat)):
+        for prompt in prompts:
+            started = time.perf_counter()
+            plain = target_pipe(prompt, **params)[0]["generated_text"]
+            middle = time.perf_counter()
+            assisted = decoder.generate(target_pipe, model, draft, prompt, dict(params))
+            finished = time.perf_counter()
+            if attempt == 0:
+                continue
+            plain_seconds += middle - started
+            speculative_seconds += finished - middle
+            mismatches += plain != assisted
+
+    stats = decoder.stats()["pairs"][0]
+    report = {
+        "model": model,
+        "draft": draft,
+        "prompts": len(prompts),
+        "max_new_tokens": args.max_new_tokens,
+        "outputs_match": mismatches == 0,
+        "mismatches": mismatches,
+        "plain_seconds": round(plain_seconds, 3),
+        "speculative_seconds": round(speculative_seconds, 3),
+        "speedup": round(plain_seconds / speculative_seconds, 2) if speculative_seconds else None,
+        "acceptance_rate": stats["acceptance_rate"],
+        "tokens_per_target_forward": stats["tokens_per_target_forward"],
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Reproducible load tests for the NCOS backend.
+
+Starts app.py under uvicorn against local stand-ins (a stub or tiny local model, fakeredis
+or a local Redis, and a mock PostgREST server), drives concurrent workloads against /infer,
+/queue submit+poll and the queue worker drain rate, and prints machine-readable JSON.
+
+    python benchmarks/run_benchmarks.py --model stub --concurrency 16 --requests 200 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def prepare_environment(args, workdir: str):
+    """
+    Point the app at the stand-ins through its environment variables. Must run before app is imported.
+    """
+    from standins import build_tiny_model, start_mock_postgrest
+
+    postgrest = start_mock_postgrest()
+    os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{postgrest.server_port}"
+    os.environ["SUPABASE_KEY"] = "benchmark"
+    os.environ["SUPABASE_JOURNAL_PATH"] = os.path.join(workdir, "supabase_journal.jsonl")
+    os.environ.setdefault("JOB_WORKER_CONCURRENCY", str(args.workers))
+    os.environ.setdefault("JOB_QUEUE_BLOCK_MS", "1000")
+    if args.model == "stub":
+        # The stub has no tokenizer or weights, so the prefix cache cannot apply
+        os.environ["PREFIX_CACHE_ENABLED"] = "false"
+        os.environ["WARMUP_MAX_NEW_TOKENS"] = "0"
+        model_path = os.path.join(workdir, "stub-model")
+        os.makedirs(model_path, exist_ok=True)
+    elif args.model == "tiny":
+        model_path = build_tiny_model(os.path.join(workdir, "tiny-gpt2"))
+    else:
+        model_path = args.model
+    os.environ["HF_MODEL_NAME"] = model_path
+
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        import fakeredis
+        import redis
+        import redis.asyncio
+        from fakeredis.aioredis import FakeConnection
+        server = fakeredis.FakeServer()
+        redis.Redis.from_url = classmethod(lambda cls, url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+        # The async endpoints' pool gets fake connections to the same server
+        redis.asyncio.BlockingConnectionPool.from_url = classmethod(
+            lambda cls, url, **kwargs: cls(connection_class=FakeConnection, server=server, **kwargs))
+    return postgrest
+
+
+def start_server(args):
+    import uvicorn
+
+    import app as backend
+
+    if args.model == "stub":
+        from standins import StubPipeline
+
+        def load_stub(model_name, path=None):
+            return StubPipeline(per_call_ms=args.stub_call_ms, per_token_ms=args.stub_token_ms)
+
+        backend.model_lifecycle.loader = load_stub
+        backend.model_registry.loader = load_stub
+    port = free_port()
+    config = uvicorn.Config(backend.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, name="uvicorn", daemon=True).start()
+    return backend, server, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(client, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get("/readyz")
+            if response.status_code == 200:
+                return response.json()
+        except Exception:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Backend did not become ready in time.")
+
+
+async def run_concurrently(total: int, concurrency: int, task):
+    """
+    Run task(i) for i in range(total) with at most concurrency in flight. Returns (results, wall seconds).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(i):
+        async with semaphore:
+            return await task(i)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(bounded(i) for i in range(total)))
+    return results, time.perf_counter() - started
+
+
+def parameters(args) -> dict:
+    # Unique prompts plus cache=false keep the result cache from hiding model time
+    return {"max_new_tokens": args.max_new_tokens, "do_sample": False, "cache": False}
+
+
+async def bench_infer(client, args) -> dict:
+    async def one(i):
+        started = time.perf_counter()
+        response = await client.post("/infer", json={"input_text": f"{args.prompt} #{i} {uuid.uuid4().hex[:8]}", "parameters": parameters(args)})
+        ok = response.status_code == 200 and response.json().get("status") == "success"
+        return ok, (time.perf_counter() - started) * 1000
+
+    results, wall = await run_concurrently(args.requests, args.concurrency, one)
+    latencies = [ms for ok, ms in results if ok]
+    return {
+        "requests": args.requests,
+        "errors": sum(1 for ok, _ in results if not ok),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def job_wait_ms(backend, job_ids: list) -> list:
+    records = backend.job_store.get_many(job_ids)
+    waits = []
+    for record in records.values():
+        if record and "started_at" in record and "created_at" in record:
+            waits.append((record["started_at"] - record["created_at"]) * 1000)
+    return waits
+
+
+async def bench_queue(client, backend, args) -> dict:
+    async def one(i):
+        started = time.perf_counter()
+        response = await client.post("/queue", json={"input_text": f"{args.prompt} #{i} {uuid.uuid4().hex[:8]}", "parameters": parameters(args)})
+        job_id = response.json()["job_id"]
+        deadline = started + args.job_timeout
+        while time.perf_counter() < deadline:
+            status = (await client.get("/queue", params={"job_id": job_id})).json()["status"]
+            if status in ("done", "error"):
+                return job_id, status == "done", (time.perf_counter() - started) * 1000
+            await asyncio.sleep(args.poll_interval)
+        return job_id, False, None
+
+    results, wall = await run_concurrently(args.requests, args.concurrency, one)
+    latencies = [ms for _, ok, ms in results if ok]
+    return {
+        "jobs": args.requests,
+        "errors": sum(1 for _, ok, _ in results if not ok),
+        "wall_seconds": round(wall, 3),
+        "throughput_jobs_per_s": round(len(latencies) / wall, 3) if wall else 0.0,
+        "end_to_end_latency_ms": percentiles(latencies),
+        "queue_wait_ms": percentiles(job_wait_ms(backend, [job_id for job_id, _, _ in results])),
+    }
+
+
+async def bench_drain(client, backend, args) -> dict:
+    jobs = [{"input_text": f"{args.prompt} drain #{i} {uuid.uuid4().hex[:8]}", "parameters": parameters(args)} for i in range(args.drain_jobs)]
+    job_ids = []
+    started = time.perf_counter()
+    for start in range(0, len(jobs), backend.QUEUE_BATCH_MAX_JOBS):
+        response = await client.post("/queue/batch", json={"jobs": jobs[start:start + backend.QUEUE_BATCH_MAX_JOBS]})
+        job_ids += response.json()["job_ids"]
+    enqueued = time.perf_counter() - started
+    deadline = started + args.job_timeout
+    remaining = set(job_ids)
+    errors = 0
+    while remaining and time.perf_counter() < deadline:
+        pending = list(remaining)[:backend.QUEUE_STATUS_MAX_IDS]
+        statuses = (await client.post("/queue/status", json={"job_ids": pending, "include_results": False})).json()["statuses"]
+        for job_id, status in statuses.items():
+            if status["status"] in ("done", "error"):
+                remaining.discard(job_id)
+                errors += status["status"] == "error"
+        await asyncio.sleep(args.poll_interval)
+    wall = time.perf_counter() - started
+    completed = len(job_ids) - len(remaining)
+    return {
+        "jobs": len(job_ids),
+        "completed": completed,
+        "errors": errors,
+        "enqueue_seconds": round(enqueued, 3),
+        "drain_seconds": round(wall, 3),
+        "drain_jobs_per_s": round(completed / wall, 3) if wall else 0.0,
+        "queue_wait_ms": percentiles(job_wait_ms(backend, job_ids)),
+    }
+
+
+async def run(args, backend, base_url: str) -> dict:
+    import httpx
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.job_timeout, limits=limits) as client:
+        ready = await wait_ready(client, args.ready_timeout)
+        scenarios = {}
+        for _ in range(args.warmup):
+            await client.post("/infer", json={"input_text": args.prompt, "parameters": parameters(args)})
+        if "infer" in args.scenarios:
+            scenarios["infer"] = await bench_infer(client, args)
+        if "queue" in args.scenarios:
+            scenarios["queue"] = await bench_queue(client, backend, args)
+        if "drain" in args.scenarios:
+            scenarios["drain"] = await bench_drain(client, backend, args)
+    return {"startup": ready, "scenarios": scenarios}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the NCOS backend against local stand-ins.")
+    parser.add_argument("--model", default="stub", help="'stub', 'tiny' (random tiny GPT-2), or a model name/path")
+    parser.add_argument("--redis-url", default=None, help="Use this Redis instead of fakeredis")
+    parser.add_argument("--scenarios", default="infer,queue,drain", help="Comma-separated: infer, queue, drain")
+    parser.add_argument("--requests", type=int, default=100, help="Requests/jobs per infer and queue scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--drain-jobs", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1, help="JOB_WORKER_CONCURRENCY for the backend")
+    parser.add_argument("--max-new-tokens", type=int, default=16)
+    parser.add_argument("--prompt", default="Does this transaction comply with policy?")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--job-timeout", type=float, default=300.0)
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed /infer calls before measuring")
+    parser.add_argument("--stub-call-ms", type=float, default=5.0, help="Stub model: fixed cost per call")
+    parser.add_argument("--stub-token-ms", type=float, default=0.5, help="Stub model: cost per generated token")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+
+    workdir = tempfile.mkdtemp(prefix="ncos-bench-")
+    prepare_environment(args, workdir)
+    backend, server, base_url = start_server(args)
+    try:
+        results = asyncio.run(run(args, backend, base_url))
+    finally:
+        server.should_exit = True
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        **results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
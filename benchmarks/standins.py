@@ -0,0 +1,132 @@
+"""
+Local stand-ins for the benchmark harness: a stub text-generation pipeline, a tiny
+randomly initialized GPT-2 saved to disk, and an in-memory PostgREST server that
+answers the Supabase helpers.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubPipeline:
+    """
+    Mimics a transformers text-generation pipeline without a model: each call sleeps
+    per_call_ms plus per_token_ms for every new token and echoes the prompt with filler text.
+    A list of prompts is handled as one batch, so batching benefits show up as in the real pipeline.
+    """
+
+    def __init__(self, per_call_ms: float = 5.0, per_token_ms: float = 0.5):
+        self.per_call_ms = per_call_ms
+        self.per_token_ms = per_token_ms
+        self.model = None
+        self.tokenizer = None
+        self.device = "cpu"
+        self._lock = threading.Lock()  # One "forward pass" at a time, like a single device
+
+    def __call__(self, inputs, max_new_tokens: int = 128, **kwargs):
+        prompts = inputs if isinstance(inputs, list) else [inputs]
+        with self._lock:
+            time.sleep((self.per_call_ms + self.per_token_ms * max_new_tokens) / 1000.0)
+        outputs = [[{"generated_text": prompt + " ok" * max_new_tokens}] for prompt in prompts]
+        return outputs if isinstance(inputs, list) else outputs[0]
+
+
+def build_tiny_model(path: str, n_layer: int = 2) -> str:
+    """
+    Save a tiny randomly initialized GPT-2 with a character-level tokenizer to path and return it.
+    Generations are gibberish, but every code path (tokenizer, generate, KV cache) is real.
+    Models built with different n_layer share the tokenizer, so they can pair up for speculative decoding.
+    """
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    vocab = {token: i for i, token in enumerate(["<|endoftext|>"] + [chr(c) for c in range(32, 127)])}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<|endoftext|>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer.decoder = decoders.Fuse()
+    fast = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|endoftext|>", bos_token="<|endoftext|>", unk_token="<|endoftext|>")
+    config = GPT2Config(vocab_size=len(vocab), n_positions=1024, n_embd=64, n_layer=n_layer, n_head=2, bos_token_id=0, eos_token_id=0)
+    GPT2LMHeadModel(config).save_pretrained(path)
+    fast.save_pretrained(path)
+    return path
+
+
+class _PostgrestHandler(BaseHTTPRequestHandler):
+    table_path = "/rest/v1/inference_results"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _rows(self):
+        return self.server.rows
+
+    def _reply(self, status: int, body=None):
+        payload = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _matches(self, query: dict):
+        filters = {k: v[0] for k, v in query.items() if k not in ("select", "order", "limit", "offset", "and", "or")}
+        def match(row):
+            for column, condition in filters.items():
+                op, _, value = condition.partition(".")
+                if op == "eq" and str(row.get(column)) != value:
+                    return False
+            return True
+        return match
+
+    def do_POST(self):
+        if urlparse(self.path).path != self.table_path:
+            return self._reply(404)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+        rows = body if isinstance(body, list) else [body]
+        with self.server.lock:
+            self._rows().extend(rows)
+        self._reply(201)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != self.table_path:
+            return self._reply(404)
+        query = parse_qs(url.query)
+        with self.server.lock:
+            rows = [row for row in self._rows() if self._matches(query)(row)]
+        if "limit" in query:
+            rows = rows[:int(query["limit"][0])]
+        self._reply(200, rows)
+
+    def do_PATCH(self):
+        url = urlparse(self.path)
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        match = self._matches(parse_qs(url.query))
+        with self.server.lock:
+            for row in self._rows():
+                if match(row):
+                    row.update(body)
+        self._reply(204)
+
+    def do_DELETE(self):
+        match = self._matches(parse_qs(urlparse(self.path).query))
+        with self.server.lock:
+            self.server.rows[:] = [row for row in self._rows() if not match(row)]
+        self._reply(204)
+
+
+def start_mock_postgrest(host: str = "127.0.0.1", port: int = 0):
+    """
+    Start an in-memory PostgREST stand-in for the inference_results table on a background thread.
+    Returns the server; its rows are in server.rows and its base URL is f"http://{host}:{server.server_port}".
+    """
+    server = ThreadingHTTPServer((host, port), _PostgrestHandler)
+    server.rows = []
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="mock-postgrest", daemon=True).start()
+    return server
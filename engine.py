@@ -0,0 +1,214 @@
+import functools
+import logging
+import os
+import threading
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, LogitsProcessorList, pipeline
+
+from metrics import GENERATION_SECONDS, TOKENS_GENERATED, TOKENS_PER_SECOND, FirstTokenTimer, observe_stage
+
+logger = logging.getLogger("ncos-backend")
+
+# --- Engine Configuration ---
+# INFERENCE_DEVICE: 'auto' (GPU if one is visible, else CPU), 'cuda' or 'cpu'
+INFERENCE_DEVICE = os.getenv("INFERENCE_DEVICE", "auto")
+# CPU-only options; ignored when the model runs on a GPU
+CPU_QUANTIZATION = os.getenv("CPU_QUANTIZATION", "none")  # 'int8' applies dynamic int8 quantization to nn.Linear layers
+CPU_BF16_AUTOCAST = os.getenv("CPU_BF16_AUTOCAST", "false").lower() == "true"  # Run generate() under bf16 autocast
+TORCH_INTRA_OP_THREADS = int(os.getenv("TORCH_INTRA_OP_THREADS", "0"))  # 0 = one per physical core (estimated)
+TORCH_INTER_OP_THREADS = int(os.getenv("TORCH_INTER_OP_THREADS", "0"))  # 0 = leave torch's default
+TORCH_COMPILE = os.getenv("TORCH_COMPILE", "false").lower() == "true"  # Compile the model's forward with torch.compile
+
+_threads_configured = False
+_threads_lock = threading.Lock()
+_engine_stats = {}  # model name -> GenerationStats
+
+
+def select_device(preference: str = INFERENCE_DEVICE) -> str:
+    """
+    Pick the device to run on: a GPU when one is available (unless 'cpu' is forced), otherwise the CPU.
+    """
+    if preference == "cpu":
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda:0"
+    if preference == "cuda":
+        logger.warning("INFERENCE_DEVICE=cuda but no GPU is available; falling back to CPU.")
+    return "cpu"
+
+
+def configure_cpu_threads():
+    """
+    Size torch's intra-op and inter-op thread pools to the host. Only the first call has an effect,
+    since torch does not allow changing the inter-op pool once work has run.
+    """
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+        intra = TORCH_INTRA_OP_THREADS or max(1, (os.cpu_count() or 2) // 2)
+        torch.set_num_threads(intra)
+        if TORCH_INTER_OP_THREADS:
+            try:
+                torch.set_num_interop_threads(TORCH_INTER_OP_THREADS)
+            except RuntimeError as e:
+                logger.warning(f"Could not set inter-op threads: {e}")
+        logger.info(f"Torch CPU threads: intra-op={torch.get_num_threads()} inter-op={torch.get_num_interop_threads()}")
+
+
+class GenerationStats:
+    """
+    Running count of generated tokens and time spent in generate() for one model.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self.last_tokens_per_s = 0.0
+
+    def record(self, tokens: int, seconds: float):
+        with self._lock:
+            self.calls += 1
+            self.tokens += tokens
+            self.seconds += seconds
+            if seconds > 0:
+                self.last_tokens_per_s = tokens / seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "tokens": self.tokens,
+                "seconds": round(self.seconds, 3),
+                "tokens_per_s": round(self.tokens / self.seconds, 2) if self.seconds else 0.0,
+                "last_tokens_per_s": round(self.last_tokens_per_s, 2),
+            }
+
+
+def _instrument_generate(model, model_name: str, stats: GenerationStats, bf16_autocast: bool):
+    """
+    Wrap model.generate so every call (from the pipeline or from streaming) is timed and
+    its new tokens counted, and optionally runs under CPU bf16 autocast.
+    The time to the first next-token scores is recorded as the prefill stage, the rest as decode.
+    """
+    generate = model.generate
+    tokens_generated = TOKENS_GENERATED.labels(model_name)
+    generation_seconds = GENERATION_SECONDS.labels(model_name)
+    tokens_per_second = TOKENS_PER_SECOND.labels(model_name)
+
+    @functools.wraps(generate)
+    def timed_generate(*args, **kwargs):
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        prompt_length = input_ids.shape[-1] if input_ids is not None else 0
+        first_token = FirstTokenTimer()
+        kwargs["logits_processor"] = LogitsProcessorList([*(kwargs.get("logits_processor") or []), first_token])
+        started = time.perf_counter()
+        if bf16_autocast:
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                output = generate(*args, **kwargs)
+        else:
+            output = generate(*args, **kwargs)
+        finished = time.perf_counter()
+        if first_token.first_token_at is not None:
+            observe_stage("prefill", first_token.first_token_at - started)
+            observe_stage("decode", finished - first_token.first_token_at)
+        sequences = getattr(output, "sequences", output)
+        if isinstance(sequences, torch.Tensor):
+            tokens = sequences.shape[0] * max(0, sequences.shape[-1] - prompt_length)
+            stats.record(tokens, finished - started)
+            tokens_generated.inc(tokens)
+            generation_seconds.inc(finished - started)
+            if finished > started:
+                tokens_per_second.observe(tokens / (finished - started))
+        return output
+
+    model.generate = timed_generate
+
+
+def _instrument_preprocess(pipe):
+    """
+    Time the pipeline's preprocess step, which tokenizes the prompt(s), as the tokenize stage.
+    """
+    preprocess = pipe.preprocess
+
+    @functools.wraps(preprocess)
+    def timed_preprocess(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return preprocess(*args, **kwargs)
+        finally:
+            observe_stage("tokenize", time.perf_counter() - started)
+
+    pipe.preprocess = timed_preprocess
+    return pipe
+
+
+def build_pipeline(model_name: str, prepare_tokenizer=None, path: str = None):
+    """
+    Load a tokenizer and causal LM and wrap them in a text-generation pipeline on the selected device.
+    On CPU the configured quantization, thread and compile options are applied.
+    path is where to load from, e.g. a downloaded snapshot; model_name (also the default path) keys the
+    engine stats and metrics.
+    """
+    device = select_device()
+    path = path or model_name
+    logger.info(f"Loading model: {model_name} on {device}")
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    if prepare_tokenizer is not None:
+        tokenizer = prepare_tokenizer(tokenizer)
+    model = AutoModelForCausalLM.from_pretrained(path)
+    model.eval()
+    bf16_autocast = False
+    if device == "cpu":
+        configure_cpu_threads()
+        if CPU_QUANTIZATION == "int8":
+            model = quantize_int8(model)
+        bf16_autocast = CPU_BF16_AUTOCAST
+    if TORCH_COMPILE:
+        try:
+            model.forward = torch.compile(model.forward, dynamic=True)
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable for {model_name}, using eager mode: {e}")
+    stats = _engine_stats.setdefault(model_name, GenerationStats())
+    _instrument_generate(model, model_name, stats, bf16_autocast)
+    return _instrument_preprocess(pipeline("text-generation", model=model, tokenizer=tokenizer, device=device))
+
+
+def quantize_int8(model):
+    """
+    Apply dynamic int8 quantization to the model's nn.Linear layers (weights int8, activations quantized on the fly).
+    Models built from other layer types, such as GPT-2's Conv1D, are left unchanged.
+    """
+    linear_layers = sum(1 for module in model.modules() if isinstance(module, torch.nn.Linear))
+    if linear_layers == 0:
+        logger.warning("CPU_QUANTIZATION=int8 requested but the model has no nn.Linear layers; running unquantized.")
+        return model
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    logger.info(f"Quantized {linear_layers} linear layers to int8.")
+    return quantized
+
+
+def engine_report() -> dict:
+    """
+    Describe the engine configuration and the tokens/s achieved per model.
+    """
+    device = select_device()
+    report = {
+        "device": device,
+        "cuda_available": torch.cuda.is_available(),
+        "torch_compile": TORCH_COMPILE,
+        "models": {name: stats.snapshot() for name, stats in _engine_stats.items()},
+    }
+    if device == "cpu":
+        report.update({
+            "cpu_quantization": CPU_QUANTIZATION,
+            "cpu_bf16_autocast": CPU_BF16_AUTOCAST,
+            "intra_op_threads": torch.get_num_threads(),
+            "inter_op_threads": torch.get_num_interop_threads(),
+        })
+    return report
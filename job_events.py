@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import redis
+
+logger = logging.getLogger("ncos-backend")
+
+TERMINAL_STATUSES = ("done", "error", "cancelled", "expired")
+
+
+class JobEventHub:
+    """
+    One Redis pub/sub subscription per process that fans job status events out to
+    every local waiter, so long-polling and streaming clients cost no Redis
+    connections or polling of their own.
+
+    Workers publish {"job_id": ..., "status": ...} on the channel whenever a job
+    changes status (see JobStore). Waiters register callbacks for the job ids they
+    care about; callbacks run on the listener thread and must not block. Whenever
+    the subscription is confirmed (at start-up, and again after it dropped), every
+    waiter gets a {"status": "resync"} event, since events published before that
+    were lost and statuses must be re-read. Call start() before serving so the
+    first waiters do not depend on that.
+    """
+
+    def __init__(self, redis_client, channel: str = "ncos_job_events"):
+        self.redis = redis_client
+        self.channel = channel
+        self._waiters = {}  # job id -> set of callbacks
+        self._lock = threading.Lock()
+        self._thread = None
+        self._subscribed = threading.Event()
+        self.events = 0
+
+    def start(self, timeout: float = 5.0) -> bool:
+        """
+        Start the listener and wait up to timeout seconds for the subscription to be confirmed.
+        Returns whether it was; if not, the listener keeps retrying in the background.
+        """
+        self._ensure_started()
+        return self._subscribed.wait(timeout)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name="job-events", daemon=True)
+                self._thread.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    kind = message.get("type")
+                    if kind == "subscribe":
+                        # Only now are events delivered; waiters added before may have missed some
+                        self._subscribed.set()
+                        self._broadcast_resync()
+                    elif kind == "message":
+                        self._dispatch(message["data"])
+            except redis.RedisError as e:
+                self._subscribed.clear()
+                logger.error(f"Job event subscription failed, reconnecting: {e}")
+                time.sleep(1)
+
+    def _dispatch(self, data: bytes):
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return
+        self.events += 1
+        with self._lock:
+            callbacks = list(self._waiters.get(event.get("job_id"), ()))
+        for callback in callbacks:
+            callback(event)
+
+    def _broadcast_resync(self):
+        with self._lock:
+            waiters = [(job_id, callback) for job_id, callbacks in self._waiters.items() for callback in callbacks]
+        for job_id, callback in waiters:
+            callback({"job_id": job_id, "status": "resync"})
+
+    def add(self, job_ids, callback):
+        """
+        Call callback(event) for every event about one of job_ids until remove() is called.
+        """
+        self._ensure_started()
+        with self._lock:
+            for job_id in job_ids:
+                self._waiters.setdefault(job_id, set()).add(callback)
+
+    def remove(self, job_ids, callback):
+        with self._lock:
+            for job_id in job_ids:
+                callbacks = self._waiters.get(job_id)
+                if callbacks is not None:
+                    callbacks.discard(callback)
+                    if not callbacks:
+                        del self._waiters[job_id]
+
+    def subscribe(self, job_ids) -> "EventSubscription":
+        """
+        Return an async subscription for job_ids; use it as a context manager on the event loop.
+        """
+        return EventSubscription(self, list(job_ids))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"watched_jobs": len(self._waiters), "waiters": sum(len(c) for c in self._waiters.values()), "events": self.events,
+                    "subscribed": self._subscribed.is_set()}
+
+
+class EventSubscription:
+    """
+    Delivers a JobEventHub's events for some job ids to an asyncio.Queue.
+    """
+
+    def __init__(self, hub: JobEventHub, job_ids: list):
+        self.hub = hub
+        self.job_ids = job_ids
+        self.queue = asyncio.Queue()
+        self._loop = None
+
+    def _callback(self, event: dict):
+        try:
+            self._loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # The event loop has shut down
+            pass
+
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self.hub.add(self.job_ids, self._callback)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.hub.remove(self.job_ids, self._callback)
+
+    async def get(self, timeout: float):
+        """
+        Wait up to timeout seconds for the next event; returns None on timeout.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
@@ -0,0 +1,527 @@
+import ast
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import redis
+
+from job_store import decode_job, encode_job
+
+logger = logging.getLogger("ncos-backend")
+
+
+class StreamJobQueue:
+    """
+    Job queue on a Redis Stream with a consumer group.
+
+    Consumers block in XREADGROUP instead of polling, so a job is picked up as soon
+    as it is added. A delivered job stays in the group's pending list until the
+    consumer acks it; jobs left pending longer than the visibility timeout (for
+    example because their worker crashed) are reclaimed by another consumer with
+    XAUTOCLAIM. Jobs that keep failing to complete are dead-lettered after
+    max_deliveries attempts.
+
+    Reading across streams and renewing the leases of running jobs is done by
+    LaneJobQueue, which owns one StreamJobQueue per stream.
+    """
+
+    def __init__(self, redis_client, stream: str, group: str, visibility_timeout_ms: int = 300000,
+                 max_deliveries: int = 3):
+        self.redis = redis_client
+        self.stream = stream
+        self.group = group
+        self.visibility_timeout_ms = visibility_timeout_ms
+        self.max_deliveries = max_deliveries
+
+    def ensure_group(self):
+        """
+        Create the stream and consumer group if they do not exist yet.
+        """
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {self.stream}.")
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def migrate_legacy_list(self, list_key: str) -> int:
+        """
+        Move jobs left in the old list-based queue into the stream.
+        Legacy entries were written with str(dict), so they are parsed with ast.literal_eval.
+        """
+        moved = 0
+        while True:
+            raw = self.redis.lpop(list_key)
+            if raw is None:
+                break
+            try:
+                job = ast.literal_eval(raw.decode("utf-8"))
+            except (ValueError, SyntaxError) as e:
+                logger.error(f"Dropping unreadable legacy job from {list_key}: {e}")
+                continue
+            self.enqueue(job)
+            moved += 1
+        if moved:
+            logger.info(f"Migrated {moved} jobs from {list_key} to {self.stream}.")
+        return moved
+
+    def enqueue(self, job: dict) -> str:
+        """
+        Append a job to the stream and return its entry id.
+        """
+        return self.redis.xadd(self.stream, {"job": encode_job(job)}).decode("utf-8")
+
+    def lag(self) -> dict:
+        """
+        Describe the backlog: jobs not yet delivered to any consumer, jobs delivered but not acked,
+        and how long the oldest undelivered job has been waiting (entry ids carry their enqueue time).
+        Acked entries are deleted, so everything left in the stream is either pending or undelivered.
+        """
+        length = self.redis.xlen(self.stream)
+        try:
+            pending_count = self.redis.xpending(self.stream, self.group)["pending"]
+            oldest = self.peek(1)
+        except redis.ResponseError as e:
+            if "NOGROUP" not in str(e):
+                raise
+            # No consumer has created the group yet, so nothing has been delivered
+            pending_count = 0
+            oldest = self._decode(self.redis.xrange(self.stream, count=1))
+        oldest_age = None
+        if oldest:
+            enqueued_ms = int(oldest[0][0].split("-")[0])
+            oldest_age = round(max(0.0, time.time() - enqueued_ms / 1000.0), 3)
+        return {
+            "depth": length,
+            "pending": pending_count,
+            "undelivered": max(0, length - pending_count),
+            "oldest_undelivered_age_s": oldest_age,
+        }
+
+    @staticmethod
+    def _decode(entries) -> list:
+        jobs = []
+        for entry_id, fields in entries:
+            if not fields:
+                # The entry was deleted after being delivered; nothing left to run
+                continue
+            jobs.append((entry_id.decode("utf-8"), decode_job(fields[b"job"])))
+        return jobs
+
+    def peek(self, count: int) -> list:
+        """
+        Return up to count (entry_id, job) pairs that have not been delivered to any consumer yet, without claiming them.
+        """
+        last_delivered = "0-0"
+        for info in self.redis.xinfo_groups(self.stream):
+            if info["name"].decode("utf-8") == self.group:
+                last_delivered = info["last-delivered-id"].decode("utf-8")
+                break
+        return self._decode(self.redis.xrange(self.stream, min=f"({last_delivered}", count=count))
+
+    def reclaim(self, consumer: str, count: int = 10) -> list:
+        """
+        Take over jobs whose consumer has not acked them within the visibility timeout.
+        Jobs that have already been delivered max_deliveries times are returned with
+        their delivery count so the caller can dead-letter them.
+        """
+        response = self.redis.xautoclaim(self.stream, self.group, consumer, self.visibility_timeout_ms, start_id="0-0", count=count)
+        claimed = self._decode(response[1])
+        reclaimed = []
+        for entry_id, job in claimed:
+            pending = self.redis.xpending_range(self.stream, self.group, min=entry_id, max=entry_id, count=1)
+            deliveries = pending[0]["times_delivered"] if pending else 1
+            logger.warning(f"Reclaimed stalled job {job.get('job_id')} (delivery {deliveries}).")
+            reclaimed.append((entry_id, job, deliveries))
+        return reclaimed
+
+    def ack(self, entry_id: str):
+        """
+        Mark a job as done and remove it from the stream.
+        """
+        pipe = self.redis.pipeline()
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        pipe.execute()
+
+    def renew(self, consumer: str, entry_id: str):
+        """
+        Reset the idle time of a pending job, so it is not reclaimed while consumer is still working on it.
+        """
+        # XCLAIM to the same consumer resets the entry's idle time
+        self.redis.xclaim(self.stream, self.group, consumer, 0, [entry_id], justid=True)
+
+
+QueueEntry = namedtuple("QueueEntry", ["stream", "entry_id", "lane", "seq"])
+
+# Append a job to its lane stream and number it, so its queue position can be computed later
+# as (its number - jobs delivered from that stream). KEYS: stream, counters hash, job hash.
+_ENQUEUE_SCRIPT = """
+local seq = redis.call('HINCRBY', KEYS[2], KEYS[1] .. '|enqueued', 1)
+redis.call('XADD', KEYS[1], '*', 'job', ARGV[1], 'seq', seq)
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('HSET', KEYS[3], 'stream', KEYS[1], 'seq', seq)
+end
+return seq
+"""
+
+
+class LaneJobQueue:
+    """
+    Priority lanes with weighted fair scheduling across tenants, on top of one
+    StreamJobQueue per (lane, tenant) stream.
+
+    Jobs for the default lane and tenant go to the base stream, so existing producers
+    and queued entries keep working; every other combination gets `<stream>:<lane>:<tenant>`.
+    A counters hash records how many jobs were enqueued into and delivered from each
+    stream, which gives both the backlog used for scheduling and each job's position.
+
+    Consumers pick streams by stride scheduling: each stream advances a virtual clock by
+    1/weight per job served and the stream with the lowest clock goes next. A lane's
+    weight is split evenly between its tenants that have work, so a 10k-case run under one
+    tenant cannot starve another tenant in the same lane, and higher lanes get
+    proportionally more turns without starving lower ones. When the counters show no work
+    (they are advisory), consumers fall back to a blocking read across all streams.
+
+    Producers and status readers on an event loop use the a-prefixed coroutines over the
+    redis.asyncio client attached with use_async(); consumers stay on the blocking client.
+    """
+
+    def __init__(self, redis_client, stream: str, group: str, lanes: dict, default_lane: str,
+                 job_key_prefix: str = "ncos_job:", visibility_timeout_ms: int = 300000,
+                 max_deliveries: int = 3, block_ms: int = 5000):
+        self.redis = redis_client
+        self.stream = stream
+        self.group = group
+        self.lanes = lanes  # lane name -> weight, highest priority first
+        self.default_lane = default_lane
+        self.job_key_prefix = job_key_prefix
+        self.visibility_timeout_ms = visibility_timeout_ms
+        self.max_deliveries = max_deliveries
+        self.block_ms = block_ms
+        self.counters_key = f"{stream}:counters"
+        self._queues = {}  # stream name -> StreamJobQueue
+        self._queues_lock = threading.Lock()
+        self._pass = {}  # stream name -> virtual time of its next turn
+        self._schedule_lock = threading.Lock()
+        self._inflight = {}  # (stream, entry id) -> consumer name
+        self._inflight_lock = threading.Lock()
+        self._lease_thread = None
+        self._enqueue_script = redis_client.register_script(_ENQUEUE_SCRIPT)
+        self.async_redis = None
+        self._aenqueue_script = None
+
+    def use_async(self, async_redis):
+        """
+        Attach the redis.asyncio client used by the coroutine methods, or detach it with None.
+        """
+        self.async_redis = async_redis
+        self._aenqueue_script = async_redis.register_script(_ENQUEUE_SCRIPT) if async_redis is not None else None
+
+    # --- Streams ---
+
+    def stream_for(self, lane: str = None, tenant: str = None) -> str:
+        lane = lane or self.default_lane
+        tenant = tenant or "default"
+        if lane == self.default_lane and tenant == "default":
+            return self.stream
+        return f"{self.stream}:{lane}:{tenant}"
+
+    def lane_of(self, stream: str) -> str:
+        if stream == self.stream:
+            return self.default_lane
+        return stream[len(self.stream) + 1:].split(":", 1)[0]
+
+    def lane_rank(self, lane: str) -> int:
+        ranks = list(self.lanes)
+        return ranks.index(lane) if lane in ranks else len(ranks)
+
+    def _queue(self, stream: str) -> StreamJobQueue:
+        with self._queues_lock:
+            queue = self._queues.get(stream)
+            if queue is None:
+                queue = StreamJobQueue(self.redis, stream, self.group, self.visibility_timeout_ms, self.max_deliveries)
+                queue.ensure_group()
+                self._queues[stream] = queue
+            return queue
+
+    def _counters(self) -> dict:
+        """
+        Return {stream: (enqueued, delivered)} for every stream that has ever had a job.
+        """
+        return self._parse_counters(self.redis.hgetall(self.counters_key))
+
+    async def _acounters(self) -> dict:
+        return self._parse_counters(await self.async_redis.hgetall(self.counters_key))
+
+    def _parse_counters(self, fields: dict) -> dict:
+        counters = {self.stream: [0, 0]}
+        for field, value in fields.items():
+            stream, _, kind = field.decode("utf-8").rpartition("|")
+            counters.setdefault(stream, [0, 0])[0 if kind == "enqueued" else 1] = int(value)
+        return {stream: tuple(values) for stream, values in counters.items()}
+
+    def backlog(self) -> dict:
+        """
+        Undelivered jobs per stream, from the counters.
+        """
+        return {stream: max(0, enqueued - delivered) for stream, (enqueued, delivered) in self._counters().items()}
+
+    def ensure_group(self):
+        self._queue(self.stream)
+        for stream in self._counters():
+            self._queue(stream)
+
+    def migrate_legacy_list(self, list_key: str) -> int:
+        return self._queue(self.stream).migrate_legacy_list(list_key)
+
+    # --- Producing ---
+
+    async def aenqueue_many(self, jobs: list, pipe):
+        """
+        Add jobs to their lane streams, queueing the commands on pipe, a redis.asyncio pipeline the caller
+        executes. The job hashes must already exist (or be created earlier in the same pipeline) so the job's
+        stream and sequence number can be recorded in them.
+        """
+        for job in jobs:
+            stream = self.stream_for(job.get("priority"), job.get("tenant"))
+            await self._aenqueue_script(
+                keys=[stream, self.counters_key, self.job_key_prefix + job["job_id"]],
+                args=[encode_job(job)],
+                client=pipe,
+            )
+
+    # --- Consuming ---
+
+    def _schedule(self, backlog: dict, count: int, preferred: set = None) -> list:
+        """
+        Choose the streams to take the next count jobs from, by stride scheduling.
+        If preferred is given, a stream not in it gives its turn to a preferred stream of the same lane.
+        """
+        active = [stream for stream, waiting in backlog.items() if waiting > 0]
+        if not active:
+            return []
+        tenants = {}
+        for stream in active:
+            lane = self.lane_of(stream)
+            tenants[lane] = tenants.get(lane, 0) + 1
+        stride = {stream: tenants[self.lane_of(stream)] / self.lanes.get(self.lane_of(stream), 1) for stream in active}
+        remaining = dict(backlog)
+        picks = []
+        with self._schedule_lock:
+            # Streams that were idle resume at the current virtual time instead of cashing in saved turns
+            known = [self._pass[stream] for stream in active if stream in self._pass]
+            now = min(known) if known else 0.0
+            for stream in active:
+                self._pass[stream] = max(self._pass.get(stream, now), now)
+            for _ in range(count):
+                candidates = [stream for stream in active if remaining[stream] > 0]
+                if not candidates:
+                    break
+                stream = min(candidates, key=lambda s: (self._pass[s], self.lane_rank(self.lane_of(s))))
+                if preferred is not None and stream not in preferred:
+                    # Only a stream's first job was checked against the preference
+                    alternatives = [s for s in candidates if s in preferred and remaining[s] == backlog[s]
+                                    and self.lane_of(s) == self.lane_of(stream)]
+                    if alternatives:
+                        stream = min(alternatives, key=lambda s: self._pass[s])
+                self._pass[stream] += stride[stream]
+                remaining[stream] -= 1
+                picks.append(stream)
+        return picks
+
+    def _entries(self, response) -> list:
+        entries = []
+        for stream_name, stream_entries in response or []:
+            stream = stream_name.decode("utf-8") if isinstance(stream_name, bytes) else stream_name
+            for entry_id, fields in stream_entries:
+                if not fields:
+                    continue
+                seq = int(fields[b"seq"]) if b"seq" in fields else None
+                entries.append((QueueEntry(stream, entry_id.decode("utf-8"), self.lane_of(stream), seq), decode_job(fields[b"job"])))
+        return entries
+
+    def _count_delivered(self, entries: list):
+        # Only numbered entries were counted on the way in (migrated legacy jobs are not)
+        delivered = {}
+        for entry, _ in entries:
+            if entry.seq is not None:
+                delivered[entry.stream] = delivered.get(entry.stream, 0) + 1
+        if delivered:
+            pipe = self.redis.pipeline(transaction=False)
+            for stream, n in delivered.items():
+                pipe.hincrby(self.counters_key, f"{stream}|delivered", n)
+            pipe.execute()
+
+    def _preferred_streams(self, backlog: dict, prefer) -> set:
+        """
+        Streams whose next undelivered job satisfies prefer(job). Only lanes with several active streams are
+        checked, since a stream's jobs can only be taken in order.
+        """
+        active = [stream for stream, waiting in backlog.items() if waiting > 0]
+        lanes = {}
+        for stream in active:
+            lanes.setdefault(self.lane_of(stream), []).append(stream)
+        preferred = set()
+        for streams in lanes.values():
+            if len(streams) < 2:
+                continue
+            for stream in streams:
+                head = self._queue(stream).peek(1)
+                if head and prefer(head[0][1]):
+                    preferred.add(stream)
+        return preferred
+
+    def read(self, consumer: str, count: int = 1, prefer=None) -> list:
+        """
+        Take up to count jobs, in scheduling order, as (QueueEntry, job) pairs.
+        Blocks up to block_ms when no stream has work.
+
+        With prefer, a predicate on jobs, a stream whose next job fails it yields its turn to another stream
+        of the same lane whose next job passes (e.g. to run jobs for already-loaded models first). The yielding
+        stream keeps its place, and no more than count jobs are claimed.
+        """
+        backlog = self.backlog()
+        preferred = self._preferred_streams(backlog, prefer) if prefer is not None else None
+        picks = self._schedule(backlog, count, preferred)
+        entries = []
+        if picks:
+            wanted = {}
+            for stream in picks:
+                wanted[stream] = wanted.get(stream, 0) + 1
+                self._queue(stream)
+            pipe = self.redis.pipeline(transaction=False)
+            for stream, n in wanted.items():
+                pipe.xreadgroup(self.group, consumer, {stream: ">"}, count=n)
+            by_stream = {}
+            for response in pipe.execute():
+                for entry in self._entries(response):
+                    by_stream.setdefault(entry[0].stream, []).append(entry)
+            for stream in picks:
+                if by_stream.get(stream):
+                    entries.append(by_stream[stream].pop(0))
+        if not entries:
+            streams = {stream: ">" for stream in self._counters()}
+            for stream in streams:
+                self._queue(stream)
+            entries = self._entries(self.redis.xreadgroup(self.group, consumer, streams, count=1, block=self.block_ms))
+        self._count_delivered(entries)
+        return entries
+
+    def peek(self, count: int) -> list:
+        """
+        Return up to count undelivered (QueueEntry, job) pairs without claiming them, highest lane first.
+        """
+        backlog = self.backlog()
+        entries = []
+        for stream in sorted(backlog, key=lambda s: self.lane_rank(self.lane_of(s))):
+            if len(entries) >= count:
+                break
+            if backlog[stream] > 0:
+                for entry_id, job in self._queue(stream).peek(count - len(entries)):
+                    entries.append((QueueEntry(stream, entry_id, self.lane_of(stream), None), job))
+        return entries
+
+    def reclaim(self, consumer: str, count: int = 10) -> list:
+        """
+        Take over up to count stalled jobs across all streams; returns (QueueEntry, job, deliveries) triples.
+        """
+        reclaimed = []
+        for stream in self._counters():
+            if len(reclaimed) >= count:
+                break
+            for entry_id, job, deliveries in self._queue(stream).reclaim(consumer, count - len(reclaimed)):
+                reclaimed.append((QueueEntry(stream, entry_id, self.lane_of(stream), None), job, deliveries))
+        return reclaimed
+
+    def ack(self, entry: QueueEntry):
+        self.release(entry)
+        self._queue(entry.stream).ack(entry.entry_id)
+
+    def release(self, entry: QueueEntry):
+        """
+        Stop renewing the lease on entry without acking it, so it is reclaimed after the visibility timeout.
+        """
+        with self._inflight_lock:
+            self._inflight.pop((entry.stream, entry.entry_id), None)
+
+    def hold(self, consumer: str, entry: QueueEntry):
+        """
+        Keep renewing the lease on entry for consumer until it is acked.
+        """
+        with self._inflight_lock:
+            self._inflight[(entry.stream, entry.entry_id)] = consumer
+            if self._lease_thread is None:
+                self._lease_thread = threading.Thread(target=self._renew_leases, name="job-queue-lease", daemon=True)
+                self._lease_thread.start()
+
+    def _renew_leases(self):
+        interval = max(self.visibility_timeout_ms / 3000.0, 0.1)
+        while True:
+            time.sleep(interval)
+            with self._inflight_lock:
+                inflight = list(self._inflight.items())
+            for (stream, entry_id), consumer in inflight:
+                try:
+                    self._queue(stream).renew(consumer, entry_id)
+                except Exception as e:
+                    logger.error(f"Failed to renew lease for queue entry {entry_id}: {e}")
+
+    # --- Reporting ---
+
+    def depth(self) -> int:
+        """
+        Jobs in all lane streams, including ones currently being processed.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for stream in self._counters():
+            pipe.xlen(stream)
+        return sum(pipe.execute())
+
+    async def adepth(self) -> int:
+        pipe = self.async_redis.pipeline(transaction=False)
+        for stream in await self._acounters():
+            pipe.xlen(stream)
+        return sum(await pipe.execute())
+
+    async def aposition(self, stream: str, seq: int) -> int:
+        """
+        Estimate how many jobs will be started before job number seq of stream, or -1 once it has been delivered.
+        Jobs in other streams are counted by their share of turns under the current weights.
+        """
+        return self._position(await self._acounters(), stream, seq)
+
+    def _position(self, counters: dict, stream: str, seq: int) -> int:
+        enqueued, delivered = counters.get(stream, (0, 0))
+        ahead = seq - delivered - 1
+        if ahead < 0:
+            return -1
+        backlog = {s: max(0, e - d) for s, (e, d) in counters.items()}
+        backlog[stream] = max(backlog.get(stream, 0), 1)
+        tenants = {}
+        for s, waiting in backlog.items():
+            if waiting > 0:
+                tenants[self.lane_of(s)] = tenants.get(self.lane_of(s), 0) + 1
+        weight = {s: self.lanes.get(self.lane_of(s), 1) / tenants[self.lane_of(s)] for s, waiting in backlog.items() if waiting > 0}
+        position = ahead
+        for s, waiting in backlog.items():
+            if s != stream and waiting > 0:
+                position += min(waiting, int((ahead + 1) * weight[s] / weight[stream]))
+        return position
+
+    def lag(self) -> dict:
+        """
+        Aggregate StreamJobQueue.lag() over all streams, with the undelivered backlog per lane.
+        """
+        totals = {"depth": 0, "pending": 0, "undelivered": 0, "oldest_undelivered_age_s": None, "lanes": {}}
+        for stream in self._counters():
+            lag = self._queue(stream).lag()
+            for field in ("depth", "pending", "undelivered"):
+                totals[field] += lag[field]
+            lane = self.lane_of(stream)
+            totals["lanes"][lane] = totals["lanes"].get(lane, 0) + lag["undelivered"]
+            age = lag["oldest_undelivered_age_s"]
+            if age is not None and (totals["oldest_undelivered_age_s"] is None or age > totals["oldest_undelivered_age_s"]):
+                totals["oldest_undelivered_age_s"] = age
+        return totals
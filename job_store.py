@@ -0,0 +1,227 @@
+import json
+import time
+import zlib
+from typing import Optional
+
+# --- Job Codec ---
+
+def encode_job(job: dict) -> bytes:
+    """
+    Serialize a job as compact JSON (no whitespace between separators).
+    """
+    return json.dumps(job, separators=(",", ":")).encode("utf-8")
+
+def decode_job(data: bytes) -> dict:
+    return json.loads(data)
+
+def encode_text(text: str, compress_min_bytes: int) -> tuple:
+    """
+    Encode text for storage, zlib-compressing it when it is at least compress_min_bytes long.
+    Returns (payload, encoding) where encoding is 'zlib' or 'utf-8'.
+    """
+    raw = text.encode("utf-8")
+    if len(raw) >= compress_min_bytes:
+        compressed = zlib.compress(raw, 6)
+        if len(compressed) < len(raw):
+            return compressed, "zlib"
+    return raw, "utf-8"
+
+def decode_text(payload: bytes, encoding: str) -> str:
+    if encoding == "zlib":
+        payload = zlib.decompress(payload)
+    return payload.decode("utf-8")
+
+
+class JobStore:
+    """
+    One Redis hash per job (`ncos_job:<id>`) holding its status, timestamps, model
+    and result, with an expiry so finished jobs do not accumulate forever.
+
+    Statuses move queued -> running -> done | error. A queued job can also end up
+    cancelled (DELETE /queue/<id>, or while running if generation was stopped) or
+    expired (its deadline passed before a worker got to it). Results larger than
+    compress_min_bytes are stored zlib-compressed. Jobs written before hashes were
+    introduced only have an `ncos_job_result:<id>` string key; those are still
+    read as a fallback.
+
+    If events_channel is set, every status change is also published there as
+    {"job_id": ..., "status": ...} so clients can be notified instead of polling.
+
+    Workers use the synchronous client. The API reads and cancels jobs on the event
+    loop, through the a-prefixed coroutines (aget, aget_many, acancel) and a
+    redis.asyncio client attached with use_async().
+    """
+
+    FIELDS = ("status", "model_name", "created_at", "started_at", "finished_at", "result", "result_encoding", "error",
+              "priority", "tenant", "deadline_at", "stream", "seq", "cancel_requested")
+
+    # Only start a job that has not been cancelled in the meantime.
+    # KEYS: job hash. ARGV: now, ttl, events channel ('' for none), event payload.
+    _START_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'status') == 'cancelled' then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'status', 'running', 'started_at', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    if ARGV[3] ~= '' then
+        redis.call('PUBLISH', ARGV[3], ARGV[4])
+    end
+    return 1
+    """
+
+    # Cancel a queued job outright, or flag a running one. Returns the status before the call.
+    # KEYS: job hash. ARGV: now, events channel ('' for none), event payload.
+    _CANCEL_SCRIPT = """
+    local status = redis.call('HGET', KEYS[1], 'status')
+    if status == 'queued' then
+        redis.call('HSET', KEYS[1], 'status', 'cancelled', 'finished_at', ARGV[1], 'error', 'Cancelled before it started.')
+        if ARGV[2] ~= '' then
+            redis.call('PUBLISH', ARGV[2], ARGV[3])
+        end
+    elseif status == 'running' then
+        redis.call('HSET', KEYS[1], 'cancel_requested', '1')
+    end
+    return status
+    """
+
+    def __init__(self, redis_client, prefix: str = "ncos_job:", legacy_result_prefix: str = "ncos_job_result:",
+                 ttl_seconds: int = 604800, compress_min_bytes: int = 1024, events_channel: Optional[str] = None):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.legacy_result_prefix = legacy_result_prefix
+        self.ttl_seconds = ttl_seconds
+        self.compress_min_bytes = compress_min_bytes
+        self.events_channel = events_channel
+        self._start = redis_client.register_script(self._START_SCRIPT)
+        self.async_redis = None
+        self._acancel_script = None
+
+    def use_async(self, async_redis):
+        """
+        Attach the redis.asyncio client used by the coroutine methods, or detach it with None.
+        """
+        self.async_redis = async_redis
+        self._acancel_script = async_redis.register_script(self._CANCEL_SCRIPT) if async_redis is not None else None
+
+    def key(self, job_id: str) -> str:
+        return self.prefix + job_id
+
+    def create(self, job: dict, pipe=None):
+        """
+        Record a newly queued job. Pass a Redis pipeline to batch this with other commands.
+        """
+        target = pipe if pipe is not None else self.redis
+        key = self.key(job["job_id"])
+        fields = {"status": "queued", "model_name": job.get("model_name", ""), "created_at": job.get("created_at", time.time())}
+        for field in ("priority", "tenant", "deadline_at"):
+            if job.get(field) is not None:
+                fields[field] = job[field]
+        target.hset(key, mapping=fields)
+        target.expire(key, self.ttl_seconds)
+
+    def _event(self, job_id: str, status: str) -> str:
+        return json.dumps({"job_id": job_id, "status": status}, separators=(",", ":"))
+
+    def _publish(self, pipe, job_id: str, status: str):
+        if self.events_channel:
+            pipe.publish(self.events_channel, self._event(job_id, status))
+
+    def mark_running(self, job_id: str) -> bool:
+        """
+        Move the job to running. Returns False, leaving it untouched, if it was cancelled while queued.
+        """
+        args = [time.time(), self.ttl_seconds, self.events_channel or "", self._event(job_id, "running")]
+        return bool(self._start(keys=[self.key(job_id)], args=args))
+
+    async def acancel(self, job_id: str) -> Optional[str]:
+        """
+        Cancel a queued job, or flag a running one for its worker to stop.
+        Returns the job's status before the call, or None if the job is unknown.
+        """
+        args = [time.time(), self.events_channel or "", self._event(job_id, "cancelled")]
+        status = await self._acancel_script(keys=[self.key(job_id)], args=args)
+        return status.decode("utf-8") if status is not None else None
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return self.redis.hget(self.key(job_id), "cancel_requested") is not None
+
+    def complete(self, job_id: str, result_text: str):
+        payload, encoding = encode_text(result_text, self.compress_min_bytes)
+        key = self.key(job_id)
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={"status": "done", "finished_at": time.time(), "result": payload, "result_encoding": encoding})
+        pipe.expire(key, self.ttl_seconds)
+        self._publish(pipe, job_id, "done")
+        pipe.execute()
+
+    def fail(self, job_id: str, error: str, status: str = "error"):
+        """
+        Record a job that ended without a result; status is 'error', 'cancelled' or 'expired'.
+        """
+        key = self.key(job_id)
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={"status": status, "finished_at": time.time(), "error": error})
+        pipe.expire(key, self.ttl_seconds)
+        self._publish(pipe, job_id, status)
+        pipe.execute()
+
+    def _record(self, values: list) -> Optional[dict]:
+        record = dict(zip(self.FIELDS, values))
+        if record["status"] is None:
+            return None
+        decoded = {}
+        for field in ("status", "model_name", "error", "result_encoding", "priority", "tenant", "stream"):
+            if record[field] is not None:
+                decoded[field] = record[field].decode("utf-8")
+        for field in ("created_at", "started_at", "finished_at", "deadline_at"):
+            if record[field] is not None:
+                decoded[field] = float(record[field])
+        if record["seq"] is not None:
+            decoded["seq"] = int(record["seq"])
+        if record["cancel_requested"] is not None:
+            decoded["cancel_requested"] = True
+        if record["result"] is not None:
+            decoded["result"] = decode_text(record["result"], decoded.pop("result_encoding", "utf-8"))
+        return decoded
+
+    @staticmethod
+    def _legacy_record(result: Optional[bytes]) -> Optional[dict]:
+        if result is None:
+            return None
+        result_str = result.decode("utf-8")
+        if result_str.startswith("ERROR:"):
+            return {"status": "error", "error": result_str}
+        return {"status": "done", "result": result_str}
+
+    def get_many(self, job_ids: list) -> dict:
+        """
+        Look up several jobs in one pipelined round trip (plus one MGET for pre-hash jobs).
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hmget(self.key(job_id), self.FIELDS)
+        records = {job_id: self._record(values) for job_id, values in zip(job_ids, pipe.execute())}
+        missing = [job_id for job_id, record in records.items() if record is None]
+        if missing:
+            legacy = self.redis.mget([self.legacy_result_prefix + job_id for job_id in missing])
+            for job_id, result in zip(missing, legacy):
+                records[job_id] = self._legacy_record(result)
+        return records
+
+    async def aget(self, job_id: str) -> Optional[dict]:
+        """
+        Return the job's record as a dict, or None if the job is unknown (or expired).
+        """
+        return (await self.aget_many([job_id]))[job_id]
+
+    async def aget_many(self, job_ids: list) -> dict:
+        pipe = self.async_redis.pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hmget(self.key(job_id), self.FIELDS)
+        records = {job_id: self._record(values) for job_id, values in zip(job_ids, await pipe.execute())}
+        missing = [job_id for job_id, record in records.items() if record is None]
+        if missing:
+            legacy = await self.async_redis.mget([self.legacy_result_prefix + job_id for job_id in missing])
+            for job_id, result in zip(missing, legacy):
+                records[job_id] = self._legacy_record(result)
+        return records
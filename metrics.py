@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from transformers import LogitsProcessor
+
+logger = logging.getLogger("ncos-backend")
+
+# --- Logging Configuration ---
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))  # Fraction of inferences logged with their prompt
+LOG_PROMPT_MAX_CHARS = int(os.getenv("LOG_PROMPT_MAX_CHARS", "200"))  # Logged prompts/results are cut to this length
+
+# Stages run from tens of microseconds (Redis writes) to minutes (long decodes)
+_STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REQUEST_LATENCY = Histogram(
+    "ncos_http_request_duration_seconds",
+    "HTTP request latency until the response headers are sent, by route template.",
+    ["method", "route", "status"],
+)
+STAGE_SECONDS = Histogram(
+    "ncos_stage_duration_seconds",
+    "Time spent in each stage of serving a request or job: queue_wait, tokenize, prefill, decode, redis_write, supabase_write.",
+    ["stage"],
+    buckets=_STAGE_BUCKETS,
+)
+QUEUE_DEPTH = Gauge("ncos_queue_depth", "Jobs waiting to be picked up, per queue.", ["queue"])
+TOKENS_GENERATED = Counter("ncos_tokens_generated_total", "New tokens generated.", ["model"])
+GENERATION_SECONDS = Counter("ncos_generation_seconds_total", "Time spent in generate().", ["model"])
+TOKENS_PER_SECOND = Histogram(
+    "ncos_generation_tokens_per_second",
+    "Decoding throughput of individual generate() calls.",
+    ["model"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000),
+)
+ADMISSION_REJECTED = Counter(
+    "ncos_admission_rejected_total",
+    "Requests shed by admission control, by endpoint and reason (queue_full, timeout, queue_depth, queue_drain).",
+    ["endpoint", "reason"],
+)
+MODEL_LOADS = Counter("ncos_model_loads_total", "Model loads, by outcome.", ["model", "outcome"])
+MODEL_LOAD_SECONDS = Histogram(
+    "ncos_model_load_seconds",
+    "Time to build a model pipeline.",
+    ["model"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200),
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+class FirstTokenTimer(LogitsProcessor):
+    """
+    Records when generate() first asks for next-token scores, i.e. when the prefill forward pass
+    has finished. Leaves the scores untouched.
+    """
+
+    def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return scores
+
+
+class CacheStatsCollector:
+    """
+    Exposes the hit/miss counters the caches already keep as Prometheus counters.
+    They are read at scrape time, so cache lookups pay nothing extra for metrics.
+
+    sources maps a cache name to a function returning a dict with 'hits' and 'misses'.
+    """
+
+    def __init__(self, sources: dict):
+        self.sources = sources
+
+    def collect(self):
+        hits = CounterMetricFamily("ncos_cache_hits", "Cache hits, per cache.", labels=["cache"])
+        misses = CounterMetricFamily("ncos_cache_misses", "Cache misses, per cache.", labels=["cache"])
+        entries = GaugeMetricFamily("ncos_cache_entries", "Entries held, per cache.", labels=["cache"])
+        for name, stats in self.sources.items():
+            try:
+                snapshot = stats()
+            except Exception as e:
+                logger.warning(f"Could not collect {name} cache stats: {e}")
+                continue
+            hits.add_metric([name], snapshot.get("hits", 0))
+            misses.add_metric([name], snapshot.get("misses", 0))
+            count = snapshot.get("entries")
+            if count is None and "models" in snapshot:
+                count = len(snapshot["models"])
+            if count is not None:
+                entries.add_metric([name], count)
+        yield hits
+        yield misses
+        yield entries
+
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > LOG_PROMPT_MAX_CHARS:
+        return value[:LOG_PROMPT_MAX_CHARS] + f"...[{len(value) - LOG_PROMPT_MAX_CHARS} more chars]"
+    return value
+
+
+def log_sampled(event: str, **fields):
+    """
+    Log an event as one JSON line for a LOG_SAMPLE_RATE fraction of calls, with long strings truncated.
+    """
+    if LOG_SAMPLE_RATE <= 0 or (LOG_SAMPLE_RATE < 1 and random.random() >= LOG_SAMPLE_RATE):
+        return
+    record = {"event": event, **{key: _truncate(value) for key, value in fields.items()}}
+    logger.info(json.dumps(record, default=str))
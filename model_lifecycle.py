@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+import time
+
+from huggingface_hub import login, snapshot_download
+
+logger = logging.getLogger("ncos-backend")
+
+# Files needed besides the weights: configs, tokenizer and generation settings
+_SUPPORT_PATTERNS = ["*.json", "*.txt", "*.model", "*.tiktoken", "tokenizer*"]
+
+
+class ModelLifecycle:
+    """
+    Loads the startup model on a background thread so the server can accept
+    connections (and answer health checks) while weights are downloaded and loaded.
+
+    Phases run in order and are timed individually:
+      login    - Hugging Face Hub login, if a token is configured
+      download - fetch the snapshot, preferring safetensors weights
+      load     - build the pipeline from the local snapshot; safetensors files are memory-mapped
+      warmup   - run a short generation so the first real request does not pay for lazy initialization
+    The pipeline is built with loader(model_name, local_path), so it stays known by its name rather than
+    the snapshot path. Once everything has run, on_ready(pipeline) is called and the lifecycle reports ready.
+    """
+
+    def __init__(self, model_name: str, loader, on_ready, hf_token: str = None,
+                 warmup_prompt: str = "Hello", warmup_max_new_tokens: int = 8):
+        self.model_name = model_name
+        self.loader = loader
+        self.on_ready = on_ready
+        self.hf_token = hf_token
+        self.warmup_prompt = warmup_prompt
+        self.warmup_max_new_tokens = warmup_max_new_tokens
+        self.phase = "pending"
+        self.phase_seconds = {}
+        self.error = None
+        self.ready = threading.Event()
+        self._started_at = None
+        self._finished_at = None
+        self._phase_started_at = None
+        self._thread = None
+
+    def start(self):
+        """
+        Start loading in the background; returns immediately.
+        """
+        if self._thread is not None:
+            return
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="model-lifecycle", daemon=True)
+        self._thread.start()
+
+    def _enter(self, phase: str):
+        now = time.monotonic()
+        if self._phase_started_at is not None:
+            self.phase_seconds[self.phase] = round(now - self._phase_started_at, 3)
+        self.phase = phase
+        self._phase_started_at = now
+        if phase in ("ready", "failed"):
+            self._finished_at = now
+
+    def _run(self):
+        try:
+            if self.hf_token:
+                self._enter("login")
+                try:
+                    login(token=self.hf_token)
+                    logger.info("Logged in to Hugging Face Hub.")
+                except Exception as e:
+                    # Public models still download without it
+                    logger.error(f"Failed to login to Hugging Face Hub: {e}")
+            self._enter("download")
+            model_path = self._download()
+            self._enter("load")
+            pipe = self.loader(self.model_name, model_path)
+            if self.warmup_max_new_tokens > 0:
+                self._enter("warmup")
+                pipe(self.warmup_prompt, max_new_tokens=self.warmup_max_new_tokens)
+            self._enter("ready")
+            self.on_ready(pipe)
+            self.ready.set()
+            total = self._finished_at - self._started_at
+            phases = ", ".join(f"{name}={seconds:.1f}s" for name, seconds in self.phase_seconds.items())
+            logger.info(f"Model {self.model_name} ready after {total:.1f}s ({phases}).")
+        except Exception as e:
+            self.error = str(e)
+            self._enter("failed")
+            logger.error(f"Model loading failed in phase {self._failed_phase()}: {e}")
+
+    def _failed_phase(self) -> str:
+        return next(reversed(self.phase_seconds), "pending")
+
+    def _download(self) -> str:
+        """
+        Fetch the model snapshot and return its local path. Local directories are used as they are.
+        Only safetensors weights are fetched when the repo has them; otherwise the .bin weights are.
+        """
+        if os.path.isdir(self.model_name):
+            return self.model_name
+        path = snapshot_download(self.model_name, allow_patterns=_SUPPORT_PATTERNS + ["*.safetensors"])
+        if not any(name.endswith(".safetensors") for _, _, files in os.walk(path) for name in files):
+            logger.info(f"No safetensors weights for {self.model_name}, downloading .bin weights.")
+            path = snapshot_download(self.model_name, allow_patterns=_SUPPORT_PATTERNS + ["*.bin"])
+        return path
+
+    def status(self) -> dict:
+        """
+        Report the current phase, per-phase timings and overall elapsed time.
+        """
+        elapsed = None
+        if self._started_at is not None:
+            elapsed = round((self._finished_at or time.monotonic()) - self._started_at, 3)
+        phase_seconds = dict(self.phase_seconds)
+        if self._phase_started_at is not None and self.phase not in ("ready", "failed"):
+            phase_seconds[self.phase] = round(time.monotonic() - self._phase_started_at, 3)
+        return {
+            "model_name": self.model_name,
+            "ready": self.ready.is_set(),
+            "phase": self.phase,
+            "phase_seconds": phase_seconds,
+            "elapsed_seconds": elapsed,
+            "error": self.error,
+        }
@@ -0,0 +1,170 @@
+import gc
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger("ncos-backend")
+
+
+def estimate_pipeline_bytes(pipe) -> int:
+    """
+    Estimate the memory held by a pipeline's model weights and buffers.
+    """
+    model = getattr(pipe, "model", None)
+    if model is None:
+        return 0
+    total = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class _Entry:
+    __slots__ = ("pipeline", "size_bytes", "pinned")
+
+    def __init__(self, pipeline, size_bytes: int, pinned: bool = False):
+        self.pipeline = pipeline
+        self.size_bytes = size_bytes
+        self.pinned = pinned
+
+
+class ModelRegistry:
+    """
+    Keeps several text-generation pipelines resident within a memory budget.
+
+    Models are loaded on first use through `loader(model_name)` and evicted in
+    least-recently-used order once the estimated size of resident weights exceeds
+    max_bytes. Pinned models (the startup model) are never evicted. A model that is
+    already being loaded, e.g. by prefetch(), is waited on rather than loaded twice.
+    """
+
+    def __init__(self, loader, max_bytes: int):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # model name -> _Entry, least recently used first
+        self._loading = {}  # model name -> Future of the pipeline being loaded
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.load_failures = 0
+        self.load_seconds = 0.0
+
+    def put(self, model_name: str, pipe, pinned: bool = False):
+        """
+        Register an already loaded pipeline, e.g. the model loaded at startup.
+        """
+        with self._lock:
+            self._entries[model_name] = _Entry(pipe, estimate_pipeline_bytes(pipe), pinned)
+            self._entries.move_to_end(model_name)
+            self._evict_locked(keep=model_name)
+
+    def is_loaded(self, model_name: str) -> bool:
+        with self._lock:
+            return model_name in self._entries
+
+    def get(self, model_name: str):
+        """
+        Return the pipeline for model_name, loading it (and evicting others) if needed.
+        """
+        with self._lock:
+            entry = self._entries.get(model_name)
+            if entry is not None:
+                self._entries.move_to_end(model_name)
+                self.hits += 1
+                return entry.pipeline
+            self.misses += 1
+            future, owner = self._claim_load_locked(model_name)
+        if owner:
+            self._load(model_name, future)
+        return future.result()
+
+    def prefetch(self, model_name: str):
+        """
+        Start loading model_name in the background if it is neither resident nor already loading.
+        """
+        with self._lock:
+            if model_name in self._entries or model_name in self._loading:
+                return
+            future, _ = self._claim_load_locked(model_name)
+        logger.info(f"Prefetching model: {model_name}")
+        threading.Thread(target=self._load, args=(model_name, future), name=f"prefetch-{model_name}", daemon=True).start()
+
+    def _claim_load_locked(self, model_name: str):
+        future = self._loading.get(model_name)
+        if future is not None:
+            return future, False
+        future = Future()
+        self._loading[model_name] = future
+        return future, True
+
+    def _load(self, model_name: str, future: Future):
+        started = time.monotonic()
+        try:
+            pipe = self.loader(model_name)
+        except Exception as e:
+            with self._lock:
+                self.load_failures += 1
+                self._loading.pop(model_name, None)
+            future.set_exception(e)
+            return
+        elapsed = time.monotonic() - started
+        size = estimate_pipeline_bytes(pipe)
+        with self._lock:
+            self.loads += 1
+            self.load_seconds += elapsed
+            self._entries[model_name] = _Entry(pipe, size)
+            self._entries.move_to_end(model_name)
+            self._loading.pop(model_name, None)
+            self._evict_locked(keep=model_name)
+        logger.info(f"Loaded model {model_name} in {elapsed:.1f}s ({size / 2**20:.0f} MiB).")
+        future.set_result(pipe)
+
+    def _evict_locked(self, keep: str):
+        evicted = False
+        for name in list(self._entries):
+            if self._resident_bytes_locked() <= self.max_bytes:
+                break
+            entry = self._entries[name]
+            if name == keep or entry.pinned:
+                continue
+            del self._entries[name]
+            self.evictions += 1
+            evicted = True
+            logger.info(f"Evicted model {name} from cache ({entry.size_bytes / 2**20:.0f} MiB).")
+        if evicted:
+            gc.collect()
+            try:
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            except ImportError:
+                pass
+
+    def _resident_bytes_locked(self) -> int:
+        return sum(entry.size_bytes for entry in self._entries.values())
+
+    def stats(self) -> dict:
+        """
+        Report cache hit/miss/eviction counters, load times and resident models.
+        """
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "resident_bytes": self._resident_bytes_locked(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "loads": self.loads,
+                "load_failures": self.load_failures,
+                "load_seconds_total": round(self.load_seconds, 3),
+                "avg_load_seconds": round(self.load_seconds / self.loads, 3) if self.loads else 0.0,
+                "loading": list(self._loading),
+                "models": [
+                    {"name": name, "size_bytes": entry.size_bytes, "pinned": entry.pinned}
+                    for name, entry in reversed(self._entries.items())
+                ],
+            }
@@ -0,0 +1,201 @@
+import copy
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Optional
+
+import torch
+
+from metrics import stage_timer
+from streaming import PIPELINE_ONLY_PARAMS
+
+logger = logging.getLogger("ncos-backend")
+
+
+def _tensor_bytes(obj, seen=None) -> int:
+    """
+    Total size of the tensors held by a past_key_values object (legacy tuples or a Cache instance).
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, (list, tuple)):
+        return sum(_tensor_bytes(item, seen) for item in obj)
+    if isinstance(obj, dict):
+        return sum(_tensor_bytes(item, seen) for item in obj.values())
+    if hasattr(obj, "__dict__"):
+        return sum(_tensor_bytes(item, seen) for item in vars(obj).values())
+    return 0
+
+
+def _common_prefix_length(a: list, b: list) -> int:
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class PrefixCache:
+    """
+    Caches the attention key/values of long prompt prefixes shared by many requests
+    (e.g. the compliance policy preamble) so generation only has to prefill the
+    part of the prompt after the prefix.
+
+    Prefixes come from register() or are detected automatically: when a prompt
+    shares at least min_tokens leading tokens with one of the last
+    detect_window prompts for the same model, that common prefix is cached.
+    Matching is done on token ids, so a prefix only hits when the full prompt
+    tokenizes to the same ids. Entries are evicted least-recently-used once their
+    total size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int, min_tokens: int = 64, auto_detect: bool = True, detect_window: int = 64):
+        self.max_bytes = max_bytes
+        self.min_tokens = min_tokens
+        self.auto_detect = auto_detect
+        self._entries = OrderedDict()  # (model_key, prefix ids) -> (past_key_values, size in bytes)
+        self._registered = {}  # model_key -> list of registered prefix id tuples
+        self._recent = {}  # model_key -> deque of recent prompt id lists
+        self.detect_window = detect_window
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.evictions = 0
+
+    def register(self, model_key: str, tokenizer, prefix_text: str) -> int:
+        """
+        Register a prefix for a model; its key/values are computed on the first request that uses it.
+        Returns the prefix length in tokens.
+        """
+        prefix_ids = tuple(tokenizer(prefix_text)["input_ids"])
+        with self._lock:
+            registered = self._registered.setdefault(model_key, [])
+            if prefix_ids not in registered:
+                registered.append(prefix_ids)
+        return len(prefix_ids)
+
+    def _match_locked(self, model_key: str, prompt_ids: list) -> Optional[tuple]:
+        """
+        Longest cached or registered prefix of prompt_ids that leaves at least one token to generate from.
+        """
+        best = None
+        candidates = [key[1] for key in self._entries if key[0] == model_key]
+        candidates += self._registered.get(model_key, [])
+        for prefix_ids in candidates:
+            if len(prefix_ids) < len(prompt_ids) and (best is None or len(prefix_ids) > len(best)):
+                if tuple(prompt_ids[:len(prefix_ids)]) == prefix_ids:
+                    best = prefix_ids
+        return best
+
+    def _detect_locked(self, model_key: str, prompt_ids: list) -> Optional[tuple]:
+        recent = self._recent.setdefault(model_key, deque(maxlen=self.detect_window))
+        longest = 0
+        for other in recent:
+            longest = max(longest, _common_prefix_length(prompt_ids, other))
+        recent.append(prompt_ids)
+        # Leave at least one prompt token uncached so generation has an input to start from
+        longest = min(longest, len(prompt_ids) - 1)
+        if longest >= self.min_tokens:
+            return tuple(prompt_ids[:longest])
+        return None
+
+    def lookup(self, model, model_key: str, prompt_ids: list):
+        """
+        Return (prefix_length, past_key_values) for the longest usable prefix of prompt_ids,
+        computing and caching the prefix state if needed, or (0, None) when no prefix applies.
+        The returned past_key_values is a private copy that generation may extend.
+        """
+        with self._lock:
+            prefix_ids = self._match_locked(model_key, prompt_ids)
+            if prefix_ids is None and self.auto_detect:
+                prefix_ids = self._detect_locked(model_key, prompt_ids)
+                if prefix_ids is not None:
+                    logger.info(f"Detected shared prompt prefix of {len(prefix_ids)} tokens for {model_key}.")
+            if prefix_ids is None:
+                self.misses += 1
+                return 0, None
+            entry = self._entries.get((model_key, prefix_ids))
+            if entry is not None:
+                self._entries.move_to_end((model_key, prefix_ids))
+                self.hits += 1
+                self.tokens_saved += len(prefix_ids)
+                past = entry[0]
+            else:
+                self.misses += 1
+                past = None
+        if past is None:
+            past = self._compute(model, model_key, prefix_ids)
+        # Cache objects are extended in place during generation, so each request gets its own copy
+        return len(prefix_ids), past if isinstance(past, tuple) else copy.deepcopy(past)
+
+    def _compute(self, model, model_key: str, prefix_ids: tuple):
+        input_ids = torch.tensor([prefix_ids], device=model.device)
+        with torch.no_grad():
+            past = model(input_ids=input_ids, use_cache=True).past_key_values
+        size = _tensor_bytes(past)
+        with self._lock:
+            self._entries[(model_key, prefix_ids)] = (past, size)
+            self._evict_locked()
+        return past
+
+    def _evict_locked(self):
+        total = sum(size for _, size in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, (_, size) = self._entries.popitem(last=False)
+            total -= size
+            self.evictions += 1
+
+    def generate(self, pipe, model_key: str, input_text: str, params: dict) -> Optional[str]:
+        """
+        Generate text for input_text resuming from a cached prefix state.
+        Returns None when no prefix applies, in which case the caller should run the pipeline as usual.
+        Mirrors the text-generation pipeline output: the prompt followed by the generated text,
+        unless return_full_text=False.
+        """
+        if params.get("num_return_sequences", 1) != 1:
+            return None
+        tokenizer, model = pipe.tokenizer, pipe.model
+        with stage_timer("tokenize"):
+            prompt_ids = tokenizer(input_text)["input_ids"]
+        prefix_length, past = self.lookup(model, model_key, prompt_ids)
+        if past is None:
+            return None
+        gen_params = dict(params)
+        return_full_text = gen_params.pop("return_full_text", True)
+        for key in PIPELINE_ONLY_PARAMS:
+            gen_params.pop(key, None)
+        input_ids = torch.tensor([prompt_ids], device=model.device)
+        with torch.no_grad():
+            output = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past,
+                pad_token_id=tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
+                **gen_params,
+            )
+        sequences = getattr(output, "sequences", output)
+        generated = tokenizer.decode(sequences[0][len(prompt_ids):], skip_special_tokens=True)
+        return input_text + generated if return_full_text else generated
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "resident_bytes": sum(size for _, size in self._entries.values()),
+                "entries": len(self._entries),
+                "registered": sum(len(prefixes) for prefixes in self._registered.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "tokens_saved": self.tokens_saved,
+                "evictions": self.evictions,
+                "prefixes": [
+                    {"model_name": model_key, "tokens": len(prefix_ids), "size_bytes": size}
+                    for (model_key, prefix_ids), (_, size) in reversed(self._entries.items())
+                ],
+            }
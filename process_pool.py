@@ -0,0 +1,192 @@
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+logger = logging.getLogger("ncos-backend")
+
+
+def _worker_main(conn, pipe, handler, torch_threads: int):
+    """
+    Entry point of a forked inference worker: run requests from the parent until told to stop.
+    """
+    torch.set_num_threads(max(1, torch_threads))
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            return
+        if message is None:
+            return
+        request_id, input_text, params = message
+        try:
+            conn.send((request_id, True, handler(pipe, input_text, params)))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    __slots__ = ("index", "process", "conn", "send_lock", "inflight", "started_at", "completed")
+
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.inflight = {}  # request id -> Future
+        self.started_at = time.monotonic()
+        self.completed = 0
+
+
+class InferencePool:
+    """
+    Runs inference on N forked worker processes that share the parent's model weights.
+
+    The parent loads the pipeline once and moves the model's tensors into shared memory
+    before forking, so every worker maps the same physical pages instead of holding its own
+    copy. Each worker runs handler(pipe, input_text, params) for one request at a time with
+    torch_threads intra-op threads; requests go to the worker with the fewest in flight.
+
+    A worker that exits (e.g. killed by the OOM killer) is detected as soon as its pipe
+    closes: its in-flight requests fail and a replacement is forked. Workers that keep
+    crashing right after starting are restarted with a growing delay.
+
+    Workers keep their own copies of any per-process state (prefix caches, generation stats),
+    so counters collected inside a worker are not visible in the parent.
+    """
+
+    def __init__(self, pipe, handler, workers: int, torch_threads: int = 1):
+        self.pipe = pipe
+        self.handler = handler
+        self.size = max(1, workers)
+        self.torch_threads = torch_threads
+        self.restarts = 0
+        self._ctx = multiprocessing.get_context("fork")
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        try:
+            pipe.model.share_memory()
+        except Exception as e:
+            # Copy-on-write after fork still shares the pages as long as nobody writes to them
+            logger.warning(f"Could not move model weights to shared memory, relying on copy-on-write: {e}")
+        self._workers = [self._spawn(i) for i in range(self.size)]
+        logger.info(f"Started {self.size} inference worker processes with {torch_threads} torch threads each.")
+
+    def _spawn(self, index: int) -> _Worker:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.pipe, self.handler, self.torch_threads),
+            name=f"inference-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(index, process, parent_conn)
+        threading.Thread(target=self._read_results, args=(worker,), name=f"inference-pool-reader-{index}", daemon=True).start()
+        return worker
+
+    def _read_results(self, worker: _Worker):
+        while True:
+            try:
+                request_id, ok, value = worker.conn.recv()
+            except (EOFError, OSError):
+                self._handle_exit(worker)
+                return
+            with self._lock:
+                future = worker.inflight.pop(request_id, None)
+                worker.completed += 1
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+
+    def _handle_exit(self, worker: _Worker):
+        worker.process.join(timeout=5)
+        with self._lock:
+            inflight, worker.inflight = worker.inflight, {}
+            closed = self._closed
+        if closed:
+            return
+        error = RuntimeError(f"Inference worker {worker.index} exited with code {worker.process.exitcode}")
+        logger.error(f"{error}; failing {len(inflight)} in-flight requests and restarting it.")
+        for future in inflight.values():
+            future.set_exception(error)
+        worker.conn.close()
+        # Back off if the worker died soon after starting, so a persistent fault does not fork in a tight loop
+        lifetime = time.monotonic() - worker.started_at
+        if lifetime < 5:
+            time.sleep(min(30.0, 2.0 ** min(self.restarts, 5)))
+        with self._lock:
+            if self._closed:
+                return
+            self.restarts += 1
+            self._workers[worker.index] = self._spawn(worker.index)
+
+    def submit_async(self, input_text: str, params: dict) -> Future:
+        """
+        Send a prompt to the least busy worker and return a Future for its text.
+        """
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Inference pool is closed.")
+            candidates = [w for w in self._workers if w.process.is_alive()] or self._workers
+            worker = min(candidates, key=lambda w: len(w.inflight))
+            worker.inflight[request_id] = future
+        try:
+            with worker.send_lock:
+                worker.conn.send((request_id, input_text, params))
+        except (OSError, ValueError) as e:
+            # The worker is gone; its reader thread fails the remaining requests and restarts it
+            with self._lock:
+                worker.inflight.pop(request_id, None)
+            future.set_exception(RuntimeError(f"Inference worker {worker.index} unavailable: {e}"))
+        return future
+
+    def submit(self, input_text: str, params: dict) -> str:
+        """
+        Run a prompt on the pool and block until its text is ready.
+        """
+        return self.submit_async(input_text, params).result()
+
+    def close(self, timeout: float = 5.0):
+        with self._lock:
+            self._closed = True
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for worker in workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.size,
+                "torch_threads_per_worker": self.torch_threads,
+                "restarts": self.restarts,
+                "processes": [
+                    {
+                        "index": w.index,
+                        "pid": w.process.pid,
+                        "alive": w.process.is_alive(),
+                        "in_flight": len(w.inflight),
+                        "completed": w.completed,
+                    }
+                    for w in self._workers
+                ],
+            }
@@ -0,0 +1,324 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from typing import Optional
+
+import torch
+
+logger = logging.getLogger("ncos-backend")
+
+# Kinds of trace a profile can hold, with the media type and file suffix they are downloaded as
+ARTIFACTS = {
+    "chrome": ("application/json", "trace.json"),  # torch profiler trace for chrome://tracing or Perfetto
+    "collapsed": ("text/plain", "collapsed.txt"),  # Sampled Python stacks, one 'frame;frame;frame count' per line
+}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    # Keep paths short and stable across machines
+    marker = filename.rfind("site-packages" + os.sep)
+    if marker >= 0:
+        filename = filename[marker + len("site-packages") + 1:]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{frame.f_lineno})"
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingSession:
+    """
+    Stack samples of a set of threads, collected by a StackSampler until stop() is called.
+    """
+
+    def __init__(self, sampler: "StackSampler", thread_ids: list):
+        self.sampler = sampler
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        self.threads = {thread_id: names.get(thread_id, str(thread_id)) for thread_id in thread_ids if thread_id is not None}
+        self.samples = Counter()  # (thread id, collapsed stack) -> samples
+
+    def stop(self):
+        self.sampler._stop(self)
+
+    def collapsed(self) -> str:
+        """
+        The samples in collapsed-stack format (the input of flamegraph.pl and speedscope), rooted at the thread name.
+        """
+        return "".join(
+            f"{self.threads[thread_id]};{stack} {count}\n"
+            for (thread_id, stack), count in self.samples.most_common()
+        )
+
+
+class StackSampler:
+    """
+    Statistical profiler for Python code: one background thread records the stack of every thread that
+    a running session follows, every interval_s. Unlike cProfile it does not slow the profiled code down,
+    and it sees time spent inside torch ops as time in the Python frame that called them. The thread only
+    runs while there are sessions, and a thread followed by several sessions is walked once per tick.
+    """
+
+    def __init__(self, interval_s: float = 0.01):
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, thread_ids: list) -> SamplingSession:
+        session = SamplingSession(self, thread_ids)
+        with self._lock:
+            self._sessions.add(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+            self._wake.set()
+        return session
+
+    def _stop(self, session: SamplingSession):
+        with self._lock:
+            self._sessions.discard(session)
+
+    def active(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._sessions:
+                    self._wake.clear()
+                else:
+                    frames = sys._current_frames()
+                    stacks = {}
+                    for session in self._sessions:
+                        for thread_id in session.threads:
+                            frame = frames.get(thread_id)
+                            if frame is None:
+                                continue
+                            if thread_id not in stacks:
+                                stacks[thread_id] = _collapse(frame)
+                            session.samples[(thread_id, stacks[thread_id])] += 1
+                    del frames
+            if not self._wake.is_set():
+                self._wake.wait()
+                continue
+            time.sleep(self.interval_s)
+
+
+class ProfileStore:
+    """
+    Profiles in Redis: one hash per profile (`ncos_profile:<id>`) with its metadata and zlib-compressed
+    traces, and a sorted set indexing them by capture time. Only the newest max_profiles are kept and each
+    expires after ttl_seconds. A trace that is still larger than max_artifact_bytes after compression is
+    left out and listed under the profile's 'dropped' metadata.
+    """
+
+    def __init__(self, redis_client, prefix: str = "ncos_profile:", max_profiles: int = 50,
+                 ttl_seconds: int = 86400, max_artifact_bytes: int = 32 * 2**20):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.index_key = prefix + "index"
+        self.max_profiles = max(1, max_profiles)
+        self.ttl_seconds = ttl_seconds
+        self.max_artifact_bytes = max_artifact_bytes
+        self.async_redis = None
+
+    def use_async(self, async_redis):
+        """
+        Attach the redis.asyncio client used by the coroutine methods, or detach it with None.
+        """
+        self.async_redis = async_redis
+
+    def key(self, profile_id: str) -> str:
+        return self.prefix + profile_id
+
+    def save(self, profile_id: str, meta: dict, artifacts: dict):
+        """
+        Store a profile; artifacts maps kinds from ARTIFACTS to their text. Evicts the oldest profiles over the cap.
+        """
+        fields = {}
+        meta = dict(meta, artifacts=[], dropped=[])
+        for name, text in artifacts.items():
+            payload = zlib.compress(text.encode("utf-8"), 6)
+            if len(payload) > self.max_artifact_bytes:
+                meta["dropped"].append(name)
+                continue
+            fields["artifact:" + name] = payload
+            meta["artifacts"].append(name)
+            meta[name + "_bytes"] = len(text)
+        fields["meta"] = json.dumps(meta, separators=(",", ":"))
+        key = self.key(profile_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, self.ttl_seconds)
+        pipe.zadd(self.index_key, {profile_id: meta.get("captured_at", time.time())})
+        pipe.zremrangebyscore(self.index_key, "-inf", time.time() - self.ttl_seconds)
+        pipe.execute()
+        excess = self.redis.zcard(self.index_key) - self.max_profiles
+        if excess > 0:
+            evicted = [profile.decode("utf-8") for profile in self.redis.zrange(self.index_key, 0, excess - 1)]
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(*[self.key(profile) for profile in evicted])
+            pipe.zrem(self.index_key, *evicted)
+            pipe.execute()
+
+    async def alist(self, limit: int = 50) -> list:
+        """
+        Metadata of the newest stored profiles, newest first.
+        """
+        profile_ids = await self.async_redis.zrevrange(self.index_key, 0, max(1, limit) - 1)
+        pipe = self.async_redis.pipeline(transaction=False)
+        for profile_id in profile_ids:
+            pipe.hget(self.key(profile_id.decode("utf-8")), "meta")
+        return [json.loads(meta) for meta in await pipe.execute() if meta is not None]
+
+    async def aget_meta(self, profile_id: str) -> Optional[dict]:
+        meta = await self.async_redis.hget(self.key(profile_id), "meta")
+        return json.loads(meta) if meta is not None else None
+
+    async def aget_artifact(self, profile_id: str, name: str) -> Optional[bytes]:
+        payload = await self.async_redis.hget(self.key(profile_id), "artifact:" + name)
+        return zlib.decompress(payload) if payload is not None else None
+
+
+class ProfileCapture:
+    """
+    Outcome of RequestProfiler.capture(): profile_id is set once the profile has been stored.
+    """
+
+    def __init__(self):
+        self.profile_id = None
+
+
+class RequestProfiler:
+    """
+    Profiles individual requests.
+
+    A requested profile runs under the torch profiler (operator timings, exported as a Chrome trace) and
+    the stack sampler (collapsed Python stacks), and is always stored. The torch profiler is process-wide,
+    so only one request is traced by it at a time; a requested profile that overlaps another gets sampled
+    stacks only, and its trace may include ops run by other threads meanwhile.
+
+    With slow_threshold_s set, every other request is followed by the sampler alone, which is cheap enough
+    to leave on, and its stacks are stored only if the request took at least slow_threshold_s.
+    """
+
+    def __init__(self, store: ProfileStore, sampler: StackSampler, slow_threshold_s: float = 0.0):
+        self.store = store
+        self.sampler = sampler
+        self.slow_threshold_s = slow_threshold_s
+        self._torch_lock = threading.Lock()
+        self.saved = Counter()  # trigger -> profiles stored
+        self.failed = 0
+
+    def _start_torch(self):
+        if not self._torch_lock.acquire(blocking=False):
+            return None
+        try:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            profile = torch.profiler.profile(activities=activities, record_shapes=True)
+            profile.__enter__()
+            return profile
+        except Exception:
+            self._torch_lock.release()
+            raise
+
+    def _finish_torch(self, profile) -> str:
+        try:
+            profile.__exit__(None, None, None)
+            handle, path = tempfile.mkstemp(prefix="ncos-trace-", suffix=".json")
+            os.close(handle)
+            try:
+                profile.export_chrome_trace(path)
+                with open(path) as f:
+                    return f.read()
+            finally:
+                os.remove(path)
+        finally:
+            self._torch_lock.release()
+
+    @contextmanager
+    def capture(self, profile_id: str, meta: dict, requested: bool = False, extra_threads: tuple = ()):
+        """
+        Profile the block running on the calling thread (plus extra_threads, e.g. a batcher doing the work).
+        Storing the profile never raises; failures are logged.
+        """
+        capture = ProfileCapture()
+        if not requested and not self.slow_threshold_s:
+            yield capture
+            return
+        torch_profile = None
+        if requested:
+            try:
+                torch_profile = self._start_torch()
+            except Exception as e:
+                logger.error(f"Could not start the torch profiler for {profile_id}: {e}")
+        session = self.sampler.start([threading.get_ident(), *extra_threads])
+        captured_at = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield capture
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            session.stop()
+            artifacts = {}
+            if torch_profile is not None:
+                try:
+                    artifacts["chrome"] = self._finish_torch(torch_profile)
+                except Exception as e:
+                    logger.error(f"Could not export the torch trace of {profile_id}: {e}")
+            if requested or seconds >= self.slow_threshold_s:
+                trigger = "requested" if requested else "slow"
+                artifacts["collapsed"] = session.collapsed()
+                record = dict(
+                    meta,
+                    profile_id=profile_id,
+                    trigger=trigger,
+                    captured_at=captured_at,
+                    seconds=round(seconds, 4),
+                    error=error,
+                    samples=sum(session.samples.values()),
+                    sample_interval_ms=round(self.sampler.interval_s * 1000, 3),
+                    threads=list(session.threads.values()),
+                )
+                try:
+                    self.store.save(profile_id, record, artifacts)
+                    capture.profile_id = profile_id
+                    self.saved[trigger] += 1
+                    logger.info(f"Stored {trigger} profile {profile_id} ({seconds:.2f}s, {record['samples']} samples).")
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Could not store profile {profile_id}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "slow_threshold_s": self.slow_threshold_s or None,
+            "sample_interval_ms": round(self.sampler.interval_s * 1000, 3),
+            "sampling": self.sampler.active(),
+            "max_profiles": self.store.max_profiles,
+            "saved": dict(self.saved),
+            "failed": self.failed,
+        }
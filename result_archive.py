@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger("ncos-backend")
+
+# Columns stored for every result; anything else in a submitted row is ignored
+ARCHIVE_COLUMNS = ("job_id", "model_name", "created_at", "finished_at", "status", "passed", "suite", "tenant",
+                   "seconds", "input_text", "parameters", "result")
+# Columns a query can filter on with equality, and the groupings aggregate() supports
+FILTER_COLUMNS = ("job_id", "model_name", "status", "suite", "tenant", "passed")
+GROUP_BY = {
+    "model_name": "model_name",
+    "status": "status",
+    "suite": "suite",
+    "tenant": "tenant",
+    "day": "strftime('%Y-%m-%d', finished_at, 'unixepoch')",
+    "hour": "strftime('%Y-%m-%dT%H:00', finished_at, 'unixepoch')",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT NOT NULL UNIQUE,
+    model_name TEXT,
+    created_at REAL,
+    finished_at REAL NOT NULL,
+    status TEXT,
+    passed INTEGER,
+    suite TEXT,
+    tenant TEXT,
+    seconds REAL,
+    input_text TEXT,
+    parameters TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS results_model_finished ON results (model_name, finished_at);
+CREATE INDEX IF NOT EXISTS results_finished ON results (finished_at);
+CREATE INDEX IF NOT EXISTS results_suite_finished ON results (suite, finished_at);
+"""
+
+
+class ResultArchive:
+    """
+    Local append-optimized archive of inference results in SQLite, for filtered and aggregated reads that
+    would otherwise pull every row from Supabase.
+
+    Like SupabaseWriter, it is a result sink: submit(row) never blocks the caller, and a background thread
+    inserts buffered rows in one transaction per batch_size rows or flush_interval_s. The database runs in
+    WAL mode, so readers (each thread gets its own connection) never wait on the writer. Rows are keyed on
+    job_id; writing the same job again replaces its row.
+    """
+
+    def __init__(self, path: str, batch_size: int = 500, flush_interval_s: float = 1.0, max_buffered: int = 100000):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self._buffer = queue.Queue(maxsize=max_buffered)
+        self._local = threading.local()
+        self._stopped = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        connection.executescript(_SCHEMA)
+        self._thread = threading.Thread(target=self._run, name="result-archive", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Durable at checkpoints rather than at every commit; fine for an archive that can be rebuilt
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    # --- Writing ---
+
+    def submit(self, row: dict):
+        """
+        Queue a result row for the next batch insert. Never blocks; rows are dropped if the buffer is full.
+        """
+        try:
+            self._buffer.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Result archive buffer full, dropping job {row.get('job_id')}.")
+
+    def write_many(self, rows: list):
+        """
+        Insert rows right away, in one transaction.
+        """
+        if not rows:
+            return
+        now = time.time()
+        values = [self._values(row, now) for row in rows]
+        connection = self._connect()
+        placeholders = ", ".join("?" for _ in ARCHIVE_COLUMNS)
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO results ({', '.join(ARCHIVE_COLUMNS)}) VALUES ({placeholders})",
+                values,
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        self.written += len(rows)
+
+    @staticmethod
+    def _values(row: dict, now: float) -> tuple:
+        values = []
+        for column in ARCHIVE_COLUMNS:
+            value = row.get(column)
+            if column == "finished_at" and value is None:
+                value = now
+            elif column == "passed" and value is not None:
+                value = int(bool(value))
+            elif isinstance(value, (dict, list)):
+                value = json.dumps(value)
+            values.append(value)
+        return tuple(values)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                try:
+                    self.write_many(batch)
+                except sqlite3.Error as e:
+                    self.dropped += len(batch)
+                    logger.error(f"Failed to archive {len(batch)} results: {e}")
+            elif self._stopped.is_set():
+                return
+
+    def _collect(self) -> list:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval_s
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._buffer.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def close(self, timeout: float = 10.0):
+        """
+        Write buffered rows and stop the writer thread.
+        """
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    # --- Reading ---
+
+    @staticmethod
+    def _where(filters: dict, since: Optional[float], until: Optional[float]):
+        clauses, args = [], []
+        for column, value in (filters or {}).items():
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Cannot filter on {column}; use one of {list(FILTER_COLUMNS)}.")
+            if value is None:
+                continue
+            clauses.append(f"{column} = ?")
+            args.append(int(bool(value)) if column == "passed" else value)
+        if since is not None:
+            clauses.append("finished_at >= ?")
+            args.append(since)
+        if until is not None:
+            clauses.append("finished_at < ?")
+            args.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    def query(self, filters: dict = None, since: float = None, until: float = None, limit: int = 100,
+              offset: int = 0, include_text: bool = True) -> list:
+        """
+        Return archived results matching the equality filters (see FILTER_COLUMNS) that finished in
+        [since, until), newest first. include_text=False leaves out input_text, parameters and result.
+        """
+        columns = ARCHIVE_COLUMNS if include_text else tuple(c for c in ARCHIVE_COLUMNS if c not in ("input_text", "parameters", "result"))
+        where, args = self._where(filters, since, until)
+        rows = self._connect().execute(
+            f"SELECT {', '.join(columns)} FROM results{where} ORDER BY finished_at DESC LIMIT ? OFFSET ?",
+            args + [limit, offset],
+        ).fetchall()
+        return [self._row(row) for row in rows]
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> dict:
+        record = dict(row)
+        if record.get("passed") is not None:
+            record["passed"] = bool(record["passed"])
+        return record
+
+    def aggregate(self, group_by: list, filters: dict = None, since: float = None, until: float = None) -> list:
+        """
+        Count results per group (any of GROUP_BY's keys, e.g. ['model_name', 'day']) with pass/fail/error
+        counts, pass rate among results with a verdict, and average seconds per result.
+        """
+        unknown = [key for key in group_by if key not in GROUP_BY]
+        if unknown:
+            raise ValueError(f"Cannot group by {unknown}; use any of {list(GROUP_BY)}.")
+        where, args = self._where(filters, since, until)
+        keys = ", ".join(f"{GROUP_BY[key]} AS {key}" for key in group_by)
+        select = (keys + ", ") if keys else ""
+        group = f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}" if group_by else ""
+        rows = self._connect().execute(
+            f"SELECT {select}COUNT(*) AS results, SUM(passed = 1) AS passed, SUM(passed = 0) AS failed, "
+            f"SUM(status = 'error') AS errors, AVG(seconds) AS avg_seconds, "
+            f"MIN(finished_at) AS first_finished_at, MAX(finished_at) AS last_finished_at "
+            f"FROM results{where}{group}",
+            args,
+        ).fetchall()
+        groups = []
+        for row in rows:
+            record = dict(row)
+            passed, failed = record["passed"] or 0, record["failed"] or 0
+            record.update(
+                passed=passed,
+                failed=failed,
+                errors=record["errors"] or 0,
+                pass_rate=round(passed / (passed + failed), 4) if passed + failed else None,
+                avg_seconds=round(record["avg_seconds"], 4) if record["avg_seconds"] is not None else None,
+            )
+            groups.append(record)
+        return groups
+
+    def stats(self) -> dict:
+        rows = self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {
+            "path": self.path,
+            "rows": rows,
+            "size_bytes": sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p)),
+            "written": self.written,
+            "buffered": self._buffer.qsize(),
+            "dropped": self.dropped,
+        }
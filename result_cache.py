@@ -0,0 +1,202 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Optional
+
+import redis
+
+logger = logging.getLogger("ncos-backend")
+
+# Deletes the in-flight marker only if this process still owns it
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Handed to in-process waiters when the computation they joined failed, so they run their own instead
+_OWNER_FAILED = object()
+
+
+def normalize_params(params: Optional[dict]) -> dict:
+    """
+    Canonicalize generation parameters so equivalent requests hash the same
+    (e.g. 1 and 1.0, or parameters given in a different order).
+    """
+    normalized = {}
+    for key, value in (params or {}).items():
+        if isinstance(value, bool) or value is None:
+            normalized[key] = value
+        elif isinstance(value, (int, float)):
+            normalized[key] = float(value)
+        else:
+            normalized[key] = value
+    return normalized
+
+
+def is_deterministic(pipe, params: dict) -> bool:
+    """
+    Whether generating with these parameters always produces the same text.
+    Sampling is deterministic only when it is turned off, either explicitly or by the model's generation config.
+    """
+    do_sample = params.get("do_sample")
+    if do_sample is None:
+        generation_config = getattr(getattr(pipe, "model", None), "generation_config", None)
+        do_sample = getattr(generation_config, "do_sample", False)
+    return not do_sample and params.get("num_return_sequences", 1) == 1
+
+
+class ResultCache:
+    """
+    Content-addressed cache of generated texts, stored in Redis.
+
+    Entries are keyed on a hash of (model_name, input_text, normalized parameters),
+    expire after ttl_seconds, and are capped at max_entries through a sorted-set
+    index that drops the oldest entries first. Values larger than max_value_bytes are
+    not cached.
+
+    Identical requests that are already running are coalesced: within a process
+    they wait on the same Future, and across processes a short-lived Redis marker
+    makes other workers wait for the first one's result instead of recomputing it.
+    Failures are never shared: the first caller's error may be its own (cancelled, shed by
+    admission control, timed out), so when its computation fails the waiters compute again.
+    Redis failures never fail the request; the result is simply computed.
+    """
+
+    def __init__(self, redis_client, prefix: str = "ncos_result_cache:", ttl_seconds: int = 86400,
+                 max_entries: int = 10000, max_value_bytes: int = 1048576, inflight_timeout_s: float = 300.0):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.index_key = prefix + "index"
+        self.inflight_prefix = prefix + "inflight:"
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_value_bytes = max_value_bytes
+        self.inflight_timeout_s = inflight_timeout_s
+        self._inflight = {}  # key -> Future for computations running in this process
+        self._lock = threading.Lock()
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(model_name: str, input_text: str, params: Optional[dict]) -> str:
+        payload = json.dumps([model_name, input_text, normalize_params(params)], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self.redis.get(self.prefix + key)
+        except redis.RedisError as e:
+            logger.warning(f"Result cache read failed: {e}")
+            return None
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str):
+        encoded = value.encode("utf-8")
+        if len(encoded) > self.max_value_bytes:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            pipe.set(self.prefix + key, encoded, ex=self.ttl_seconds)
+            pipe.zadd(self.index_key, {key: time.time()})
+            pipe.zcard(self.index_key)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                oldest = self.redis.zpopmin(self.index_key, size - self.max_entries)
+                if oldest:
+                    self.redis.delete(*[self.prefix + member.decode("utf-8") for member, _ in oldest])
+        except redis.RedisError as e:
+            logger.warning(f"Result cache write failed: {e}")
+
+    def get_or_compute(self, key: str, compute):
+        """
+        Return the cached text for key, or run compute() once and cache its result.
+        Concurrent callers for the same key share a single successful computation; if it fails,
+        only its caller gets the error and one of the waiters runs its own compute().
+        """
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            with self._lock:
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._inflight[key] = future
+            if not owner:
+                value = future.result()
+                if value is _OWNER_FAILED:
+                    continue
+                self.coalesced += 1
+                return value
+            try:
+                value = self._compute_across_processes(key, compute)
+            except BaseException:
+                self._settle(key, future, _OWNER_FAILED)
+                raise
+            self._settle(key, future, value)
+            return value
+
+    def _settle(self, key: str, future: Future, value):
+        # Unregister first, so woken waiters that retry do not find the finished Future again
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(value)
+
+    def _compute_across_processes(self, key: str, compute):
+        marker = self.inflight_prefix + key
+        token = uuid.uuid4().hex
+        try:
+            owner = self.redis.set(marker, token, nx=True, ex=max(1, int(self.inflight_timeout_s)))
+        except redis.RedisError:
+            owner = True
+            token = None
+        if not owner:
+            # Another worker is generating this exact answer; wait for it to land in the cache
+            deadline = time.monotonic() + self.inflight_timeout_s
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                cached = self.get(key)
+                if cached is not None:
+                    self.coalesced += 1
+                    return cached
+                try:
+                    if not self.redis.exists(marker):
+                        break
+                except redis.RedisError:
+                    break
+            token = None
+        self.misses += 1
+        try:
+            value = compute()
+            self.set(key, value)
+            return value
+        finally:
+            if token is not None:
+                try:
+                    self._release(keys=[marker], args=[token])
+                except redis.RedisError:
+                    pass
+
+    def stats(self) -> dict:
+        try:
+            entries = self.redis.zcard(self.index_key)
+        except redis.RedisError:
+            entries = None
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
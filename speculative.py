@@ -0,0 +1,172 @@
+import threading
+import time
+from typing import Optional
+
+import torch
+
+from metrics import stage_timer
+from streaming import PIPELINE_ONLY_PARAMS
+
+_active = threading.local()  # Forward-call counts of the generation running on this thread
+
+
+def _count_forward(module, inputs, output):
+    counts = getattr(_active, "counts", None)
+    if counts is not None:
+        counts[id(module)] = counts.get(id(module), 0) + 1
+
+
+def _ensure_counted(model):
+    # One hook per model, shared by every generation; it only counts while a speculative call is measuring
+    if not getattr(model, "_ncos_forward_counted", False):
+        model.register_forward_hook(_count_forward)
+        model._ncos_forward_counted = True
+
+
+class SpeculativeStats:
+    """
+    Running totals of speculative generations for one (model, draft) pair.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self.proposed = 0
+        self.accepted = 0
+        self.target_forwards = 0
+
+    def record(self, tokens: int, seconds: float, proposed: int, accepted: int, target_forwards: int):
+        with self._lock:
+            self.calls += 1
+            self.tokens += tokens
+            self.seconds += seconds
+            self.proposed += proposed
+            self.accepted += accepted
+            self.target_forwards += target_forwards
+
+    def snapshot(self, model_stats: Optional[dict] = None) -> dict:
+        """
+        model_stats is the target model's engine snapshot (all its generate() calls, speculative ones included);
+        plain decoding throughput is what remains after taking out the speculative calls.
+        """
+        with self._lock:
+            tokens_per_s = self.tokens / self.seconds if self.seconds else 0.0
+            snapshot = {
+                "calls": self.calls,
+                "tokens": self.tokens,
+                "seconds": round(self.seconds, 3),
+                "tokens_per_s": round(tokens_per_s, 2),
+                "draft_tokens_proposed": self.proposed,
+                "draft_tokens_accepted": self.accepted,
+                "acceptance_rate": round(self.accepted / self.proposed, 3) if self.proposed else None,
+                # Upper bound on the speedup if draft forwards were free
+                "tokens_per_target_forward": round(self.tokens / self.target_forwards, 2) if self.target_forwards else None,
+                "speedup": None,
+            }
+            if model_stats:
+                plain_tokens = model_stats.get("tokens", 0) - self.tokens
+                plain_seconds = model_stats.get("seconds", 0.0) - self.seconds
+                if plain_tokens > 0 and plain_seconds > 0 and tokens_per_s:
+                    snapshot["speedup"] = round(tokens_per_s / (plain_tokens / plain_seconds), 2)
+            return snapshot
+
+
+class SpeculativeDecoder:
+    """
+    Assisted generation: a small draft model with the same tokenizer proposes several tokens, and the
+    target model checks all of them in one forward pass, keeping the longest prefix it agrees with plus
+    one token of its own. With greedy decoding the output is identical to plain decoding.
+
+    Requests opt in with parameters["draft_model"] (a model name, or 'none' to opt out); otherwise
+    default_draft is used when set. Draft pipelines come from get_pipeline, e.g. the model cache.
+    Acceptance is measured by counting forward passes of both models during each call: every draft
+    forward proposes one token, and every target forward yields one token besides the accepted ones.
+    Assisted generation runs one prompt at a time, so these calls bypass the micro-batcher and the prefix cache.
+    """
+
+    def __init__(self, get_pipeline, default_draft: str = "", num_assistant_tokens: int = 0):
+        self.get_pipeline = get_pipeline
+        self.default_draft = default_draft
+        self.num_assistant_tokens = num_assistant_tokens
+        self._lock = threading.Lock()
+        self._stats = {}  # (model name, draft name) -> SpeculativeStats
+
+    def draft_for(self, model_name: str, params: dict) -> Optional[str]:
+        """
+        Remove the speculative options from params and return the draft model to use, or None.
+        """
+        draft = params.pop("draft_model", self.default_draft)
+        if draft is None or draft is False or str(draft).strip().lower() in ("", "none", "false") or draft == model_name:
+            return None
+        return str(draft)
+
+    def _draft_model(self, pipe, draft_name: str):
+        draft = self.get_pipeline(draft_name)
+        if len(draft.tokenizer) != len(pipe.tokenizer) or draft.tokenizer.eos_token_id != pipe.tokenizer.eos_token_id:
+            raise ValueError(f"Draft model {draft_name} does not share the target model's tokenizer.")
+        if self.num_assistant_tokens and getattr(draft.model, "_ncos_assistant_tokens", None) != self.num_assistant_tokens:
+            draft.model.generation_config.num_assistant_tokens = self.num_assistant_tokens
+            draft.model._ncos_assistant_tokens = self.num_assistant_tokens
+        return draft.model
+
+    def generate(self, pipe, model_name: str, draft_name: str, input_text: str, params: dict) -> str:
+        """
+        Generate text for one prompt with draft_name assisting, returning what the text-generation pipeline would.
+        """
+        if params.get("num_return_sequences", 1) != 1:
+            raise ValueError("Speculative decoding supports num_return_sequences=1 only.")
+        draft = self._draft_model(pipe, draft_name)
+        tokenizer, model = pipe.tokenizer, pipe.model
+        _ensure_counted(model)
+        _ensure_counted(draft)
+        gen_params = dict(params)
+        return_full_text = gen_params.pop("return_full_text", True)
+        for key in PIPELINE_ONLY_PARAMS:
+            gen_params.pop(key, None)
+        with stage_timer("tokenize"):
+            inputs = tokenizer(input_text, return_tensors="pt").to(model.device)
+        prompt_length = inputs["input_ids"].shape[-1]
+        counts = {}
+        _active.counts = counts
+        started = time.perf_counter()
+        try:
+            with torch.no_grad():
+                output = model.generate(
+                    **inputs,
+                    assistant_model=draft,
+                    pad_token_id=tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id,
+                    **gen_params,
+                )
+        finally:
+            _active.counts = None
+        seconds = time.perf_counter() - started
+        sequences = getattr(output, "sequences", output)
+        tokens = max(0, sequences.shape[-1] - prompt_length)
+        proposed = counts.get(id(draft), 0)
+        target_forwards = counts.get(id(model), 0)
+        accepted = min(proposed, max(0, tokens - target_forwards))
+        self._stats_for(model_name, draft_name).record(tokens, seconds, proposed, accepted, target_forwards)
+        generated = tokenizer.decode(sequences[0][prompt_length:], skip_special_tokens=True)
+        return input_text + generated if return_full_text else generated
+
+    def _stats_for(self, model_name: str, draft_name: str) -> SpeculativeStats:
+        with self._lock:
+            return self._stats.setdefault((model_name, draft_name), SpeculativeStats())
+
+    def stats(self, engine_models: Optional[dict] = None) -> dict:
+        """
+        Per model/draft pair counters. engine_models maps model names to their engine snapshots,
+        which are used to compare against plain decoding throughput.
+        """
+        with self._lock:
+            pairs = list(self._stats.items())
+        return {
+            "default_draft_model": self.default_draft or None,
+            "num_assistant_tokens": self.num_assistant_tokens or None,
+            "pairs": [
+                {"model_name": model_name, "draft_model": draft_name, **stats.snapshot((engine_models or {}).get(model_name))}
+                for (model_name, draft_name), stats in pairs
+            ],
+        }
@@ -0,0 +1,76 @@
+import threading
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+from metrics import stage_timer
+
+# Pipeline call options that are not generate() kwargs
+PIPELINE_ONLY_PARAMS = ("return_full_text", "return_text", "return_tensors", "clean_up_tokenization_spaces", "prefix", "handle_long_generation", "batch_size")
+
+
+class CancelOnEvent(StoppingCriteria):
+    """
+    Stops generation at the next decoding step once the event is set.
+    """
+
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class TokenStream:
+    """
+    Runs generate() for one prompt on a background thread and yields decoded
+    text chunks as soon as they are produced.
+
+    Call cancel() to stop generating early, e.g. when the client has gone away.
+    After iteration finishes, `error` holds the exception raised by generate(), if any,
+    and `text` holds the same string the text-generation pipeline would have returned.
+    """
+
+    def __init__(self, pipe, input_text: str, params: dict):
+        self.input_text = input_text
+        self.error = None
+        self.chunks = []
+        self.cancelled = threading.Event()
+        params = dict(params)
+        self.return_full_text = params.pop("return_full_text", True)
+        for key in PIPELINE_ONLY_PARAMS:
+            params.pop(key, None)
+        tokenizer = pipe.tokenizer
+        self._streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        with stage_timer("tokenize"):
+            inputs = tokenizer(input_text, return_tensors="pt").to(pipe.device)
+        stopping = StoppingCriteriaList([CancelOnEvent(self.cancelled)])
+        self._thread = threading.Thread(
+            target=self._generate,
+            args=(pipe.model, dict(**inputs, streamer=self._streamer, stopping_criteria=stopping, **params)),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _generate(self, model, kwargs: dict):
+        try:
+            with torch.no_grad():
+                model.generate(**kwargs)
+        except Exception as e:
+            self.error = e
+            # Unblock the consumer; it would otherwise wait on the streamer forever
+            self._streamer.end()
+
+    def __iter__(self):
+        for chunk in self._streamer:
+            if chunk:
+                self.chunks.append(chunk)
+                yield chunk
+
+    def cancel(self):
+        self.cancelled.set()
+
+    @property
+    def text(self) -> str:
+        generated = "".join(self.chunks)
+        return self.input_text + generated if self.return_full_text else generated
@@ -0,0 +1,399 @@
+# Bulk compliance test-suite runner: streams test cases from a JSONL/CSV file or a Supabase table, runs them
+# through the model in large length-bucketed batches, and appends one result line per case to a JSONL file.
+# A checkpoint next to the output records how far the run got, so an interrupted run picks up where it stopped:
+#
+#   python suite_runner.py --cases cases.jsonl --output results.jsonl
+#   python suite_runner.py --table test_cases --filter suite=eq.aml --output aml.jsonl --supabase-results
+#
+# Cases need an input_text (or prompt); case_id/id, expected and parameters are optional. A case with an
+# expected answer passes when the expected text appears in the output, ignoring case and whitespace.
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from typing import Optional
+
+logger = logging.getLogger("ncos-backend")
+
+# --- Suite Runner Configuration ---
+SUITE_WINDOW_SIZE = int(os.getenv("SUITE_WINDOW_SIZE", "2048"))  # Cases read ahead and sorted by length together
+SUITE_BATCH_SIZE = int(os.getenv("SUITE_BATCH_SIZE", "32"))  # Prompts per generate() call
+SUITE_MAX_BATCH_TOKENS = int(os.getenv("SUITE_MAX_BATCH_TOKENS", "16384"))  # Padded prompt tokens per batch
+SUITE_PROGRESS_INTERVAL_S = float(os.getenv("SUITE_PROGRESS_INTERVAL_S", "10"))
+SUITE_CASES_TABLE = os.getenv("SUITE_CASES_TABLE", "test_cases")
+
+
+def _normalize_case(row: dict, index: int) -> dict:
+    parameters = row.get("parameters") or None
+    if isinstance(parameters, str):
+        parameters = json.loads(parameters)
+    case_id = row.get("case_id") if row.get("case_id") not in (None, "") else row.get("id")
+    return {
+        "case_id": str(case_id if case_id not in (None, "") else index),
+        "input_text": row.get("input_text") or row.get("prompt") or "",
+        "expected": row.get("expected") if row.get("expected") not in ("", None) else None,
+        "parameters": parameters,
+    }
+
+
+def _read_rows(path: str):
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_file_cases(path: str, cursor: Optional[int] = None):
+    """
+    Yield (cursor, case) for the cases in a JSONL or CSV file, starting after cursor cases.
+    The cursor after a case is its 1-based position in the file.
+    """
+    start = cursor or 0
+    for index, row in enumerate(_read_rows(path)):
+        if index >= start:
+            yield index + 1, _normalize_case(row, index)
+
+
+def count_file_cases(path: str) -> int:
+    return sum(1 for _ in _read_rows(path))
+
+
+def iter_table_cases(table: str, cursor: Optional[dict] = None, filters: dict = None):
+    """
+    Yield (cursor, case) for the rows of a Supabase table in id order, starting after the row in cursor.
+    """
+    from supabase_rest import iter_table_rows
+
+    for row in iter_table_rows(f"/rest/v1/{table}", filters=filters, order_by="id", after=cursor):
+        yield {"id": row["id"]}, _normalize_case(row, row["id"])
+
+
+def expected_matches(output: str, expected: str) -> bool:
+    normalize = lambda text: " ".join(str(text).split()).lower()
+    return normalize(expected) in normalize(output)
+
+
+def length_buckets(cases: list, lengths: list, batch_size: int, max_batch_tokens: int) -> list:
+    """
+    Group cases into batches of similar prompt length: sort by length and cut a batch when it reaches
+    batch_size prompts or its padded size (prompts x longest prompt) would exceed max_batch_tokens.
+    """
+    batches, batch, longest = [], [], 0
+    for length, case in sorted(zip(lengths, cases), key=lambda pair: pair[0]):
+        if batch and (len(batch) >= batch_size or (len(batch) + 1) * max(longest, length) > max_batch_tokens):
+            batches.append(batch)
+            batch, longest = [], 0
+        batch.append(case)
+        longest = max(longest, length)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class Checkpoint:
+    """
+    The resume point of a run, rewritten atomically after every batch: the source cursor of the window in
+    progress, the case ids of that window already written, and the output file size at that moment.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state: dict):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class SuiteProgress:
+    def __init__(self, total: Optional[int], done: int = 0, passed: int = 0, failed: int = 0, errors: int = 0):
+        self.total = total
+        self.resumed_from = done
+        self.done = done
+        self.passed = passed
+        self.failed = failed
+        self.errors = errors
+        self.started_at = time.monotonic()
+
+    def record(self, result: dict):
+        self.done += 1
+        if result["error"] is not None:
+            self.errors += 1
+        elif result["passed"] is True:
+            self.passed += 1
+        elif result["passed"] is False:
+            self.failed += 1
+
+    def snapshot(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        rate = (self.done - self.resumed_from) / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if self.total is not None and rate > 0 else None
+        return {
+            "done": self.done,
+            "total": self.total,
+            "passed": self.passed,
+            "failed": self.failed,
+            "errors": self.errors,
+            "cases_per_s": round(rate, 2),
+            "eta_seconds": round(max(0.0, eta), 1) if eta is not None else None,
+            "elapsed_seconds": round(elapsed, 1),
+        }
+
+
+class SuiteRunner:
+    """
+    Runs test cases through a text-generation pipeline in length-bucketed batches.
+
+    Cases are read window_size at a time in source order; each window is sorted by prompt token length
+    and cut into batches, so prompts in a batch need little padding without loading the whole suite.
+    Results are appended to output_path as they finish and the checkpoint is updated after every batch.
+    On restart the output is truncated to the size recorded in the checkpoint, the source is reopened at
+    the window in progress, and the cases of that window already written are skipped.
+    """
+
+    def __init__(self, pipe, model_name: str, output_path: str, checkpoint_path: Optional[str] = None,
+                 parameters: Optional[dict] = None, window_size: int = SUITE_WINDOW_SIZE,
+                 batch_size: int = SUITE_BATCH_SIZE, max_batch_tokens: int = SUITE_MAX_BATCH_TOKENS, result_sinks=()):
+        self.pipe = pipe
+        self.model_name = model_name
+        self.output_path = output_path
+        self.checkpoint = Checkpoint(checkpoint_path or output_path + ".checkpoint.json")
+        self.parameters = {"max_new_tokens": 128, "do_sample": False, **(parameters or {})}
+        self.window_size = window_size
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.result_sinks = list(result_sinks)  # Callables taking each batch's result dicts, e.g. a Supabase insert
+        self.progress = None
+
+    def run(self, open_source, source_id: str, total: Optional[int] = None) -> dict:
+        """
+        Run every case from open_source(cursor), an iterator of (cursor, case) starting after cursor
+        (None for the beginning). source_id identifies the suite so a checkpoint is only reused for the same one.
+        Returns the final progress snapshot.
+        """
+        state = self.checkpoint.load()
+        if state is not None and state.get("source") == source_id and state.get("model_name") == self.model_name:
+            logger.info(f"Resuming suite {source_id} after {state['done']} cases.")
+            # The window in progress must be re-read with the same boundaries
+            self.window_size = state["window_size"]
+        else:
+            state = {"source": source_id, "model_name": self.model_name, "window_size": self.window_size, "cursor": None,
+                     "window_done": [], "output_bytes": 0, "done": 0, "passed": 0, "failed": 0, "errors": 0}
+        self.progress = SuiteProgress(total, state["done"], state["passed"], state["failed"], state["errors"])
+        last_report = time.monotonic()
+        with open(self.output_path, "a+b") as output:
+            output.truncate(state["output_bytes"])
+            output.seek(state["output_bytes"])
+            source = open_source(state["cursor"])
+            while True:
+                window, window_cursor = [], state["cursor"]
+                for cursor, case in source:
+                    window.append(case)
+                    window_cursor = cursor
+                    if len(window) >= self.window_size:
+                        break
+                if not window:
+                    break
+                done_ids = set(state["window_done"])
+                for batch in self._batches([case for case in window if case["case_id"] not in done_ids]):
+                    results = self._run_batch(batch)
+                    for result in results:
+                        output.write((json.dumps(result) + "\n").encode("utf-8"))
+                        self.progress.record(result)
+                    output.flush()
+                    os.fsync(output.fileno())
+                    for sink in self.result_sinks:
+                        sink(results)
+                    state["window_done"] += [result["case_id"] for result in results]
+                    self._save(state, output.tell())
+                    if time.monotonic() - last_report >= SUITE_PROGRESS_INTERVAL_S:
+                        last_report = time.monotonic()
+                        self._log_progress()
+                state["cursor"], state["window_done"] = window_cursor, []
+                self._save(state, output.tell())
+        self._log_progress()
+        return self.progress.snapshot()
+
+    def _save(self, state: dict, output_bytes: int):
+        state.update(
+            output_bytes=output_bytes,
+            done=self.progress.done,
+            passed=self.progress.passed,
+            failed=self.progress.failed,
+            errors=self.progress.errors,
+        )
+        self.checkpoint.save(state)
+
+    def _log_progress(self):
+        p = self.progress.snapshot()
+        total = p["total"] if p["total"] is not None else "?"
+        eta = f"{p['eta_seconds']:.0f}s" if p["eta_seconds"] is not None else "unknown"
+        logger.info(f"Suite progress: {p['done']}/{total} cases, {p['cases_per_s']} cases/s, ETA {eta}, "
+                    f"passed={p['passed']} failed={p['failed']} errors={p['errors']}")
+
+    def _batches(self, cases: list) -> list:
+        # Cases with their own parameters can only share a generate() call with cases using the same ones
+        groups = {}
+        for case in cases:
+            params = {**self.parameters, **(case["parameters"] or {})}
+            groups.setdefault(json.dumps(params, sort_keys=True), (params, []))[1].append(case)
+        batches = []
+        for params, group in groups.values():
+            lengths = [len(ids) for ids in self.pipe.tokenizer([case["input_text"] for case in group])["input_ids"]]
+            batches += [(params, batch) for batch in length_buckets(group, lengths, self.batch_size, self.max_batch_tokens)]
+        return batches
+
+    def _run_batch(self, params_and_cases) -> list:
+        params, cases = params_and_cases
+        started = time.perf_counter()
+        texts = [case["input_text"] for case in cases]
+        # Outputs are scored without the prompt, whatever the suite or case parameters say
+        params = {**params, "return_full_text": False}
+        try:
+            outputs = self.pipe(texts, **{**params, "batch_size": len(texts)})
+            outcomes = [(output[0]["generated_text"], None) for output in outputs]
+        except Exception as e:
+            # One bad prompt should not fail the cases it was batched with
+            logger.error(f"Suite batch of {len(cases)} failed, retrying individually: {e}")
+            outcomes = []
+            for text in texts:
+                try:
+                    outcomes.append((self.pipe(text, **params)[0]["generated_text"], None))
+                except Exception as case_error:
+                    outcomes.append(("", f"{type(case_error).__name__}: {case_error}"))
+        seconds = round((time.perf_counter() - started) / len(cases), 4)
+        results = []
+        for case, (output, error) in zip(cases, outcomes):
+            expected = case["expected"]
+            results.append({
+                "case_id": case["case_id"],
+                "input_text": case["input_text"],
+                "output": output,
+                "expected": expected,
+                "passed": expected_matches(output, expected) if expected is not None and error is None else None,
+                "error": error,
+                "model_name": self.model_name,
+                "seconds": seconds,
+            })
+        return results
+
+
+def _result_rows(suite: str, parameters: dict, results: list) -> list:
+    return [
+        {
+            "job_id": f"suite:{suite}:{result['case_id']}",
+            "input_text": result["input_text"],
+            "parameters": str(parameters),
+            "model_name": result["model_name"],
+            "result": result["output"] if result["error"] is None else f"ERROR: {result['error']}",
+        }
+        for result in results
+    ]
+
+
+def supabase_result_sink(suite: str, parameters: dict):
+    """
+    Return a result sink that inserts each batch of results into the inference_results table.
+    """
+    from supabase_rest import insert_inference_result
+
+    return lambda results: insert_inference_result(_result_rows(suite, parameters, results))
+
+
+def archive_result_sink(path: str, suite: str, parameters: dict):
+    """
+    Return a result sink that writes each batch of results, with their verdicts, to a local ResultArchive.
+    """
+    from result_archive import ResultArchive
+
+    archive = ResultArchive(path)
+
+    def sink(results: list):
+        rows = _result_rows(suite, parameters, results)
+        for row, result in zip(rows, results):
+            row.update(status="done" if result["error"] is None else "error", passed=result["passed"], suite=suite, seconds=result["seconds"])
+        archive.write_many(rows)
+
+    return sink
+
+
+def _parse_filters(filters: list) -> dict:
+    parsed = {}
+    for item in filters or []:
+        column, _, condition = item.partition("=")
+        parsed[column] = condition
+    return parsed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run a compliance test suite through the model in bulk.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--cases", help="JSONL or CSV file of test cases")
+    source.add_argument("--table", nargs="?", const=SUITE_CASES_TABLE, help="Supabase table of test cases")
+    parser.add_argument("--filter", action="append", help="PostgREST filter for --table, e.g. suite=eq.aml")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <output>.checkpoint.json)")
+    parser.add_argument("--model", default=os.getenv("HF_MODEL_NAME", "distilgpt2"))
+    parser.add_argument("--parameters", default=None, help="JSON generation parameters for every case")
+    parser.add_argument("--window", type=int, default=SUITE_WINDOW_SIZE)
+    parser.add_argument("--batch-size", type=int, default=SUITE_BATCH_SIZE)
+    parser.add_argument("--max-batch-tokens", type=int, default=SUITE_MAX_BATCH_TOKENS)
+    parser.add_argument("--supabase-results", action="store_true", help="Also insert results into inference_results")
+    parser.add_argument("--archive", default=None, help="Also write results to this local result archive (SQLite)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from batching import prepare_tokenizer_for_batching
+    from engine import build_pipeline
+
+    parameters = json.loads(args.parameters) if args.parameters else {}
+    if args.cases:
+        suite = os.path.abspath(args.cases)
+        total = count_file_cases(args.cases)
+        open_source = lambda cursor: iter_file_cases(args.cases, cursor)
+    else:
+        filters = _parse_filters(args.filter)
+        suite = f"{args.table}?{json.dumps(filters, sort_keys=True)}"
+        total = None
+        open_source = lambda cursor: iter_table_cases(args.table, cursor, filters)
+    suite_name = os.path.basename(args.cases or args.table)
+    sinks = []
+    if args.supabase_results:
+        sinks.append(supabase_result_sink(suite_name, parameters))
+    if args.archive:
+        sinks.append(archive_result_sink(args.archive, suite_name, parameters))
+    pipe = build_pipeline(args.model, prepare_tokenizer=prepare_tokenizer_for_batching)
+    runner = SuiteRunner(
+        pipe,
+        args.model,
+        args.output,
+        checkpoint_path=args.checkpoint,
+        parameters=parameters,
+        window_size=args.window,
+        batch_size=args.batch_size,
+        max_batch_tokens=args.max_batch_tokens,
+        result_sinks=sinks,
+    )
+    summary = runner.run(open_source, suite, total)
+    print(json.dumps(summary))
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,444 @@
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+
+import httpx
+
+from metrics import stage_timer
+
+logger = logging.getLogger("ncos-backend")
+
+# --- Supabase REST API Connection ---
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_TABLE_PATH = "/rest/v1/inference_results"
+SUPABASE_RESULT_COLUMNS = ("job_id", "input_text", "parameters", "model_name", "result")  # Columns of inference_results
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "10"))
+SUPABASE_TIMEOUT_S = float(os.getenv("SUPABASE_TIMEOUT_S", "10"))
+
+# One pooled client for every Supabase call, so requests reuse keep-alive connections instead of
+# opening a new connection and TLS session each time.
+supabase_http = None
+if SUPABASE_URL and SUPABASE_KEY:
+    supabase_http = httpx.Client(
+        base_url=SUPABASE_URL,
+        headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+        timeout=SUPABASE_TIMEOUT_S,
+        limits=httpx.Limits(max_connections=SUPABASE_MAX_CONNECTIONS, max_keepalive_connections=SUPABASE_MAX_CONNECTIONS),
+    )
+
+def async_supabase_client():
+    """
+    Build the httpx.AsyncClient counterpart of supabase_http for event-loop code, or None if Supabase
+    is not configured. The client belongs to the event loop it is used on, so create and close it in the
+    app lifespan.
+    """
+    if not (SUPABASE_URL and SUPABASE_KEY):
+        return None
+    return httpx.AsyncClient(
+        base_url=SUPABASE_URL,
+        headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+        timeout=SUPABASE_TIMEOUT_S,
+        limits=httpx.Limits(max_connections=SUPABASE_MAX_CONNECTIONS, max_keepalive_connections=SUPABASE_MAX_CONNECTIONS),
+    )
+
+# --- Supabase REST API Helper Functions ---
+
+def insert_inference_result(data) -> bool:
+    """
+    Insert a row, or a list of rows, into the inference_results table using Supabase REST API.
+    Returns True if successful, False otherwise.
+    """
+    if supabase_http is None:
+        logger.warning("Supabase credentials not set. Skipping Supabase integration.")
+        return False
+    headers = {"Content-Type": "application/json", "Prefer": "return=minimal"}
+    try:
+        response = supabase_http.post(SUPABASE_TABLE_PATH, json=data, headers=headers)
+        if response.status_code == 201:
+            logger.info(f"Stored {_describe_rows(data)} in Supabase via REST API.")
+            return True
+        else:
+            logger.error(f"Failed to store {_describe_rows(data)} in Supabase: {response.status_code} {response.text}")
+            return False
+    except Exception as e:
+        logger.error(f"Exception during Supabase REST API call: {e}")
+        return False
+
+def select_inference_results(filters: dict = None, columns: str = "*", limit: int = None) -> list:
+    """
+    Select rows from the inference_results table using Supabase REST API.
+    filters: dict of query params (e.g., {"job_id": "eq.test123"})
+    columns: comma-separated columns to return (PostgREST select syntax)
+    limit: maximum number of rows to return
+    Returns a list of results or an empty list.
+    For large result sets use iter_inference_results, which pages through rows instead of loading them all.
+    """
+    if supabase_http is None:
+        logger.warning("Supabase credentials not set. Skipping Supabase integration.")
+        return []
+    params = {"select": columns}
+    if filters:
+        params.update(filters)
+    if limit is not None:
+        params["limit"] = limit
+    try:
+        response = supabase_http.get(SUPABASE_TABLE_PATH, params=params)
+        if response.status_code == 200:
+            logger.info(f"Selected results from Supabase via REST API.")
+            return response.json()
+        else:
+            logger.error(f"Failed to select from Supabase: {response.status_code} {response.text}")
+            return []
+    except Exception as e:
+        logger.error(f"Exception during Supabase REST API select: {e}")
+        return []
+
+# Columns that can drive keyset pagination; job_id breaks ties between rows with the same created_at
+KEYSET_COLUMNS = {"id": ("id",), "job_id": ("job_id",), "created_at": ("created_at", "job_id")}
+
+def _quote(value) -> str:
+    # Values inside PostgREST logical filters must be double-quoted when they contain reserved characters
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _keyset_condition(order_by: str, last_row: dict) -> str:
+    if order_by != "created_at":
+        return f"{order_by}.gt.{_quote(last_row[order_by])}"
+    created_at, job_id = _quote(last_row["created_at"]), _quote(last_row["job_id"])
+    return f"or(created_at.gt.{created_at},and(created_at.eq.{created_at},job_id.gt.{job_id}))"
+
+def iter_inference_results(filters: dict = None, columns: str = "*", order_by: str = "job_id",
+                           page_size: int = 1000, limit: int = None):
+    """
+    Lazily yield rows from the inference_results table, one page at a time. See iter_table_rows.
+    """
+    return iter_table_rows(SUPABASE_TABLE_PATH, filters, columns, order_by, page_size, limit)
+
+def aiter_inference_results(client: httpx.AsyncClient, filters: dict = None, columns: str = "*", order_by: str = "job_id",
+                            page_size: int = 1000, limit: int = None):
+    """
+    Async version of iter_inference_results. See aiter_table_rows.
+    """
+    return aiter_table_rows(client, SUPABASE_TABLE_PATH, filters, columns, order_by, page_size, limit)
+
+class _KeysetPages:
+    """
+    Request parameters and row bookkeeping for keyset pagination, shared by iter_table_rows and aiter_table_rows.
+    """
+
+    def __init__(self, filters: dict, columns: str, order_by: str, page_size: int, limit: int, after: dict):
+        if order_by not in KEYSET_COLUMNS:
+            raise ValueError(f"order_by must be one of {sorted(KEYSET_COLUMNS)}")
+        self.order_by = order_by
+        self.keyset = KEYSET_COLUMNS[order_by]
+        requested = [c.strip() for c in columns.split(",") if c.strip()]
+        self.extra = [] if "*" in requested else [c for c in self.keyset if c not in requested]
+        self.base_params = dict(filters or {})
+        extra_conditions = self.base_params.pop("and", None)
+        if extra_conditions and extra_conditions.startswith("(") and extra_conditions.endswith(")"):
+            extra_conditions = extra_conditions[1:-1]
+        self.extra_conditions = extra_conditions
+        self.base_params["select"] = ",".join(requested + self.extra)
+        self.base_params["order"] = ",".join(f"{c}.asc" for c in self.keyset)
+        self.page_size = page_size
+        self.last_row = after
+        self.remaining = limit
+        self.rows_wanted = 0
+        self.done = False
+
+    def next_request(self):
+        """
+        Return (params, headers) for the next page, or None once every page has been read.
+        """
+        if self.done or (self.remaining is not None and self.remaining <= 0):
+            return None
+        self.rows_wanted = self.page_size if self.remaining is None else min(self.page_size, self.remaining)
+        params = dict(self.base_params)
+        conditions = [self.extra_conditions] if self.extra_conditions else []
+        if self.last_row is not None:
+            conditions.append(_keyset_condition(self.order_by, self.last_row))
+        if conditions:
+            params["and"] = f"({','.join(conditions)})"
+        return params, {"Range-Unit": "items", "Range": f"0-{self.rows_wanted - 1}"}
+
+    def take(self, rows: list) -> list:
+        """
+        Record a fetched page and return its rows, minus the keyset columns that were not requested.
+        """
+        if rows:
+            self.last_row = {c: rows[-1].get(c) for c in self.keyset}
+        for row in rows:
+            for c in self.extra:
+                row.pop(c, None)
+        if self.remaining is not None:
+            self.remaining -= len(rows)
+        self.done = len(rows) < self.rows_wanted
+        return rows
+
+def iter_table_rows(table_path: str, filters: dict = None, columns: str = "*", order_by: str = "job_id",
+                    page_size: int = 1000, limit: int = None, after: dict = None):
+    """
+    Lazily yield rows from a table, one page at a time.
+    table_path: REST path of the table, e.g. /rest/v1/inference_results
+    filters: dict of PostgREST query params applied server-side (e.g., {"model_name": "eq.gpt2"})
+    columns: comma-separated columns to return; the keyset columns are fetched as well but only
+             returned if requested
+    order_by: 'id', 'job_id' or 'created_at'; pages are fetched with keyset pagination on that column
+              (plus job_id as a tie-breaker for created_at) and sized with a Range header
+    page_size: rows per request
+    limit: stop after this many rows
+    after: keyset values of a row to resume after, e.g. {"id": 1234}
+    Raises RuntimeError if Supabase is not configured and httpx.HTTPStatusError if a page request fails.
+    """
+    if supabase_http is None:
+        raise RuntimeError("Supabase credentials not set.")
+    pages = _KeysetPages(filters, columns, order_by, page_size, limit, after)
+    request = pages.next_request()
+    while request is not None:
+        params, headers = request
+        response = supabase_http.get(table_path, params=params, headers=headers)
+        response.raise_for_status()
+        yield from pages.take(response.json())
+        request = pages.next_request()
+
+async def aiter_table_rows(client: httpx.AsyncClient, table_path: str, filters: dict = None, columns: str = "*",
+                           order_by: str = "job_id", page_size: int = 1000, limit: int = None, after: dict = None):
+    """
+    Async version of iter_table_rows that fetches pages with client (see async_supabase_client),
+    so an event loop can stream a large table without holding a thread.
+    """
+    pages = _KeysetPages(filters, columns, order_by, page_size, limit, after)
+    request = pages.next_request()
+    while request is not None:
+        params, headers = request
+        response = await client.get(table_path, params=params, headers=headers)
+        response.raise_for_status()
+        for row in pages.take(response.json()):
+            yield row
+        request = pages.next_request()
+
+def update_inference_result(job_id: str, update_data: dict) -> bool:
+    """
+    Update a row in the inference_results table using Supabase REST API.
+    job_id: the job_id to match
+    update_data: dict of fields to update
+    Returns True if successful, False otherwise.
+    """
+    if supabase_http is None:
+        logger.warning("Supabase credentials not set. Skipping Supabase integration.")
+        return False
+    headers = {"Content-Type": "application/json"}
+    params = {"job_id": f"eq.{job_id}"}
+    try:
+        response = supabase_http.patch(SUPABASE_TABLE_PATH, json=update_data, headers=headers, params=params)
+        if response.status_code in (200, 204):
+            logger.info(f"Updated job {job_id} in Supabase via REST API.")
+            return True
+        else:
+            logger.error(f"Failed to update job {job_id} in Supabase: {response.status_code} {response.text}")
+            return False
+    except Exception as e:
+        logger.error(f"Exception during Supabase REST API update: {e}")
+        return False
+
+def delete_inference_result(job_id: str) -> bool:
+    """
+    Delete a row from the inference_results table using Supabase REST API.
+    job_id: the job_id to match
+    Returns True if successful, False otherwise.
+    """
+    if supabase_http is None:
+        logger.warning("Supabase credentials not set. Skipping Supabase integration.")
+        return False
+    params = {"job_id": f"eq.{job_id}"}
+    try:
+        response = supabase_http.delete(SUPABASE_TABLE_PATH, params=params)
+        if response.status_code in (200, 204):
+            logger.info(f"Deleted job {job_id} from Supabase via REST API.")
+            return True
+        else:
+            logger.error(f"Failed to delete job {job_id} from Supabase: {response.status_code} {response.text}")
+            return False
+    except Exception as e:
+        logger.error(f"Exception during Supabase REST API delete: {e}")
+        return False
+
+def _describe_rows(data) -> str:
+    if isinstance(data, list):
+        return f"{len(data)} job results"
+    return f"job {data.get('job_id')} result"
+
+# --- Background Result Writer ---
+
+class SupabaseWriter:
+    """
+    Buffers inference results in process and bulk-inserts them into inference_results
+    from a background thread, so workers never wait on Supabase.
+
+    Rows are flushed as one JSON array POST once batch_size rows are buffered or
+    flush_interval_s has passed. Failed flushes are retried with exponential backoff;
+    rows that still cannot be written are appended to an on-disk JSONL journal. The
+    journal, including one left by a previous process, is replayed at start-up, after
+    the next successful flush, and every replay_interval_s while there is nothing else
+    to write. Replayed rows are only dropped from disk once Supabase has taken them, so
+    a crash mid-replay may send some twice but loses none. Rows Supabase rejects outright
+    (4xx other than 408/429) are moved to '<journal>.rejected' instead of being retried forever.
+    If columns is given, submitted rows are cut down to those columns.
+    """
+
+    def __init__(self, client, batch_size: int = 50, flush_interval_s: float = 1.0, max_retries: int = 4,
+                 backoff_s: float = 0.5, journal_path: str = "supabase_journal.jsonl", max_buffered: int = 10000,
+                 columns: tuple = None, replay_interval_s: float = 30.0):
+        self.client = client
+        self.columns = columns
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self.journal_path = journal_path
+        self.replay_path = journal_path + ".replay"
+        self.replay_interval_s = replay_interval_s
+        self._buffer = queue.Queue(maxsize=max_buffered)
+        self._journal_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.written = 0
+        self.journaled = 0
+        self._thread = threading.Thread(target=self._run, name="supabase-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row: dict):
+        """
+        Queue a row for the next bulk insert. Never blocks; if the buffer is full the row goes straight to the journal.
+        """
+        if self.columns is not None:
+            row = {column: row[column] for column in self.columns if column in row}
+        try:
+            self._buffer.put_nowait(row)
+        except queue.Full:
+            logger.warning(f"Supabase writer buffer full, journaling job {row.get('job_id')}.")
+            self._journal([row])
+
+    def close(self, timeout: float = 10.0):
+        """
+        Flush buffered rows and stop the writer thread.
+        """
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        next_replay = 0.0  # Replay a journal left by a previous process right away
+        while True:
+            batch = self._collect()
+            if batch:
+                if self._write(batch):
+                    next_replay = 0.0
+                else:
+                    next_replay = time.monotonic() + self.replay_interval_s
+            elif self._stopped.is_set():
+                return
+            if time.monotonic() >= next_replay:
+                next_replay = time.monotonic() + self.replay_interval_s
+                self._replay_journal()
+
+    def _collect(self) -> list:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval_s
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._buffer.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, rows: list) -> bool:
+        """
+        Bulk-insert rows, retrying transient failures. Returns True if Supabase accepted them.
+        """
+        headers = {"Content-Type": "application/json", "Prefer": "return=minimal"}
+        for attempt in range(self.max_retries + 1):
+            try:
+                with stage_timer("supabase_write"):
+                    response = self.client.post(SUPABASE_TABLE_PATH, json=rows, headers=headers)
+                if response.status_code == 201:
+                    self.written += len(rows)
+                    logger.info(f"Stored {len(rows)} job results in Supabase via REST API.")
+                    return True
+                if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                    logger.error(f"Supabase rejected {len(rows)} job results: {response.status_code} {response.text}")
+                    self._journal(rows, self.journal_path + ".rejected")
+                    return False
+                logger.warning(f"Supabase bulk insert failed ({response.status_code}), attempt {attempt + 1}.")
+            except httpx.HTTPError as e:
+                logger.warning(f"Supabase bulk insert failed ({e}), attempt {attempt + 1}.")
+            if attempt < self.max_retries:
+                time.sleep(self.backoff_s * (2 ** attempt) * (0.5 + random.random()))
+        logger.error(f"Giving up on {len(rows)} job results for now, journaling to {self.journal_path}.")
+        self._journal(rows)
+        return False
+
+    def _journal(self, rows: list, path: str = None):
+        path = path or self.journal_path
+        with self._journal_lock:
+            with open(path, "a", encoding="utf-8") as journal:
+                for row in rows:
+                    journal.write(json.dumps(row) + "\n")
+            if path == self.journal_path:
+                self.journaled += len(rows)
+
+    def _replay_journal(self):
+        """
+        Re-send journaled rows. They are moved to '<journal>.replay' first, appending to rows a failed replay left
+        there, so new failures can keep being journaled meanwhile; the file is only trimmed or removed once the
+        rows it holds are written.
+        """
+        with self._journal_lock:
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, "rb") as journal, open(self.replay_path, "a+b") as replay:
+                    replay.seek(0, os.SEEK_END)
+                    if replay.tell():
+                        replay.seek(-1, os.SEEK_END)
+                        if replay.read(1) != b"\n":
+                            # Keep a line cut short by a crash from swallowing the first appended row
+                            replay.write(b"\n")
+                    shutil.copyfileobj(journal, replay)
+                    replay.flush()
+                    os.fsync(replay.fileno())
+                os.remove(self.journal_path)
+        if not os.path.exists(self.replay_path):
+            return
+        rows = []
+        with open(self.replay_path, encoding="utf-8") as replay:
+            for line in replay:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash while journaling
+                    if line.strip():
+                        logger.warning(f"Skipping unreadable line in {self.replay_path}.")
+        logger.info(f"Replaying {len(rows)} journaled job results to Supabase.")
+        for start in range(0, len(rows), self.batch_size):
+            if not self._write(rows[start:start + self.batch_size]):
+                # _write journaled (or set aside) the failed batch; keep the rows after it for the next replay
+                self._rewrite_replay(rows[start + self.batch_size:])
+                return
+        os.remove(self.replay_path)
+
+    def _rewrite_replay(self, rows: list):
+        temporary = self.replay_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as replay:
+            for row in rows:
+                replay.write(json.dumps(row) + "\n")
+            replay.flush()
+            os.fsync(replay.fileno())
+        os.replace(temporary, self.replay_path)
+
+    def stats(self) -> dict:
+        return {"buffered": self._buffer.qsize(), "written": self.written, "journaled": self.journaled}
@@ -0,0 +1,45 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import app
+from admission import AdmissionController
+
+GENERATION_SECONDS = 1.0
+
+
+def _slow_generate(*args):
+    time.sleep(GENERATION_SECONDS)
+    return "ok"
+
+
+async def _flood(requests: int) -> list:
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        async def call():
+            started = time.monotonic()
+            response = await client.post("/infer", json={"input_text": "hi", "parameters": {"cache": False}})
+            return response.status_code, time.monotonic() - started, response.headers.get("Retry-After")
+        return await asyncio.gather(*[call() for _ in range(requests)])
+
+
+def test_full_wait_queue_is_rejected_immediately(monkeypatch):
+    # 2 running + 4 waiting; the other 24 requests must get 429 straight away, not after queueing for a thread.
+    # The executor only has threads for the running generations, so waiting requests must not hold one.
+    monkeypatch.setattr(app, "admission", AdmissionController(2, max_waiting=4, max_wait_s=30))
+    monkeypatch.setattr(app, "inference_executor", ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(app, "ncos_pipeline", object())
+    monkeypatch.setattr(app, "inference_pool", None)
+    monkeypatch.setattr(app, "generate_text", _slow_generate)
+
+    results = asyncio.run(_flood(30))
+
+    rejected = [(seconds, retry_after) for status, seconds, retry_after in results if status == 429]
+    served = [seconds for status, seconds, _ in results if status == 200]
+    assert len(rejected) == 24
+    assert len(served) == 6
+    assert all(seconds < GENERATION_SECONDS / 2 for seconds, _ in rejected)
+    assert all(retry_after is not None for _, retry_after in rejected)
+    assert app.admission.stats()["running"] == 0
@@ -0,0 +1,36 @@
+# Standalone queue worker: loads the model and consumes jobs from the Redis stream without serving HTTP.
+# Run as many of these as needed (`python worker.py`) and set RUN_QUEUE_CONSUMERS=false on the API replicas,
+# so API capacity and inference capacity scale independently. Configuration is read from the same
+# environment variables as app.py.
+import logging
+import os
+import signal
+import sys
+import threading
+
+os.environ["RUN_QUEUE_CONSUMERS"] = "true"
+os.environ.setdefault("NCOS_PROCESS_ROLE", "worker")
+
+import app
+
+logger = logging.getLogger("ncos-backend")
+
+def main() -> int:
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    app.model_lifecycle.start()
+    while not stop.wait(1.0):
+        if app.model_lifecycle.error:
+            logger.error("Worker exiting: model failed to load.")
+            return 1
+    logger.info("Shutting down worker, finishing in-flight jobs.")
+    app.stop_job_workers()
+    if app.inference_pool is not None:
+        app.inference_pool.close()
+    for sink in app.result_sinks:
+        sink.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
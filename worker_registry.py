@@ -0,0 +1,159 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import redis
+
+logger = logging.getLogger("ncos-backend")
+
+
+class ThroughputMeter:
+    """
+    Counts jobs processed by this process and their rate over the last window_s seconds.
+    """
+
+    def __init__(self, window_s: float = 60.0):
+        self.window_s = window_s
+        self._lock = threading.Lock()
+        self._finished = deque()  # (finished_at, seconds) of jobs in the window
+        self._started_at = time.monotonic()
+        self.busy = 0
+        self.done = 0
+        self.failed = 0
+
+    def started(self):
+        with self._lock:
+            self.busy += 1
+
+    def finished(self, ok: bool, seconds: float):
+        now = time.monotonic()
+        with self._lock:
+            self.busy -= 1
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+            self._finished.append((now, seconds))
+            self._trim_locked(now)
+
+    def _trim_locked(self, now: float):
+        while self._finished and self._finished[0][0] < now - self.window_s:
+            self._finished.popleft()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._trim_locked(now)
+            recent = list(self._finished)
+            window = min(self.window_s, max(now - self._started_at, 1e-3))
+            return {
+                "busy": self.busy,
+                "jobs_done": self.done,
+                "jobs_failed": self.failed,
+                "jobs_per_s": round(len(recent) / window, 3),
+                "avg_job_seconds": round(sum(seconds for _, seconds in recent) / len(recent), 3) if recent else None,
+            }
+
+
+class WorkerHeartbeat:
+    """
+    Publishes this process's consumer capacity to Redis every interval_s seconds.
+
+    Each process writes a hash `<prefix><worker_id>` that expires after ttl_s, and
+    keeps its id in the `<prefix>index` sorted set scored by the last heartbeat, so
+    dead workers drop out on their own once they stop refreshing. info() is called
+    on every beat and should return a JSON-serializable dict (loaded models, throughput, ...).
+    """
+
+    def __init__(self, redis_client, worker_id: str, info, prefix: str = "ncos_worker:",
+                 interval_s: float = 5.0, ttl_s: int = 30):
+        self.redis = redis_client
+        self.worker_id = worker_id
+        self.info = info
+        self.prefix = prefix
+        self.interval_s = interval_s
+        self.ttl_s = ttl_s
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def key(self) -> str:
+        return self.prefix + self.worker_id
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="worker-heartbeat", daemon=True)
+        self._thread.start()
+
+    def beat(self):
+        now = time.time()
+        fields = {"worker_id": self.worker_id, "last_seen": now, **self.info()}
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self.key)
+        pipe.hset(self.key, mapping={name: json.dumps(value) for name, value in fields.items()})
+        pipe.expire(self.key, self.ttl_s)
+        pipe.zadd(self.prefix + "index", {self.worker_id: now})
+        pipe.execute()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.beat()
+            except Exception as e:
+                logger.warning(f"Worker heartbeat failed: {e}")
+            self._stopped.wait(self.interval_s)
+
+    def stop(self):
+        """
+        Stop beating and remove this worker from the registry right away.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_s + 1)
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(self.key)
+            pipe.zrem(self.prefix + "index", self.worker_id)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Failed to deregister worker {self.worker_id}: {e}")
+
+
+def list_workers(redis_client, prefix: str = "ncos_worker:", ttl_s: int = 30) -> list:
+    """
+    Return the heartbeat records of all live workers, most recently seen first.
+    Index entries older than ttl_s are pruned.
+    """
+    index = prefix + "index"
+    cutoff = time.time() - ttl_s
+    redis_client.zremrangebyscore(index, "-inf", cutoff)
+    worker_ids = redis_client.zrevrangebyscore(index, "+inf", cutoff)
+    pipe = redis_client.pipeline(transaction=False)
+    for worker_id in worker_ids:
+        pipe.hgetall(prefix + worker_id.decode("utf-8"))
+    return _decode_workers(pipe.execute())
+
+
+async def alist_workers(redis_client, prefix: str = "ncos_worker:", ttl_s: int = 30) -> list:
+    """
+    Coroutine version of list_workers for a redis.asyncio client.
+    """
+    index = prefix + "index"
+    cutoff = time.time() - ttl_s
+    await redis_client.zremrangebyscore(index, "-inf", cutoff)
+    worker_ids = await redis_client.zrevrangebyscore(index, "+inf", cutoff)
+    pipe = redis_client.pipeline(transaction=False)
+    for worker_id in worker_ids:
+        pipe.hgetall(prefix + worker_id.decode("utf-8"))
+    return _decode_workers(await pipe.execute())
+
+
+def _decode_workers(results: list) -> list:
+    workers = []
+    for fields in results:
+        if fields:
+            workers.append({name.decode("utf-8"): json.loads(value) for name, value in fields.items()})
+    return workers